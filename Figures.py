@@ -29,7 +29,6 @@ import matplotlib.pyplot as plt
 import datetime
 from matplotlib.ticker import (AutoMinorLocator)
 import string
-import pickle
 
 # Bangkok Subsidence Model Package
 import bkk_sub_gw
@@ -57,7 +56,7 @@ plt.rc("legend", fontsize=6)  # fontsize of the legend
 # Reading in data
 sheet = "EstTotalPump_54-60_Int50"
 pumppath = "inputs\\BasinPumping.xlsx"
-pump_2020 = pd.read_excel(pumppath, sheet_name=sheet)
+pump_2020 = bkk_sub_gw.bkk_cache.read_excel(pumppath, sheet_name=sheet)
 
 # Xticks
 x = pd.date_range(start=pump_2020.Date[0],
@@ -79,7 +78,7 @@ Wellnest_name = "LCBKK013"
 well_name = "PD32"
 well_path = "inputs\\"
 full_path = os.path.join(well_path, Wellnest_name + ".xlsx")
-data = pd.read_excel(full_path, skiprows=3)
+data = bkk_sub_gw.bkk_cache.read_excel(full_path, skiprows=3)
 all_head_data, gw_well_head = mfs.GW_Data_Process(data, well_name)
 
 # CORRECTING GW HEAD DATA TO LAND SURFACE (COASTAL DEM 2.1)
@@ -87,10 +86,10 @@ landsurf_path = os.path.join(well_path,
                              "LandSurfElev_GWWellLocs.xlsx")
 
 # Each well nest has its own Ss and K sheet
-landsurf_data = pd.read_excel(landsurf_path,
-                              sheet_name="2.1",
-                              usecols="C:F",
-                              index_col=0)
+landsurf_data = bkk_sub_gw.bkk_cache.read_excel(landsurf_path,
+                                                sheet_name="2.1",
+                                                usecols="C:F",
+                                                index_col=0)
 
 gw_well_head.Head += (landsurf_data.RASTERVALU.loc[Wellnest_name])
 # Adding years and annual average heads
@@ -108,40 +107,10 @@ axs[1].tick_params(axis='both', which='major', labelsize=8)
 axs[1].set_title("Measured Groundwater Levels",
                  fontsize=12)
 axs[1].grid(True, linestyle="dotted")
-loc = os.path.join(os.path.abspath("inputs"), "SurveyingLevels.xlsx")
 
-subdata = pd.read_excel(loc, sheet_name=Wellnest_name+"_Leveling",
-                        index_col=3)
-subdata = pd.DataFrame(subdata)
-subdata.index = pd.to_datetime(subdata.index)
-
-# Getting rid of benchmarks outside time period
-subdata = subdata[(subdata.Year <= 2020)]
-
-# Benchmarks should start at 0 at the first year.
-bench = subdata.loc[:, subdata.columns.str.contains("Land")]
-bench = bench.fillna(0)
-
-if (bench.iloc[0] != 0).any():
-    bench.iloc[0] = 0
-
-# IMPORTANT INFO
-# For benchmark measurements, the first year is 0, the second year is
-# the compaction rate over that first year.
-# For implicit Calc, the first year has a compaction rate over that
-# year, so to shift benchmarks value to the previouse year to match
-# Index has the right years
-bench.index = bench.index.shift(-1, freq="D")
-bench["date"] = bench.index
-
-# Gets the last date of each year
-lastdate = bench.groupby(pd.DatetimeIndex(bench["date"]).year,
-                         as_index=False).agg({"date": max}).reset_index(drop=True)
-bench = bench.loc[lastdate.date]
-
-leveling = bench[
-    bench.columns[
-        bench.columns.str.contains("Land")].item()]
+# Annual benchmark rates (cm/yr) at the end of each year
+leveling = bkk_sub_gw.bkk_sub.load_benchmarks().leveling(
+    Wellnest_name).fillna(0)
 
 leveling[leveling == 0] = np.nan
 axs[2].bar(leveling.index, -leveling.values, color="orange", width=300)
@@ -200,15 +169,15 @@ plt.rcParams["legend.title_fontsize"] = 6  # fontsize of legend title
 # Reading in data
 sheet = "EstTotalPump_54-60_Int50"
 full_path = os.path.join(os.path.abspath("inputs"), "BasinPumping.xlsx")
-pump_50 = pd.read_excel(full_path, sheet_name=sheet)
+pump_50 = bkk_sub_gw.bkk_cache.read_excel(full_path, sheet_name=sheet)
 sheet = "EstTotalPump_54-60_IntF25"
-pump_25 = pd.read_excel(full_path, sheet_name=sheet)
+pump_25 = bkk_sub_gw.bkk_cache.read_excel(full_path, sheet_name=sheet)
 sheet = "EstTotalPump_54-60_IntF100"
-pump_100 = pd.read_excel(full_path, sheet_name=sheet)
+pump_100 = bkk_sub_gw.bkk_cache.read_excel(full_path, sheet_name=sheet)
 sheet = "EstTotalPump_54-60_IntF50_25"
-pump_50_25 = pd.read_excel(full_path, sheet_name=sheet)
+pump_50_25 = bkk_sub_gw.bkk_cache.read_excel(full_path, sheet_name=sheet)
 sheet = "EstTotalPump_54-60_IntF0"
-pump_0 = pd.read_excel(full_path, sheet_name=sheet)
+pump_0 = bkk_sub_gw.bkk_cache.read_excel(full_path, sheet_name=sheet)
 
 # Plotting
 fig, axs = plt.subplots(3, 1, figsize=(3.2, 7), dpi=300, sharex=True)
@@ -234,16 +203,14 @@ axs[0].set_ylabel("Pumping Rate\n(m$^3$/day)")
 
 # Plotting Groundwater forecasts
 modelpath = os.path.abspath("models")
-# Model files
-modelfiles = os.listdir(modelpath)
 Wellnest_name = "LCBKK013"
 well_name = "PD32"
-wellmodel = [s for s in modelfiles
-             if np.logical_and(Wellnest_name in s, well_name in s)][0]
+wellmodel = bkk_sub_gw.bkk_catalog.load_catalog(
+    models_path=modelpath).model_file(Wellnest_name, well_name)
 model = ps.io.load(modelpath + "\\" + wellmodel)
 pump_rfunc = ps.Gamma()
 pumppath = os.path.join(os.path.abspath("inputs"), "BasinPumping.xlsx")
-EstTotPump = pd.read_excel(full_path, sheet_name=sheet)
+EstTotPump = bkk_sub_gw.bkk_cache.read_excel(full_path, sheet_name=sheet)
 pumpsheet = "EstTotalPump_54-60_Int50"
 
 # Original pumping scenario 500,000 m3/day
@@ -258,8 +225,8 @@ optiparam = model.parameters["optimal"]
 stdparam = model.parameters["stderr"]
 model.del_stressmodel("well")
 pumpsheet = "EstTotalPump_54-60_IntF25"
-EstTotPump = pd.read_excel(pumppath, sheet_name=pumpsheet, index_col=0,
-                           parse_dates=["Date"])
+EstTotPump = bkk_sub_gw.bkk_cache.read_excel(pumppath, sheet_name=pumpsheet,
+                                             index_col=0, parse_dates=["Date"])
 EstTotPump_ = ps.StressModel(EstTotPump.Pump, rfunc=pump_rfunc, name="well",
                              settings="well", up=False)
 model.add_stressmodel(EstTotPump_)
@@ -274,8 +241,8 @@ optiparam = model.parameters["optimal"]
 stdparam = model.parameters["stderr"]
 model.del_stressmodel("well")
 pumpsheet = "EstTotalPump_54-60_IntF100"
-EstTotPump = pd.read_excel(pumppath, sheet_name=pumpsheet, index_col=0,
-                           parse_dates=["Date"])
+EstTotPump = bkk_sub_gw.bkk_cache.read_excel(pumppath, sheet_name=pumpsheet,
+                                             index_col=0, parse_dates=["Date"])
 EstTotPump_ = ps.StressModel(EstTotPump.Pump, rfunc=pump_rfunc, name="well",
                              settings="well", up=False)
 model.add_stressmodel(EstTotPump_)
@@ -290,8 +257,8 @@ optiparam = model.parameters["optimal"]
 stdparam = model.parameters["stderr"]
 model.del_stressmodel("well")
 pumpsheet = "EstTotalPump_54-60_IntF50_25"
-EstTotPump = pd.read_excel(pumppath, sheet_name=pumpsheet, index_col=0,
-                           parse_dates=["Date"])
+EstTotPump = bkk_sub_gw.bkk_cache.read_excel(pumppath, sheet_name=pumpsheet,
+                                             index_col=0, parse_dates=["Date"])
 EstTotPump_ = ps.StressModel(EstTotPump.Pump, rfunc=pump_rfunc, name="well",
                              settings="well", up=False)
 model.add_stressmodel(EstTotPump_)
@@ -306,8 +273,8 @@ optiparam = model.parameters["optimal"]
 stdparam = model.parameters["stderr"]
 model.del_stressmodel("well")
 pumpsheet = "EstTotalPump_54-60_IntF0"
-EstTotPump = pd.read_excel(pumppath, sheet_name=pumpsheet, index_col=0,
-                           parse_dates=["Date"])
+EstTotPump = bkk_sub_gw.bkk_cache.read_excel(pumppath, sheet_name=pumpsheet,
+                                             index_col=0, parse_dates=["Date"])
 EstTotPump_ = ps.StressModel(EstTotPump.Pump, rfunc=pump_rfunc, name="well",
                              settings="well", up=False)
 model.add_stressmodel(EstTotPump_)
@@ -339,19 +306,8 @@ wellnestlist = ["LCBKK013"]
 tmin = "1978"
 tmax = "2060"
 
-# Reading in thickness and storage data
-path = os.path.join(os.path.abspath("inputs"), "SUBParameters.xlsx")
-Thick_data = pd.read_excel(path, sheet_name="Thickness",
-                           index_col=0)  # Thickness
-Sskv_data = pd.read_excel(path,
-                          sheet_name="Sskv",
-                          index_col=0)  # Sskv
-Sske_data = pd.read_excel(path,
-                          sheet_name="Sske",
-                          index_col=0)  # Ssk
-K_data = pd.read_excel(path,
-                       sheet_name="K",
-                       index_col=0)  # K
+# Thickness, K and storage of clays and aquifers, read once
+params = bkk_sub_gw.bkk_sub.load_parameters()
 
 # Mode can be "raw" as in raw groundwater data vs "Pastas" for importing Pastas
 # simulated groundwater in the aquifers
@@ -396,10 +352,7 @@ for pumpsheet in pumpsheets:
         bkk_sub.bkk_subsidence(wellnestlist,
                                mode, tmin,
                                tmax,
-                               Thick_data,
-                               K_data,
-                               Sskv_data,
-                               Sske_data,
+                               params,
                                CC=CC,
                                Nz=node_num,
                                ic_run=True,
@@ -575,12 +528,13 @@ Wellnest_name = ["LCBKK013"]
 # Total path
 tot_path = os.path.abspath("inputs")
 
+# Well nests, wells and model files
+catalog = bkk_sub_gw.bkk_catalog.load_catalog(tot_path, modelpath)
+
 # All well nest list
 if list_wellnest_flag == 1:
 
-    files = os.listdir(tot_path)
-    files = [i.replace(".xlsx", "") for i in files
-             if i.startswith("LC") and "_" not in i]
+    files = catalog.wellnests()
 
 else:
     files = Wellnest_name
@@ -605,7 +559,7 @@ for Wellnest_name in files:
 
     # Reading in groundwater data
     full_path = os.path.join(tot_path, Wellnest_name + ".xlsx")
-    data = pd.read_excel(full_path, skiprows=3)
+    data = bkk_sub_gw.bkk_cache.read_excel(full_path, skiprows=3)
 
     # For all wells in well nest
     for wells in data.columns[-(len(data.columns)-2):]:
@@ -613,16 +567,13 @@ for Wellnest_name in files:
         # Name of well as a string
         well_name = wells
 
-        # Model files
-        modelfiles = os.listdir(modelpath)
-
         # If file exists:
         try:
 
             # Load existing model
-            wellmodel = [s for s in modelfiles
-                         if np.logical_and(Wellnest_name in s,
-                                           well_name in s)][0]
+            wellmodel = catalog.model_file(Wellnest_name, well_name)
+            if wellmodel is None:
+                raise FileNotFoundError(Wellnest_name + "_" + well_name)
             model = ps.io.load(modelpath + "/" + wellmodel)
 
             # Gets time min and max from file name
@@ -642,8 +593,10 @@ for Wellnest_name in files:
             # Adding new pumping stress time series
             # If the same pumping stress time series, then
             # optimal parameters are the same
-            EstTotPump = pd.read_excel(pumppath, sheet_name=pumpsheet,
-                                       index_col=0, parse_dates=["Date"])
+            EstTotPump = bkk_sub_gw.bkk_cache.read_excel(pumppath,
+                                                         sheet_name=pumpsheet,
+                                                         index_col=0,
+                                                         parse_dates=["Date"])
             EstTotPump_ = ps.StressModel(EstTotPump.Pump, rfunc=pump_rfunc,
                                          name="well", settings="well",
                                          up=False)
@@ -691,142 +644,101 @@ for Wellnest_name in files:
                                                califlag=califlag)
 
 # NEW MODEL
-# Creating (0) or importing (1)
-importing = 0
-
-# If saving model
-saving = 1
-
 # For well nest BKK013 (in paper) = LCBKK013
 wellnestlist = ["LCBKK013"]
 
-# If creating results for first time
-if importing == 0:
-
-    tmin = "1978"
-    tmax = "2020"
-
-    # Reading in thickness and storage data
-    path = os.path.join(os.path.abspath("inputs"), "SUBParameters.xlsx")
-    Thick_data = pd.read_excel(path, sheet_name="Thickness",
-                               index_col=0)  # Thickness
-    Sskv_data = pd.read_excel(path,
-                              sheet_name="Sskv",
-                              index_col=0)  # Sskv
-    Sske_data = pd.read_excel(path,
-                              sheet_name="Sske",
-                              index_col=0)  # Ssk
-    K_data = pd.read_excel(path,
-                           sheet_name="K",
-                           index_col=0)  # K
-
-    # Mode can be "raw" as in raw groundwater data vs "Pastas" for importing Pastas
-    # simulated groundwater in the aquifers
-    mode = "Pastas"
-
-    # If mode is Pastas, need model path
-    if mode == "Pastas":
+tmin = "1978"
+tmax = "2020"
 
-        mpath = os.path.abspath("models")
+# Thickness, K and storage of clays and aquifers, read once
+params = bkk_sub_gw.bkk_sub.load_parameters()
 
-    # Pumping flag, for PASTAS, if changing pumping scenario
-    pumpflag = 1
-    # If changing pumping scenario, need pumping sheet/path
-    if pumpflag == 1:
+# Mode can be "raw" as in raw groundwater data vs "Pastas" for importing Pastas
+# simulated groundwater in the aquifers
+mode = "Pastas"
 
-        ppath = os.path.join(os.path.abspath("inputs"), "BasinPumping.xlsx")
-        psheet = "EstTotalPump_54-60_Int50Syn2"
+# If mode is Pastas, need model path
+if mode == "Pastas":
 
-    # Convergence criteria
-    CC = 1 * 10**-5
+    mpath = os.path.abspath("models")
 
-    # Number of nodes in clay
-    node_num = 10
+# Pumping flag, for PASTAS, if changing pumping scenario
+pumpflag = 1
+# If changing pumping scenario, need pumping sheet/path
+if pumpflag == 1:
 
-    # Using available heads as proxy for missing
-    proxyflag = 1
+    ppath = os.path.join(os.path.abspath("inputs"), "BasinPumping.xlsx")
+    psheet = "EstTotalPump_54-60_Int50Syn2"
 
-    # Calculates subsidence
-    all_results, sub_total, subv_total = bkk_sub_gw.\
-        bkk_sub.bkk_subsidence(wellnestlist,
-                               mode, tmin,
-                               tmax,
-                               Thick_data,
-                               K_data,
-                               Sskv_data,
-                               Sske_data,
-                               CC=CC,
-                               Nz=node_num,
-                               ic_run=True,
-                               proxyflag=proxyflag,
-                               pumpflag=pumpflag,
-                               pump_path=ppath,
-                               pump_sheet=psheet,
-                               model_path=mpath)
+# Convergence criteria
+CC = 1 * 10**-5
 
-    # Post process data
-    sub_total, subv_total, ann_sub, \
-        avgsub = bkk_sub_gw.bkk_sub.bkk_postproc(wellnestlist,
-                                                 sub_total,
-                                                 subv_total,
-                                                 all_results)
-
-    # Dictionary to store everything
-    model_subSYN2 = {"wellnestlist": wellnestlist,
-                     "all_results": all_results,
-                     "sub_total": sub_total,
-                     "subv_total": subv_total,
-                     "ann_sub": ann_sub,
-                     "avgsub": avgsub,
-                     "tmin": tmin,
-                     "tmax": tmax,
-                     "Thick_data": Thick_data,
-                     "Sske_data": Sske_data,
-                     "Sskv_data": Sskv_data,
-                     "K_data": K_data,
-                     "pumping_scenario": psheet,
-                     "CC": CC,
-                     "clay_nodes": node_num,
-                     "proxyflag": proxyflag,
-                     "mode": mode}
-
-    # If saving model
-    if saving == 1:
-
-        # Path to save models
-        path = os.path.abspath("models")
-
-        # Saving dict for this model
-        afile = open(path + "\\LCBKK013_subSyn2.pkl", "wb")
-        pickle.dump(model_subSYN2, afile)
-        afile.close()
-
-# if importing subsidence model results
-else:
+# Number of nodes in clay
+node_num = 10
 
-    # Path to import models
-    path = os.path.abspath("models")
+# Using available heads as proxy for missing
+proxyflag = 1
 
-    # Reload object from file
-    file2 = open(path + "\\" + wellnestlist[0] + "_subSyn2.pkl", "rb")
-    model_sub = pickle.load(file2)
-    file2.close()
+# Calculates subsidence
+all_results, sub_total, subv_total = bkk_sub_gw.\
+    bkk_sub.bkk_subsidence(wellnestlist,
+                           mode, tmin,
+                           tmax,
+                           params,
+                           CC=CC,
+                           Nz=node_num,
+                           ic_run=True,
+                           proxyflag=proxyflag,
+                           pumpflag=pumpflag,
+                           pump_path=ppath,
+                           pump_sheet=psheet,
+                           model_path=mpath,
+                           run_cache=bkk_sub_gw.bkk_cache.RunCache(
+                               os.path.abspath("cache/runs")))
+
+# Post process data
+sub_total, subv_total, ann_sub, \
+    avgsub = bkk_sub_gw.bkk_sub.bkk_postproc(wellnestlist,
+                                             sub_total,
+                                             subv_total,
+                                             all_results)
+
+# Dictionary to store everything
+model_subSYN2 = {"wellnestlist": wellnestlist,
+                 "all_results": all_results,
+                 "sub_total": sub_total,
+                 "subv_total": subv_total,
+                 "ann_sub": ann_sub,
+                 "avgsub": avgsub,
+                 "tmin": tmin,
+                 "tmax": tmax,
+                 "Thick_data": params.frame("Thickness"),
+                 "Sske_data": params.frame("Sske"),
+                 "Sskv_data": params.frame("Sskv"),
+                 "K_data": params.frame("K"),
+                 "pumping_scenario": psheet,
+                 "CC": CC,
+                 "clay_nodes": node_num,
+                 "proxyflag": proxyflag,
+                 "mode": mode}
+
+# Saving dict for this model
+bkk_sub_gw.bkk_results.ResultStore(
+    os.path.join(os.path.abspath("models"), "results")).append(
+        "LCBKK013_subSyn2", model_subSYN2)
 
 # OG MODEL
 
-# If saving model
-saving = 0
-
 # For well nest BKK013 (in paper) = LCBKK013
 wellnestlist = ["LCBKK013"]
 
 # Path to import models
 path = os.path.abspath("models")
 
-# Reload object from file
-file2 = open(path + "\\" + wellnestlist[0] + "_sub.pkl", "rb")
-model_sub = pickle.load(file2)
-file2.close()
+# Reload object from store (read when used)
+model_sub = bkk_sub_gw.bkk_results.open_results(
+    bkk_sub_gw.bkk_results.ResultStore(os.path.join(path, "results")),
+    wellnestlist[0] + "_sub", os.path.join(path, wellnestlist[0] + "_sub.pkl"))
 
 # Plotting
 # path to save figures
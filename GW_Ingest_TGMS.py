@@ -0,0 +1,77 @@
+# ##############################################################################
+"""Ingesting new groundwater observations exported from the TGMS portal.
+
+Thai GW data from http://tgms.dgr.go.th/
+Each export (same format as inputs/LC*.xlsx, one well nest per file) is added
+to the observation store; only rows after the last date already ingested for
+the well nest are processed and appended
+Inputs: TGMS excel exports
+Outputs: observation store (inputs/observations), outlier masks of each well,
+first new date of each well nest
+
+Article Title: Hybrid data-driven, physics-based modeling of ground-
+water and subsidence with application to Bangkok, Thailand
+
+Jenny Soonthornrangsan 2023
+TU Delft
+
+"""
+# ##############################################################################
+
+###############################################################################
+# import statements
+###############################################################################
+
+# Importing packages and libraries
+import os
+import warnings
+
+# Bangkok Subsidence Model Package
+import bkk_sub_gw
+
+# Ignoring openpyxl warnings
+warnings.simplefilter(action="ignore", category=UserWarning)
+
+# Changing current directory to locaiton of python script
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+# %%###########################################################################
+# Ingest settings
+###############################################################################
+
+# Folder of the observation store
+store_path = os.path.join(os.path.abspath("inputs"), "observations")
+
+# Folder of the TGMS exports
+export_path = os.path.abspath("inputs")
+
+# Getting a list of all the exports
+files = [os.path.join(export_path, i) for i in os.listdir(export_path)
+         if i.startswith("LC") and "_" not in i and i.endswith(".xlsx")]
+
+###############################################################################
+# Ingesting
+###############################################################################
+
+store = bkk_sub_gw.bkk_ingest.ObservationStore(store_path)
+
+# First new date of each well nest with new observations
+changed = {}
+
+for file in sorted(files):
+
+    changed_from = bkk_sub_gw.bkk_ingest.ingest_tgms(store, file)
+
+    if changed_from is not None:
+        changed[os.path.splitext(os.path.basename(file))[0]] = changed_from
+
+# Screening all wells for outliers (only wells with new observations)
+masks = bkk_sub_gw.bkk_ingest.screen_outliers(store, window_size=5,
+                                              n_sigma=3.0)
+
+# First new date of each well nest. Cached raw mode subsidence runs (with
+# obs_store) are only recomputed if these observations are used up to the end
+# of their window; Pastas models calibrated on these well nests are not
+# updated
+for wellnest, changed_from in changed.items():
+    print(wellnest + ": new observations from " + str(changed_from.date()))
@@ -0,0 +1,87 @@
+# ##############################################################################
+"""Calibrating the Pastas models of all wells in Bangkok, Thailand in parallel.
+
+Same models as Pastas_ModelGraphs_1950-2020.py (import_model = 0), but all
+wells are solved at the same time on a process pool
+Calibration period: typically from 1978-2020 (based on data
+availability)
+Inputs: Basin-wide Pumping
+Outputs: Pastas models (.pas files), calibration statistics (.csv)
+Recalibration: warm started from the previous models (warm_start = True)
+
+Article Title: Hybrid data-driven, physics-based modeling of ground-
+water and subsidence with application to Bangkok, Thailand
+
+Jenny Soonthornrangsan 2023
+TU Delft
+
+"""
+# ##############################################################################
+
+###############################################################################
+# import statements
+###############################################################################
+
+# Importing packages and libraries
+import os
+import warnings
+
+# Bangkok Subsidence Model Package
+import bkk_sub_gw
+
+# Ignoring Pastas warnings
+warnings.simplefilter(action="ignore", category=FutureWarning)
+
+# Everything under main so that worker processes do not rerun the script
+if __name__ == "__main__":
+
+    # Changing current directory to locaiton of python script
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    # %%#######################################################################
+    # Pastas settings
+    ###########################################################################
+
+    # Folder to save models and calibration statistics
+    modelpath = os.path.abspath("models")
+    pumppath = os.path.join(os.path.abspath("inputs"), "BasinPumping.xlsx")
+    pumpsheet = "EstTotalPump_54-60_Int50"
+
+    # Calibration period
+    calitime_min = "1978"
+    calitime_max = "2005"
+
+    # Noise model
+    noise_TF = True
+
+    # Number of processes, None for all processors
+    n_jobs = None
+
+    # If continuing a stopped calibration, resume = True
+    resume = True
+
+    # If recalibrating from the optimal parameters of the previous models
+    # (e.g. after adding observations or changing calitime_max),
+    # warm_start = True
+    warm_start = False
+
+    # Getting a list of all the wells
+    # Total path
+    tot_path = os.path.abspath("inputs")
+
+    files = bkk_sub_gw.bkk_catalog.load_catalog(tot_path,
+                                                modelpath).wellnests()
+
+    ###########################################################################
+    # Calibrating
+    ###########################################################################
+
+    stats = bkk_sub_gw.bkk_calib.calibrate_wells(files, tot_path, modelpath,
+                                                 pumppath, pumpsheet,
+                                                 calitime_min, calitime_max,
+                                                 noise_TF=noise_TF,
+                                                 n_jobs=n_jobs,
+                                                 resume=resume,
+                                                 warm_start=warm_start)
+
+    print(stats[["file", "fit_time", "nfev", "rsq", "rmse"]].to_string())
@@ -22,7 +22,6 @@ TU Delft
 ###############################################################################
 
 # Importing packages and libraries
-import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 import pastas as ps
@@ -61,6 +60,7 @@ plt.rc("legend", fontsize=6)  # fontsize of the legend
 save_model = 0
 
 # If importing previous saved models, import_model = 1
+# (Pastas_Calibration_1950-2020.py calibrates all wells in parallel instead)
 import_model = 1
 
 # If saving graphs, save_graph = 1
@@ -106,12 +106,13 @@ Wellnest_name = ["LCBKK013"]
 # Total path
 tot_path = os.path.abspath("inputs")
 
+# Well nests, wells and model files
+catalog = bkk_sub_gw.bkk_catalog.load_catalog(tot_path, modelpath)
+
 # All well nest list
 if list_wellnest_flag == 1:
 
-    files = os.listdir(tot_path)
-    files = [i.replace(".xlsx", "") for i in files
-             if i.startswith("LC") and "_" not in i]
+    files = catalog.wellnests()
 
 else:
     files = Wellnest_name
@@ -134,7 +135,7 @@ for Wellnest_name in files:
 
     # Reading in groundwater data
     full_path = os.path.join(tot_path, Wellnest_name + ".xlsx")
-    data = pd.read_excel(full_path, skiprows=3)
+    data = bkk_sub_gw.bkk_cache.read_excel(full_path, skiprows=3)
 
     # For all wells in well nest
     for wells in data.columns[-(len(data.columns)-2):]:
@@ -161,10 +162,10 @@ for Wellnest_name in files:
             # Reading in land surface elevation for each well nest
             landsurf_path = os.path.join(tot_path,
                                          "LandSurfElev_GWWellLocs.xlsx")
-            landsurf_data = pd.read_excel(landsurf_path,
-                                          sheet_name="2.1",
-                                          usecols="C:F",
-                                          index_col=0)
+            landsurf_data = bkk_sub_gw.bkk_cache.read_excel(landsurf_path,
+                                                            sheet_name="2.1",
+                                                            usecols="C:F",
+                                                            index_col=0)
 
             # Correcting head relative to 0 m to be head relative to a
             # global datum.
@@ -202,9 +203,9 @@ for Wellnest_name in files:
             # as land surface elevation
             SS_path = os.path.join(tot_path,
                                    "SS_Head_GWWellLocs.xlsx")
-            SS_data = pd.read_excel(SS_path,
-                                    sheet_name="SS_Py",
-                                    index_col=0)
+            SS_data = bkk_sub_gw.bkk_cache.read_excel(SS_path,
+                                                      sheet_name="SS_Py",
+                                                      index_col=0)
 
             # Getting steady state heads according to aquifer
             if "BK" in well_name:
@@ -238,8 +239,9 @@ for Wellnest_name in files:
 
                 # Daily interpolated and estimated pumping rates for the basin
                 # from simulated (Chula report)
-                EstTotPump = pd.read_excel(pumppath, sheet_name=pumpsheet,
-                                           index_col=0, parse_dates=["Date"])
+                EstTotPump = bkk_sub_gw.bkk_cache.read_excel(
+                    pumppath, sheet_name=pumpsheet, index_col=0,
+                    parse_dates=["Date"])
 
                 # Creating stress model
                 EstTotPump_ = ps.StressModel(EstTotPump.Pump, rfunc=pump_rfunc,
@@ -309,16 +311,13 @@ for Wellnest_name in files:
         # If importing Pastas model
         else:
 
-            # Model files
-            modelfiles = os.listdir(modelpath)
-
             # If file exists:
             try:
 
                 # Load existing model
-                wellmodel = [s for s in modelfiles
-                             if np.logical_and(Wellnest_name in s,
-                                               well_name in s)][0]
+                wellmodel = catalog.model_file(Wellnest_name, well_name)
+                if wellmodel is None:
+                    raise FileNotFoundError(Wellnest_name + "_" + well_name)
                 model = ps.io.load(modelpath + "/" + wellmodel)
 
                 # Gets time min and max from file name
@@ -335,8 +334,9 @@ for Wellnest_name in files:
                 # Adding new pumping stress time series
                 # If the same pumping stress time series, then
                 # optimal parameters are the same
-                EstTotPump = pd.read_excel(pumppath, sheet_name=pumpsheet,
-                                           index_col=0, parse_dates=["Date"])
+                EstTotPump = bkk_sub_gw.bkk_cache.read_excel(
+                    pumppath, sheet_name=pumpsheet, index_col=0,
+                    parse_dates=["Date"])
                 EstTotPump_ = ps.StressModel(EstTotPump.Pump, rfunc=pump_rfunc,
                                              name="well", settings="well",
                                              up=False)
@@ -25,7 +25,6 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import pastas as ps
 import os
-from mpl_toolkits.basemap import Basemap
 import bkk_sub_gw
 
 # Importing script for pre-processing Thai GW data
@@ -55,16 +54,13 @@ plt.rc("legend", fontsize=6)  # fontsize of the legend
 model_path = os.path.abspath("models")
 fig_path = os.path.abspath("figures")
 
-# Model files
-modelfiles = os.listdir(model_path)
-
 # Getting a list of all the wells
 # Total path
 tot_path = os.path.abspath("inputs")
 
-files = os.listdir(tot_path)
-files = [i.replace(".xlsx", "") for i in files
-         if i.startswith("LC") and "_" not in i]
+# Well nests, wells and model files
+catalog = bkk_sub_gw.bkk_catalog.load_catalog(tot_path, model_path)
+files = catalog.wellnests()
 
 # Preallocation
 # Saving RMSE values for time period
@@ -83,6 +79,10 @@ obs_range = []
 # Creating subsets of wells that fit certain criteria
 subset_well_dict = {}
 
+# Models and (well nest, well) names, for the skill of all models at once
+models = []
+model_names = []
+
 ###############################################################################
 # Pastas Import
 ###############################################################################
@@ -90,12 +90,8 @@ subset_well_dict = {}
 # For each well nest
 for Wellnest_name in files:
 
-    # Reading in groundwater data
-    full_path = os.path.join(tot_path, Wellnest_name + ".xlsx")
-    data = pd.read_excel(full_path, skiprows=3)
-
     # For all wells in well nest
-    for wells in data.columns[-(len(data.columns)-2):]:
+    for wells in catalog.wells(Wellnest_name):
 
         # Well name in as a string
         well_name = wells
@@ -103,23 +99,18 @@ for Wellnest_name in files:
         # Saving well nest and well name association
         subset_well_dict[well_name] = [Wellnest_name]
 
-        # If model file exists:
-        try:
-            wellmodel = [s for s in modelfiles
-                         if np.logical_and(Wellnest_name in s, well_name in s)][0]
-            model = ps.io.load(model_path + "/" + wellmodel)
+        wellmodel = catalog.model_file(Wellnest_name, well_name)
 
-            # If does not exist
-        except FileNotFoundError:
+        # If model file does not exist
+        if wellmodel is None:
             print("No model for " + Wellnest_name + "_" + well_name)
             continue
 
-        # Saving rmse
-        rmse_ = model.stats.rmse(tmin=time_min, tmax=time_max)
+        model = ps.io.load(model_path + "/" + wellmodel)
 
-        # Saving rmse
-        rmse.append(Wellnest_name)
-        rmse.extend((well_name, rmse_))
+        # Saving model
+        models.append(model)
+        model_names.append((Wellnest_name, well_name))
 
         # Saving pumping step response tmax
         res_tmax.append(Wellnest_name)
@@ -132,6 +123,16 @@ for Wellnest_name in files:
             tmin=time_min, tmax=time_max).max() - model.observations(
                 tmin=time_min, tmax=time_max).min()))
 
+# RMSE, NSE, KGE and bias of all models during the time period
+gw_skill = bkk_sub_gw.bkk_metrics.gw_skill(models, model_names,
+                                           tmin=time_min, tmax=time_max)
+
+# Saving rmse
+for Wellnest_name, well_name, rmse_ in zip(gw_skill.wellnest, gw_skill.well,
+                                           gw_skill.rmse):
+    rmse.append(Wellnest_name)
+    rmse.extend((well_name, rmse_))
+
 # Obs range
 # Overall
 overall_range = np.mean(obs_range[2::3])
@@ -195,7 +196,7 @@ NB_rmse = np.mean(temp_NBrmse)
 
 # Importing spatial coordinates
 full_path = os.path.join(tot_path, "GroundwaterWellLocs.xls")
-gwwell_locs = pd.read_excel(full_path)
+gwwell_locs = bkk_sub_gw.bkk_cache.read_excel(full_path)
 
 # Locations of wellnests removing duplicates
 gwwell_locs = gwwell_locs.drop_duplicates("WellNest_Name", keep="first")
@@ -280,9 +281,8 @@ data_lim = [min(np.array(cs)[~mfs.is_outlier(cs, 3.5)]),
 plt.set_cmap("coolwarm")  # Color map settings
 
 # Plots
-# Creating a basemap
-map = Basemap(llcrnrlon=100.3, llcrnrlat=13.4, urcrnrlon=100.8, urcrnrlat=14,
-              resolution="h", ellps="WGS84", lat_0=13.6, lon_0=100.4)
+# Basemap (built once, cached on disk)
+map = bkk_sub_gw.bkk_plotting.load_basemap()
 
 bkk_sub_gw.bkk_plotting.draw_basemap(map, xs, ys, d_dict, fig=fig, ax=ax,
                                      datalim=data_lim, mode="RMSE_full", save=0,
@@ -306,7 +306,7 @@ plt.savefig(full_figpath, bbox_inches="tight", format="eps")
 
 # Importing spatial coordinates
 full_path = os.path.join(tot_path, "GroundwaterWellLocs.xls")
-gwwell_locs = pd.read_excel(full_path)
+gwwell_locs = bkk_sub_gw.bkk_cache.read_excel(full_path)
 
 # Locations of wellnests; removing duplicates
 gwwell_locs = gwwell_locs.drop_duplicates("WellNest_Name", keep="first")
@@ -394,8 +394,7 @@ data_lim = [0, 18]
 plt.set_cmap("plasma")  # Color map colors
 
 # Plots
-map = Basemap(llcrnrlon=100.3, llcrnrlat=13.4, urcrnrlon=100.8, urcrnrlat=14,
-              resolution="h", ellps="WGS84", lat_0=13.6, lon_0=100.4)
+map = bkk_sub_gw.bkk_plotting.load_basemap()
 bkk_sub_gw.bkk_plotting.draw_basemap(map, xs, ys, d_dict, fig=fig, ax=ax,
                                      datalim=data_lim, mode="step_full", save=0,
                                      aq=aq, perc=0,
@@ -39,268 +39,418 @@ TU Delft
 import os
 import pandas as pd
 import numpy as np
-import pickle
 import datetime as dt
 import warnings
 
 # Bangkok Subsidence Model Package
 import bkk_sub_gw
 
-# Hampel filter
-from hampel import hampel
-
 # Ignoring Pastas warnings
 warnings.simplefilter(action="ignore", category=FutureWarning)
 
 # %%###########################################################################
-# Runs the functions to calculate subsidence at point locations in BKK
-# Main paper graph
+# Cache of Pastas simulated heads
 ##############################################################################
 
-# Creating (0) or importing (1)
-importing = 1
-
-# If saving model
-saving = 0
-
-# For well nest BKK013 (in paper) = LCBKK013
-wellnestlist = ["LCBKK013"]
+# Heads are only simulated once for each Pastas model, pumping scenario, and
+# time period. Runs that only change subsidence settings read them from disk
+head_cache = bkk_sub_gw.bkk_cache.HeadCache(os.path.abspath("cache/heads"))
 
-# If creating results for first time
-if importing == 0:
+# Warmup contributions of the Pastas models are the same for all pumping
+# scenarios and are only convolved once
+warmup_cache = bkk_sub_gw.bkk_cache.WarmupCache()
 
-    tmin = "1978"
-    tmax = "2020"
-
-    # Reading in thickness and storage data
-    path = os.path.join(os.path.abspath("inputs"), "SUBParameters.xlsx")
-    Thick_data = pd.read_excel(path, sheet_name="Thickness",
-                               index_col=0)  # Thickness
-    Sskv_data = pd.read_excel(path,
-                              sheet_name="Sskv",
-                              index_col=0)  # Sskv
-    Sske_data = pd.read_excel(path,
-                              sheet_name="Sske",
-                              index_col=0)  # Ssk
-    K_data = pd.read_excel(path,
-                           sheet_name="K",
-                           index_col=0)  # K
-
-    # Mode can be "raw" as in raw groundwater data vs "Pastas" for importing Pastas
-    # simulated groundwater in the aquifers
-    mode = "Pastas"
+# Results of bkk_subsidence are saved by a hash of all of its inputs (settings,
+# parameters, observations and Pastas models). Sections are always run and only
+# compute subsidence again if one of the inputs changed
+run_cache = bkk_sub_gw.bkk_cache.RunCache(os.path.abspath("cache/runs"))
 
-    # If mode is Pastas, need model path
-    if mode == "Pastas":
+# %%###########################################################################
+# Store of subsidence results
+##############################################################################
 
-        mpath = os.path.abspath("models")
+# Results of each run are saved as a scenario of the store and can be read one
+# well nest, layer and variable at a time
+result_store = bkk_sub_gw.bkk_results.ResultStore(
+    os.path.join(os.path.abspath("models"), "results"))
 
-    # Pumping flag, for PASTAS, if changing pumping scenario
-    pumpflag = 1
-    # If changing pumping scenario, need pumping sheet/path
-    if pumpflag == 1:
+# %%###########################################################################
+# Runs the functions to calculate subsidence at point locations in BKK
+# Main paper graph
+##############################################################################
 
-        ppath = os.path.join(os.path.abspath("inputs"), "BasinPumping.xlsx")
-        psheet = "EstTotalPump_54-60_Int50"
+# For well nest BKK013 (in paper) = LCBKK013
+wellnestlist = ["LCBKK013"]
 
-    # Convergence criteria
-    CC = 1 * 10**-5
 
-    # Number of nodes in clay
-    node_num = 10
+tmin = "1978"
+tmax = "2020"
+
+# Thickness, K and storage of clays and aquifers, read once
+params = bkk_sub_gw.bkk_sub.load_parameters()
+
+# Mode can be "raw" as in raw groundwater data vs "Pastas" for importing Pastas
+# simulated groundwater in the aquifers
+mode = "Pastas"
+
+# If mode is Pastas, need model path
+if mode == "Pastas":
+
+    mpath = os.path.abspath("models")
+
+# Pumping flag, for PASTAS, if changing pumping scenario
+pumpflag = 1
+# If changing pumping scenario, need pumping sheet/path
+if pumpflag == 1:
+
+    ppath = os.path.join(os.path.abspath("inputs"), "BasinPumping.xlsx")
+    psheet = "EstTotalPump_54-60_Int50"
+
+# Convergence criteria
+CC = 1 * 10**-5
+
+# Number of nodes in clay
+node_num = 10
+
+# Using available heads as proxy for missing
+proxyflag = 1
+
+# Calculates subsidence
+all_results, sub_total, subv_total = bkk_sub_gw.\
+    bkk_sub.bkk_subsidence(wellnestlist,
+                           mode, tmin,
+                           tmax,
+                           params,
+                           CC=CC,
+                           Nz=node_num,
+                           ic_run=True,
+                           proxyflag=proxyflag,
+                           pumpflag=pumpflag,
+                           pump_path=ppath,
+                           pump_sheet=psheet,
+                           model_path=mpath,
+                           head_cache=head_cache,
+                           run_cache=run_cache,
+                           warmup_cache=warmup_cache)
+
+# Post process data
+sub_total, subv_total, ann_sub, \
+    avgsub = bkk_sub_gw.bkk_sub.bkk_postproc(wellnestlist,
+                                             sub_total,
+                                             subv_total,
+                                             all_results)
+
+# Dictionary to store everything
+model_sub = {"wellnestlist": wellnestlist,
+             "all_results": all_results,
+             "sub_total": sub_total,
+             "subv_total": subv_total,
+             "ann_sub": ann_sub,
+             "avgsub": avgsub,
+             "tmin": tmin,
+             "tmax": tmax,
+             "Thick_data": params.frame("Thickness"),
+             "Sske_data": params.frame("Sske"),
+             "Sskv_data": params.frame("Sskv"),
+             "K_data": params.frame("K"),
+             "pumping_scenario": psheet,
+             "CC": CC,
+             "clay_nodes": node_num,
+             "proxyflag": proxyflag,
+             "mode": mode}
+
+# Saving dict for this model
+result_store.append("LCBKK013_sub", model_sub)
 
-    # Using available heads as proxy for missing
-    proxyflag = 1
+# Plotting
+# path to save figures
+path = os.path.abspath("figures")
 
-    # Calculates subsidence
-    all_results, sub_total, subv_total = bkk_sub_gw.\
-        bkk_sub.bkk_subsidence(wellnestlist,
-                               mode, tmin,
-                               tmax,
-                               Thick_data,
-                               K_data,
-                               Sskv_data,
-                               Sske_data,
-                               CC=CC,
-                               Nz=node_num,
-                               ic_run=True,
-                               proxyflag=proxyflag,
-                               pumpflag=pumpflag,
-                               pump_path=ppath,
-                               pump_sheet=psheet,
-                               model_path=mpath)
+###############################################################################
+# Plots Results: Bar graph for main paper for BKK013
+##############################################################################
 
-    # Post process data
-    sub_total, subv_total, ann_sub, \
-        avgsub = bkk_sub_gw.bkk_sub.bkk_postproc(wellnestlist,
-                                                 sub_total,
-                                                 subv_total,
-                                                 all_results)
+bkk_sub_gw.bkk_plotting.sub_bar(path, model_sub["wellnestlist"],
+                                annual_data=model_sub["ann_sub"],
+                                tmin=model_sub["tmin"],
+                                tmax=model_sub["tmax"], save=1,
+                                benchflag=1)
 
-    # Dictionary to store everything
-    model_sub = {"wellnestlist": wellnestlist,
-                 "all_results": all_results,
-                 "sub_total": sub_total,
-                 "subv_total": subv_total,
-                 "ann_sub": ann_sub,
-                 "avgsub": avgsub,
-                 "tmin": tmin,
-                 "tmax": tmax,
-                 "Thick_data": Thick_data,
-                 "Sske_data": Sske_data,
-                 "Sskv_data": Sskv_data,
-                 "K_data": K_data,
-                 "pumping_scenario": psheet,
-                 "CC": CC,
-                 "clay_nodes": node_num,
-                 "proxyflag": proxyflag,
-                 "mode": mode}
+# %%###########################################################################
+# Runs the functions to calculate subsidence at point locations in BKK
+# Appendix graphs
+##############################################################################
 
-    # If saving model
-    if saving == 1:
+# For each well nest
+wellnestlist = ["LCBKK003",
+                "LCBKK005",
+                "LCBKK006",
+                "LCBKK007",
+                "LCBKK009",
+                "LCBKK011",
+                "LCBKK012",
+                "LCBKK013",
+                "LCBKK014",
+                "LCBKK015",
+                "LCBKK016",
+                "LCBKK018",
+                "LCBKK020",
+                "LCBKK021",
+                "LCBKK026",
+                "LCBKK027",
+                "LCBKK036",
+                "LCBKK038",
+                "LCBKK041",
+                "LCNBI003",
+                "LCNBI007",
+                "LCSPK007",
+                "LCSPK009"]
 
-        # Path to save models
-        path = os.path.abspath("models")
+tmin = "1978"
+tmax = "2020"
+
+# Thickness, K and storage of clays and aquifers, read once
+params = bkk_sub_gw.bkk_sub.load_parameters()
+
+# Mode can be "raw" as in raw groundwater data vs "Pastas" for importing Pastas
+# simulated groundwater in the aquifers
+mode = "Pastas"
+
+# If mode is Pastas, need model path
+if mode == "Pastas":
+
+    mpath = os.path.abspath("models")
+
+# Pumping flag, for PASTAS, if changing pumping scenario
+pumpflag = 1
+# If changing pumping scenario, need pumping sheet/path
+if pumpflag == 1:
+
+    ppath = os.path.join(os.path.abspath("inputs"), "BasinPumping.xlsx")
+    psheet = "EstTotalPump_54-60_Int50"
+
+# Convergence criteria
+CC = 1 * 10**-5
+
+# Number of nodes in clay
+node_num = 10
+
+# Using available heads as proxy for missing
+proxyflag = 1
+
+# Contribution of each clay layer, collected while solving
+layer_stats = bkk_sub_gw.bkk_sub.LayerStats()
+
+# Calculates subsidence
+all_results, sub_total, subv_total = bkk_sub_gw.\
+    bkk_sub.bkk_subsidence(wellnestlist,
+                           mode, tmin,
+                           tmax,
+                           params,
+                           CC=CC,
+                           Nz=node_num,
+                           ic_run=True,
+                           proxyflag=proxyflag,
+                           pumpflag=pumpflag,
+                           pump_path=ppath,
+                           pump_sheet=psheet,
+                           model_path=mpath,
+                           head_cache=head_cache,
+                           run_cache=run_cache,
+                           warmup_cache=warmup_cache,
+                           layer_stats=layer_stats)
+
+# Post process data
+sub_total, subv_total, ann_sub, \
+    avgsub = bkk_sub_gw.bkk_sub.bkk_postproc(wellnestlist,
+                                             sub_total,
+                                             subv_total,
+                                             all_results)
+
+# Dictionary to store everything
+model_sub = {"wellnestlist": wellnestlist,
+             "all_results": all_results,
+             "sub_total": sub_total,
+             "subv_total": subv_total,
+             "ann_sub": ann_sub,
+             "avgsub": avgsub,
+             "tmin": tmin,
+             "tmax": tmax,
+             "Thick_data": params.frame("Thickness"),
+             "Sske_data": params.frame("Sske"),
+             "Sskv_data": params.frame("Sskv"),
+             "K_data": params.frame("K"),
+             "pumping_scenario": psheet,
+             "CC": CC,
+             "clay_nodes": node_num,
+             "proxyflag": proxyflag,
+             "mode": mode}
+
+# Saving dict for this model
+result_store.append("Allnests_sub", model_sub)
+
+# Contribution of each clay layer of each well nest, indexed by (wellnest,
+# layer) with layer 0 the clay above BK: shares, inelastic fraction and peak
+# subsidence rate and date
+layer_table = layer_stats.table()
 
-        # Saving dict for this model
-        afile = open(path + "\\LCBKK013_sub.pkl", "wb")
-        pickle.dump(model_sub, afile)
-        afile.close()
+# Average perc of each clay layer to total for all well nest
+BKClayavg, PDClayavg, NLClayavg, NBClayavg = \
+    layer_table.groupby("layer").avg_share.mean().values * 100
 
-# if importing subsidence model results
-else:
+list_ = ["LCBKK003", "LCBKK006", "LCBKK011", "LCBKK036", "LCBKK038"]
+in_list = layer_table.index.get_level_values("wellnest").isin(list_)
 
-    # Path to import models
-    path = os.path.abspath("models")
+# Average perc of each clay layer to total for well nests with BK
+BKClayavg_list1, PDClayavg_list1, NLClayavg_list1, NBClayavg_list1 = \
+    layer_table[in_list].groupby("layer").avg_share.mean().values * 100
 
-    # Reload object from file
-    file2 = open(path + "\\" + wellnestlist[0] + "_sub.pkl", "rb")
-    model_sub = pickle.load(file2)
-    file2.close()
+# Average perc of each clay layer to total for well nests without BK
+BKClayavg_list0, PDClayavg_list0, NLClayavg_list0, NBClayavg_list0 = \
+    layer_table[~in_list].groupby("layer").avg_share.mean().values * 100
+
+# Skill of annual subsidence against leveling for the years of the bar graphs
+# and of the RMSE map, with 95% bootstrap confidence intervals
+sub_skill = bkk_sub_gw.bkk_metrics.sub_skill(model_sub["ann_sub"],
+                                             model_sub["wellnestlist"],
+                                             [("1990", "2010"),
+                                              ("1978", "2020")],
+                                             n_boot=1000)
+print(sub_skill.groupby(["tmin", "tmax"])[
+    bkk_sub_gw.bkk_metrics.METRICS].mean())
 
 # Plotting
 # path to save figures
 path = os.path.abspath("figures")
 
-###############################################################################
-# Plots Results: Bar graph for main paper for BKK013
+# %%###########################################################################
+# Plots Results: Bar graph for appendix
 ##############################################################################
 
+# Figures of each well nest rendered on all processors
 bkk_sub_gw.bkk_plotting.sub_bar(path, model_sub["wellnestlist"],
-                                model_sub["all_results"],
-                                model_sub["sub_total"],
-                                model_sub["subv_total"],
-                                model_sub["ann_sub"],
+                                annual_data=model_sub["ann_sub"],
                                 tmin=model_sub["tmin"],
                                 tmax=model_sub["tmax"], save=1,
-                                benchflag=1)
+                                benchflag=1, skill=sub_skill, n_jobs=None)
 
 # %%###########################################################################
-# Runs the functions to calculate subsidence at point locations in BKK
-# Appendix graphs
+# Plots Results: Subsidence RMSE map for main paper
 ##############################################################################
 
-# Creating (0) or importing (1)
-importing = 1
-
-# If saving model
-saving = 0
-
-# If creating results for first time
-if importing == 0:
-
-    # For each well nest
-    wellnestlist = ["LCBKK003",
-                    "LCBKK005",
-                    "LCBKK006",
-                    "LCBKK007",
-                    "LCBKK009",
-                    "LCBKK011",
-                    "LCBKK012",
-                    "LCBKK013",
-                    "LCBKK014",
-                    "LCBKK015",
-                    "LCBKK016",
-                    "LCBKK018",
-                    "LCBKK020",
-                    "LCBKK021",
-                    "LCBKK026",
-                    "LCBKK027",
-                    "LCBKK036",
-                    "LCBKK038",
-                    "LCBKK041",
-                    "LCNBI003",
-                    "LCNBI007",
-                    "LCSPK007",
-                    "LCSPK009"]
+# Spatial map plotting
+bkk_sub_gw.bkk_plotting.sub_rmse_map(path, model_sub["wellnestlist"],
+                                     annual_data=model_sub["ann_sub"],
+                                     tmin=model_sub["tmin"],
+                                     tmax=model_sub["tmax"], save=1,
+                                     skill=sub_skill)
 
-    tmin = "1978"
-    tmax = "2020"
-
-    # Reading in thickness and storage data
-    path = os.path.join(os.path.abspath("inputs"), "SUBParameters.xlsx")
-    Thick_data = pd.read_excel(path, sheet_name="Thickness",
-                               index_col=0)  # Thickness
-    Sskv_data = pd.read_excel(path,
-                              sheet_name="Sskv",
-                              index_col=0)  # Sskv
-    Sske_data = pd.read_excel(path,
-                              sheet_name="Sske",
-                              index_col=0)  # Ssk
-    K_data = pd.read_excel(path,
-                           sheet_name="K",
-                           index_col=0)  # K
-
-    # Mode can be "raw" as in raw groundwater data vs "Pastas" for importing Pastas
-    # simulated groundwater in the aquifers
-    mode = "Pastas"
+# %%###########################################################################
+# Plots Results: Forecasts of cumulative subsidence (cm) for pumping scenarios
+##############################################################################
 
-    # If mode is Pastas, need model path
-    if mode == "Pastas":
+# All ann subs
+all_ann_subs = []
 
-        mpath = os.path.abspath("models")
+# For each well nest
+wellnestlist = ["LCBKK003",
+                "LCBKK005",
+                "LCBKK006",
+                "LCBKK007",
+                "LCBKK009",
+                "LCBKK011",
+                "LCBKK012",
+                "LCBKK013",
+                "LCBKK014",
+                "LCBKK015",
+                "LCBKK016",
+                "LCBKK018",
+                "LCBKK020",
+                "LCBKK021",
+                "LCBKK026",
+                "LCBKK027",
+                "LCBKK036",
+                "LCBKK038",
+                "LCBKK041",
+                "LCNBI003",
+                "LCNBI007",
+                "LCSPK007",
+                "LCSPK009"]
+tmin = "1978"
+tmax = "2110"
 
-    # Pumping flag, for PASTAS, if changing pumping scenario
-    pumpflag = 1
-    # If changing pumping scenario, need pumping sheet/path
-    if pumpflag == 1:
+# Mode can be "raw" as in raw groundwater data vs "Pastas" for importing Pastas
+# simulated groundwater in the aquifers
+mode = "Pastas"
 
-        ppath = os.path.join(os.path.abspath("inputs"), "BasinPumping.xlsx")
-        psheet = "EstTotalPump_54-60_Int50"
+# If mode is Pastas, need model path
+if mode == "Pastas":
 
-    # Convergence criteria
-    CC = 1 * 10**-5
+    mpath = os.path.abspath("models")
 
-    # Number of nodes in clay
-    node_num = 10
+# Pumping flag, for PASTAS, if changing pumping scenario
+pumpflag = 1
+# If changing pumping scenario, need pumping sheet/path
+if pumpflag == 1:
 
-    # Using available heads as proxy for missing
-    proxyflag = 1
+    ppath = os.path.join(os.path.abspath("inputs"), "BasinPumping.xlsx")
+
+    # Pumping sheets
+    pumpsheets = ["EstTotalPump_54-60_Int50",
+                  "EstTotalPump_54-60_IntF25",
+                  "EstTotalPump_54-60_IntF100",
+                  "EstTotalPump_54-60_IntF50_25",
+                  "EstTotalPump_54-60_IntF0"]
+
+    scenarios = ["500", "250", "100", "500_250", "0"]
+
+# Convergence criteria
+CC = 1 * 10**-5
+
+# Number of nodes in clay
+node_num = 10
+
+# Using available heads as proxy for missing
+proxyflag = 1
+
+# Thickness, K and storage of clays and aquifers, read once
+params = bkk_sub_gw.bkk_sub.load_parameters()
+
+# Daily heads of all models and pumping scenarios, simulated once
+head_archive = bkk_sub_gw.bkk_archive.build_head_archive(
+    os.path.abspath("cache/head_archive"), mpath, wellnestlist, ppath,
+    pumpsheets, tmax)
+
+# For each pumping scenario
+for index, pumpsheet in enumerate(pumpsheets):
 
     # Calculates subsidence
     all_results, sub_total, subv_total = bkk_sub_gw.\
         bkk_sub.bkk_subsidence(wellnestlist,
                                mode, tmin,
                                tmax,
-                               Thick_data,
-                               K_data,
-                               Sskv_data,
-                               Sske_data,
+                               params,
                                CC=CC,
                                Nz=node_num,
                                ic_run=True,
                                proxyflag=proxyflag,
                                pumpflag=pumpflag,
                                pump_path=ppath,
-                               pump_sheet=psheet,
-                               model_path=mpath)
+                               pump_sheet=pumpsheet,
+                               model_path=mpath,
+                               head_cache=head_cache,
+                               run_cache=run_cache,
+                               head_archive=head_archive,
+                               warmup_cache=warmup_cache)
 
     # Post process data
     sub_total, subv_total, ann_sub, \
-        avgsub = bkk_sub_gw.bkk_sub.bkk_postproc(wellnestlist,
-                                                 sub_total,
-                                                 subv_total,
-                                                 all_results)
+        _ = bkk_sub_gw.bkk_sub.bkk_postproc(wellnestlist,
+                                            sub_total,
+                                            subv_total,
+                                            all_results)
+
+    all_ann_subs.append(ann_sub)
 
     # Dictionary to store everything
     model_sub = {"wellnestlist": wellnestlist,
@@ -308,143 +458,78 @@ if importing == 0:
                  "sub_total": sub_total,
                  "subv_total": subv_total,
                  "ann_sub": ann_sub,
-                 "avgsub": avgsub,
                  "tmin": tmin,
                  "tmax": tmax,
-                 "Thick_data": Thick_data,
-                 "Sske_data": Sske_data,
-                 "Sskv_data": Sskv_data,
-                 "K_data": K_data,
-                 "pumping_scenario": psheet,
+                 "Thick_data": params.frame("Thickness"),
+                 "Sske_data": params.frame("Sske"),
+                 "Sskv_data": params.frame("Sskv"),
+                 "K_data": params.frame("K"),
+                 "pumping_scenario": scenarios[index],
                  "CC": CC,
                  "clay_nodes": node_num,
                  "proxyflag": proxyflag,
                  "mode": mode}
 
-    # If saving
-    if saving == 1:
-
-        # Path to save models
-        path = os.path.abspath("models")
-
-        # Saving dict for this model
-        afile = open(path + "\\Allnests_sub.pkl", "wb")
-        pickle.dump(model_sub, afile)
-        afile.close()
-
-# if importing subsidence model results
-else:
-
-    # Path to import models
-    path = os.path.abspath("models")
-
-    # Reload object from file
-    file2 = open(path + "\\Allnests_sub.pkl", "rb")
-    model_sub = pickle.load(file2)
-    file2.close()
-
-# Average perc of each clay layer to total for all well nest
-BKClayavg = np.average([i[2] for i in model_sub["avgsub"][0::4]])*100
-PDClayavg = np.average([i[2] for i in model_sub["avgsub"][1::4]])*100
-NLClayavg = np.average([i[2] for i in model_sub["avgsub"][2::4]])*100
-NBClayavg = np.average([i[2] for i in model_sub["avgsub"][3::4]])*100
-
-list_ = ["LCBKK003", "LCBKK006", "LCBKK011", "LCBKK036", "LCBKK038"]
-# Average perc of each clay layer to total for well nests with BK
-BKClayavg_list1 = np.average([i[2] for i in model_sub["avgsub"][0::4]
-                              if i[0] in list_])*100
-PDClayavg_list1 = np.average([i[2] for i in model_sub["avgsub"][1::4]
-                              if i[0] in list_])*100
-NLClayavg_list1 = np.average([i[2] for i in model_sub["avgsub"][2::4]
-                              if i[0] in list_])*100
-NBClayavg_list1 = np.average([i[2] for i in model_sub["avgsub"][3::4]
-                              if i[0] in list_])*100
-
-# Average perc of each clay layer to total for well nests without BK
-BKClayavg_list0 = np.average([i[2] for i in model_sub["avgsub"][0::4]
-                              if i[0] not in list_])*100
-PDClayavg_list0 = np.average([i[2] for i in model_sub["avgsub"][1::4]
-                              if i[0] not in list_])*100
-NLClayavg_list0 = np.average([i[2] for i in model_sub["avgsub"][2::4]
-                              if i[0] not in list_])*100
-NBClayavg_list0 = np.average([i[2] for i in model_sub["avgsub"][3::4]
-                              if i[0] not in list_])*100
+    # Saving dict for this model
+    result_store.append("Allnests_sub_" + scenarios[index], model_sub)
 
 # Plotting
 # path to save figures
 path = os.path.abspath("figures")
 
 # %%###########################################################################
-# Plots Results: Bar graph for appendix
+# Plots Results: Line graphs of cumulative sub forecast for whole time period
+# For appendix
 ##############################################################################
 
-bkk_sub_gw.bkk_plotting.sub_bar(path, model_sub["wellnestlist"],
-                                model_sub["all_results"],
-                                model_sub["sub_total"],
-                                model_sub["subv_total"],
-                                model_sub["ann_sub"],
-                                tmin=model_sub["tmin"],
-                                tmax=model_sub["tmax"], save=1,
-                                benchflag=1)
+# Figures of each well nest rendered on all processors
+bkk_sub_gw.bkk_plotting.sub_forecast(path, model_sub["wellnestlist"],
+                                     all_ann_subs,
+                                     save=1, n_jobs=None)
 
 # %%###########################################################################
-# Plots Results: Subsidence RMSE map for main paper
+# Plots Results: Maps of cumulative sub forecast from new tmin and tmax
+# For main paper
 ##############################################################################
 
-# Spatial map plotting
-bkk_sub_gw.bkk_plotting.sub_rmse_map(path, model_sub["wellnestlist"],
-                                     model_sub["all_results"],
-                                     model_sub["sub_total"],
-                                     model_sub["subv_total"],
-                                     model_sub["ann_sub"],
-                                     tmin=model_sub["tmin"],
-                                     tmax=model_sub["tmax"], save=1)
+tmin = "2020"
+tmax = "2060"
+
+# Cum sub change of all pumping scenarios over the period, cached in the store
+summary = result_store.periods(
+    bkk_sub_gw.bkk_periods.forecast_window(tmin, tmax),
+    scenarios=["Allnests_sub_" + scenario for scenario in scenarios])
+
+bkk_sub_gw.bkk_plotting.sub_forecast_map(path, model_sub["wellnestlist"],
+                                         tmin=tmin, tmax=tmax, save=1,
+                                         summary=summary)
 
 # %%###########################################################################
-# Plots Results: Forecasts of cumulative subsidence (cm) for pumping scenarios
+# Plots Results: Sensitivity Analysis, shown in appendix
 ##############################################################################
 
-# Creating (0) or importing (1)
-importing = 0
+# Sensitivity analysis
+sens_modes = ["Sske_clay", "thick", "Sskv", "K", "Sske_sand"]
 
-# If saving
-saving = 0
+# Recommended looking at results from sensitivity analysis for only
+# one well nest
+# Well nest to run sensitivity analysis
+wellnest_sens = ["LCBKK013"]
 
-# All ann subs
-all_ann_subs = []
+# For each sensitivity parameter set
+for sens_mode in sens_modes:
+
+    # Increasing by 10%
+    coeff = .5
+    num = 11  # Num of increases in percentage
+
+    # Preallocation
+    # Annual results from every sensitivity
+    sens_ann = []
 
-# If creating results for first time
-if importing == 0:
-
-    # For each well nest
-    wellnestlist = ["LCBKK003",
-                    "LCBKK005",
-                    "LCBKK006",
-                    "LCBKK007",
-                    "LCBKK009",
-                    "LCBKK011",
-                    "LCBKK012",
-                    "LCBKK013",
-                    "LCBKK014",
-                    "LCBKK015",
-                    "LCBKK016",
-                    "LCBKK018",
-                    "LCBKK020",
-                    "LCBKK021",
-                    "LCBKK026",
-                    "LCBKK027",
-                    "LCBKK036",
-                    "LCBKK038",
-                    "LCBKK041",
-                    "LCNBI003",
-                    "LCNBI007",
-                    "LCSPK007",
-                    "LCSPK009"]
     tmin = "1978"
-    tmax = "2110"
+    tmax = "2060"
 
-    # Mode can be "raw" as in raw groundwater data vs "Pastas" for importing Pastas
-    # simulated groundwater in the aquifers
     mode = "Pastas"
 
     # If mode is Pastas, need model path
@@ -458,15 +543,7 @@ if importing == 0:
     if pumpflag == 1:
 
         ppath = os.path.join(os.path.abspath("inputs"), "BasinPumping.xlsx")
-
-        # Pumping sheets
-        pumpsheets = ["EstTotalPump_54-60_Int50",
-                      "EstTotalPump_54-60_IntF25",
-                      "EstTotalPump_54-60_IntF100",
-                      "EstTotalPump_54-60_IntF50_25",
-                      "EstTotalPump_54-60_IntF0"]
-
-        scenarios = ["500", "250", "100", "500_250", "0"]
+        psheet = "EstTotalPump_54-60_Int50"
 
     # Convergence criteria
     CC = 1 * 10**-5
@@ -477,303 +554,106 @@ if importing == 0:
     # Using available heads as proxy for missing
     proxyflag = 1
 
-    # For each pumping scenario
-    for index, pumpsheet in enumerate(pumpsheets):
+    # Thickness, K and storage of clays and aquifers, read once
+    # Each sensitivity only changes the factors of a view of them
+    base_params = bkk_sub_gw.bkk_sub.load_parameters()
 
-        # Calculates subsidence
-        all_results, sub_total, subv_total = bkk_sub_gw.\
-            bkk_sub.bkk_subsidence(wellnestlist,
-                                   mode, tmin,
-                                   tmax,
-                                   Thick_data,
-                                   K_data,
-                                   Sskv_data,
-                                   Sske_data,
-                                   CC=CC,
-                                   Nz=node_num,
-                                   ic_run=True,
-                                   proxyflag=proxyflag,
-                                   pumpflag=pumpflag,
-                                   pump_path=ppath,
-                                   pump_sheet=pumpsheet,
-                                   model_path=mpath)
+    # For each parameter increase
+    for i in range(num):
 
-        # Post process data
-        sub_total, subv_total, ann_sub, \
-            _ = bkk_sub_gw.bkk_sub.bkk_postproc(wellnestlist,
-                                                sub_total,
-                                                subv_total,
-                                                all_results)
+        params = base_params
 
-        all_ann_subs.append(ann_sub)
+        # Sensitivity analyses depending on parameter
+        # Inelastic specific storage
+        if sens_mode == "Sskv":
 
-        # Dictionary to store everything
-        model_sub = {"wellnestlist": wellnestlist,
-                     "all_results": all_results,
-                     "sub_total": sub_total,
-                     "subv_total": subv_total,
-                     "ann_sub": ann_sub,
-                     "tmin": tmin,
-                     "tmax": tmax,
-                     "Thick_data": Thick_data,
-                     "Sske_data": Sske_data,
-                     "Sskv_data": Sskv_data,
-                     "K_data": K_data,
-                     "pumping_scenario": scenarios[index],
-                     "CC": CC,
-                     "clay_nodes": node_num,
-                     "proxyflag": proxyflag,
-                     "mode": mode}
+            params = base_params.scaled("Sskv", coeff)
 
-        # If saving
-        if saving == 1:
+        # Elastic specific storage for clay
+        elif sens_mode == "Sske_clay":
 
-            # Path to save models
-            path = os.path.abspath("models")
+            params = base_params.scaled("Sske", coeff,
+                                        layers=bkk_sub_gw.bkk_sub.CLAYS)
 
-            # Saving dict for this model
-            afile = open(path + "\\Allnests_sub_" + scenarios[index] + ".pkl", "wb")
-            pickle.dump(model_sub, afile)
-            afile.close()
+        # Elastic specific storage for sand
+        elif sens_mode == "Sske_sand":
 
-# if importing subsidence model results
-else:
+            # If not the last sens
+            if i != (num - 1):
 
-    # Path to import models
-    path = os.path.abspath("models")
-    scenarios = ["500", "250", "100", "500_250", "0"]
-    for scenario in scenarios:
+                params = base_params.scaled(
+                    "Sske", coeff, layers=bkk_sub_gw.bkk_sub.AQUIFERS)
 
-        # Reload object from file
-        file2 = open(path + "\\Allnests_sub_" + scenario + ".pkl", "rb")
-        model_sub = pickle.load(file2)
-        file2.close()
+            # If last sens, setting sand elastic storage to clay
+            # which is typically one order of magnitude higher
+            else:
 
-        all_ann_subs.append(model_sub["ann_sub"])
+                params = base_params.replaced("Sske", {"BK": "VSC",
+                                                       "PD": "MSC",
+                                                       "NL": "SC",
+                                                       "NB": "HC"})
 
-# Plotting
-# path to save figures
-path = os.path.abspath("figures")
+        # Vertical hydraulic conductivity
+        elif sens_mode == "K":
 
-# %%###########################################################################
-# Plots Results: Line graphs of cumulative sub forecast for whole time period
-# For appendix
-##############################################################################
+            params = base_params.scaled("K", coeff)
 
-bkk_sub_gw.bkk_plotting.sub_forecast(path, model_sub["wellnestlist"],
-                                     all_ann_subs,
-                                     save=1)
-
-# %%###########################################################################
-# Plots Results: Maps of cumulative sub forecast from new tmin and tmax
-# For main paper
-##############################################################################
+        # Thickness
+        elif sens_mode == "thick":
 
-tmin = "2020"
-tmax = "2060"
-bkk_sub_gw.bkk_plotting.sub_forecast_map(path, model_sub["wellnestlist"],
-                                         all_ann_subs, tmin, tmax,
-                                         save=1)
+            params = base_params.scaled("Thickness", coeff)
 
-# %%###########################################################################
-# Plots Results: Sensitivity Analysis, shown in appendix
-##############################################################################
-
-# Creating (0) or importing (1)
-importing = 1
-
-# If saving odels
-saving = 0
-
-# Sensitivity analysis
-sens_modes = ["Sske_clay", "thick", "Sskv", "K", "Sske_sand"]
-
-# Recommended looking at results from sensitivity analysis for only
-# one well nest
-# Well nest to run sensitivity analysis
-wellnest_sens = ["LCBKK013"]
-
-# For each sensitivity parameter set
-for sens_mode in sens_modes:
-
-    # Increasing by 10%
-    coeff = .5
-    num = 11  # Num of increases in percentage
-
-    # Preallocation
-    # All results from every sensitivity
-    sens_results = []
-    sens_sub = []
-    sens_subv = []
-    sens_ann = []
-
-    # If creating results for first time
-    if importing == 0:
-
-        tmin = "1978"
-        tmax = "2060"
+        # Running subsidence model for every analysis value
+        all_, sub_, subv_ = bkk_sub_gw.\
+            bkk_sub.bkk_subsidence(wellnest_sens,
+                                   mode, tmin,
+                                   tmax,
+                                   params,
+                                   CC=CC,
+                                   Nz=node_num,
+                                   ic_run=True,
+                                   proxyflag=proxyflag,
+                                   pumpflag=pumpflag,
+                                   pump_path=ppath,
+                                   pump_sheet=psheet,
+                                   model_path=mpath,
+                                   head_cache=head_cache,
+                                   run_cache=run_cache,
+                                   warmup_cache=warmup_cache)
 
-        mode = "Pastas"
+        sub_, subv_, ann_, _ = bkk_sub_gw.bkk_sub.bkk_postproc(wellnest_sens,
+                                                               sub_,
+                                                               subv_,
+                                                               all_)
 
-        # If mode is Pastas, need model path
-        if mode == "Pastas":
+        # Saving results
+        sens_ann.append(ann_)
 
-            mpath = os.path.abspath("models")
+        # Dictionary to store everything
+        model_sub = {"wellnestlist": wellnest_sens,
+                     "all_results": all_,
+                     "sub_total": sub_,
+                     "subv_total": subv_,
+                     "ann_sub": ann_,
+                     "sens_mode": sens_mode,
+                     "tmin": tmin,
+                     "tmax": tmax,
+                     "Thick_data": params.frame("Thickness"),
+                     "Sske_data": params.frame("Sske"),
+                     "Sskv_data": params.frame("Sskv"),
+                     "K_data": params.frame("K"),
+                     "pumping_scenario": psheet,
+                     "CC": CC,
+                     "clay_nodes": node_num,
+                     "proxyflag": proxyflag}
 
-        # Pumping flag, for PASTAS, if changing pumping scenario
-        pumpflag = 1
-        # If changing pumping scenario, need pumping sheet/path
-        if pumpflag == 1:
+        # Saving dict for this model
+        result_store.append("LCBKK013_sub_sens_" +
+                            str(round(coeff*100)) + sens_mode,
+                            model_sub)
 
-            ppath = os.path.join(os.path.abspath("inputs"), "BasinPumping.xlsx")
-            psheet = "EstTotalPump_54-60_Int50"
-
-        # Convergence criteria
-        CC = 1 * 10**-5
-
-        # Number of nodes in clay
-        node_num = 10
-
-        # Using available heads as proxy for missing
-        proxyflag = 1
-
-        # For each parameter increase
-        for i in range(num):
-
-            # Reading in thickness and storage data
-            path = os.path.join(os.path.abspath("inputs"), "SUBParameters.xlsx")
-            Thick_data = pd.read_excel(path, sheet_name="Thickness",
-                                       index_col=0)  # Thickness
-            Sskv_data = pd.read_excel(path,
-                                      sheet_name="Sskv",
-                                      index_col=0)  # Sskv
-            Sske_data = pd.read_excel(path,
-                                      sheet_name="Sske",
-                                      index_col=0)  # Ssk
-            K_data = pd.read_excel(path,
-                                   sheet_name="K",
-                                   index_col=0)  # K
-
-            # Sensitivity analyses depending on parameter
-            # Inelastic specific storage
-            if sens_mode == "Sskv":
-
-                Sskv_data = Sskv_data.iloc[:, :9] * coeff
-
-            # Elastic specific storage for clay
-            elif sens_mode == "Sske_clay":
-
-                Sske_data.iloc[:, 0:9:2] = Sske_data.iloc[:, 0:9:2] * coeff
-
-            # Elastic specific storage for sand
-            elif sens_mode == "Sske_sand":
-
-                # If not the last sens
-                if i != (num - 1):
-
-                    Sske_data.iloc[:, 1:10:2] = Sske_data.iloc[:, 1:10:2] * coeff
-
-                # If last sens, setting sand elastic storage to clay
-                # which is typically one order of magnitude higher
-                else:
-
-                    Sske_data.iloc[:, 1:10:2] = Sske_data.iloc[:, 0:9:2]
-
-            # Vertical hydraulic conductivity
-            elif sens_mode == "K":
-
-                K_data = K_data.iloc[:, :9] * coeff
-
-            # Thickness
-            elif sens_mode == "thick":
-
-                Thick_data = Thick_data.iloc[:, :9] * coeff
-
-            # Running subsidence model for every analysis value
-            all_, sub_, subv_ = bkk_sub_gw.\
-                bkk_sub.bkk_subsidence(wellnest_sens,
-                                       mode, tmin,
-                                       tmax,
-                                       Thick_data,
-                                       K_data,
-                                       Sskv_data,
-                                       Sske_data,
-                                       CC=CC,
-                                       Nz=node_num,
-                                       ic_run=True,
-                                       proxyflag=proxyflag,
-                                       pumpflag=pumpflag,
-                                       pump_path=ppath,
-                                       pump_sheet=psheet,
-                                       model_path=mpath)
-
-            sub_, subv_, ann_, _ = bkk_sub_gw.bkk_sub.bkk_postproc(wellnest_sens,
-                                                                   sub_,
-                                                                   subv_,
-                                                                   all_)
-
-            # Saving results
-            sens_results.append(all_)
-            sens_sub.append(sub_)
-            sens_subv.append(subv_)
-            sens_ann.append(ann_)
-
-            # Dictionary to store everything
-            model_sub = {"wellnestlist": wellnest_sens,
-                         "all_results": all_,
-                         "sub_total": sub_,
-                         "subv_total": subv_,
-                         "ann_sub": ann_,
-                         "sens_mode": sens_mode,
-                         "tmin": tmin,
-                         "tmax": tmax,
-                         "Thick_data": Thick_data,
-                         "Sske_data": Sske_data,
-                         "Sskv_data": Sskv_data,
-                         "K_data": K_data,
-                         "pumping_scenario": psheet,
-                         "CC": CC,
-                         "clay_nodes": node_num,
-                         "proxyflag": proxyflag}
-
-            # If saving
-            if saving == 1:
-
-                # Path to save models
-                path = os.path.abspath("models")
-
-                # Saving dict for this model
-                afile = open(path + "\\LCBKK013_sub_sens_" + str(round(coeff*100)) +
-                             sens_mode + ".pkl", "wb")
-                pickle.dump(model_sub, afile)
-                afile.close()
-
-            # Shifting parameter value
-            coeff += .1
-
-    # If importing model results
-    else:
-
-        # For each parameter increase
-        for i in range(num):
-
-            # Path to save models
-            path = os.path.abspath("models")
-
-            # Saving dict for this model
-            afile = open(path + "\\LCBKK013_sub_sens_" + str(round(coeff*100)) +
-                         sens_mode + ".pkl", "rb")
-            model_sub = pickle.load(afile)
-            afile.close()
-
-            # Saving results
-            sens_results.append(model_sub["all_results"])
-            sens_sub.append(model_sub["sub_total"])
-            sens_subv.append(model_sub["subv_total"])
-            sens_ann.append(model_sub["ann_sub"])
-
-            # Shifting parameter value
-            coeff += .1
+        # Shifting parameter value
+        coeff += .1
 
     # Plotting
     # path to save figures
@@ -783,8 +663,8 @@ for sens_mode in sens_modes:
     # New tmin for subsidence change
     tmin = "2020"
     tmax = "2060"
-    bkk_sub_gw.bkk_plotting.sub_sens_line(path, wellnest_sens, sens_results,
-                                          sens_sub, sens_subv, sens_ann,
+    bkk_sub_gw.bkk_plotting.sub_sens_line(path, wellnest_sens,
+                                          annual_data=sens_ann,
                                           tmin=tmin, tmax=tmax, mode=sens_mode,
                                           num=num, save=1)
 
@@ -849,41 +729,8 @@ IQRnum = 0
 hampelnum = 0
 for wellnest in wellnestlist:
     # BENCHMARK LEVELING
-    # Subsidence plotting
-    # Getting benchmark time series
-    loc = os.path.join(os.path.abspath("inputs"),
-                       "SurveyingLevels.xlsx")
-    subdata = pd.read_excel(loc, sheet_name=wellnest + "_Leveling",
-                            index_col=3)
-
-    # SYNTHETIC DATA
-    # loc = os.path.join(os.path.abspath("inputs"),
-    #                    "synthetictruth_partial.xlsx")
-    # subdata = pd.read_excel(loc, index_col=0)
-    subdata = pd.DataFrame(subdata)
-    subdata.index = pd.to_datetime(subdata.index)
-    # Getting rid of benchmarks outside time period
-    subdata = subdata[(subdata.Year <= 2020)]
-
-    # Benchmarks should start at 0 at the first year.
-    bench = subdata.loc[:, subdata.columns.str.contains("Land")]
-    if (bench.iloc[0] != 0).any():
-        bench.iloc[0] = 0
-
-    # IMPORTANT INFO
-    # For benchmark measurements, the first year is 0, the second year
-    # is the compaction rate over that first year.
-    # For implicit Calc, the first year has a compaction rate over that
-    # year, so to shift benchmarks value to the previouse year to match
-    # Index has the right years
-    bench.index = bench.index.shift(-1, freq="D")
-    bench["date"] = bench.index
-
-    # Gets the last date of each year
-    lastdate = bench.groupby(pd.DatetimeIndex(bench["date"]).year,
-                             as_index=False).agg(
-                                 {"date": max}).reset_index(drop=True)
-    bench = bench.loc[lastdate.date]
+    # Annual benchmark rates (cm/yr) at the end of each year
+    bench = bkk_sub_gw.bkk_sub.load_benchmarks().get(wellnest)
 
     # Dataframe prep
     daterange = pd.date_range(dt.datetime(1978, 12, 31), periods=43,
@@ -909,7 +756,8 @@ for wellnest in wellnestlist:
 
     # FINDS OUTLIERS
     IQRoutliers = find_outliers_IQR(-dobs)
-    hampeloutliers = hampel(-dobs, window_size=3, n_sigma=3.5).outlier_indices
+    hampeloutliers = np.flatnonzero(bkk_sub_gw.bkk_ingest.hampel_mask(
+        -dobs.values, window_size=3, n_sigma=3.5))
 
     print(wellnest)
     print("\n IQR Method")
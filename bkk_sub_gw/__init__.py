@@ -1,2 +1,11 @@
+from bkk_sub_gw import bkk_cache
+from bkk_sub_gw import bkk_catalog
 from bkk_sub_gw import bkk_sub
+from bkk_sub_gw import bkk_archive
+from bkk_sub_gw import bkk_ingest
+from bkk_sub_gw import bkk_periods
+from bkk_sub_gw import bkk_results
+from bkk_sub_gw import bkk_metrics
+from bkk_sub_gw import bkk_calib
+from bkk_sub_gw import bkk_render
 from bkk_sub_gw import bkk_plotting
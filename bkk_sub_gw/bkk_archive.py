@@ -0,0 +1,248 @@
+# ##############################################################################
+"""Memory-mapped archive of daily Pastas heads for all wells and scenarios.
+
+Heads are saved as one float32 array (scenario, well, day) on disk with a
+sidecar index.json of the scenario names, well names, and dates. The archive is
+written once by the Pastas stage and read without copying by the subsidence
+stage and by plotting. Only the archive path is passed between processes, so no
+pandas series need to be pickled.
+
+Article Title: Hybrid data-driven, physics-based modeling of ground-
+water and subsidence with application to Bangkok, Thailand
+
+Jenny Soonthornrangsan 2023
+TU Delft
+
+"""
+# ##############################################################################
+
+###############################################################################
+# import statements
+###############################################################################
+
+import os
+import json
+import numpy as np
+import pandas as pd
+import pastas as ps
+
+# Bangkok Subsidence Model Package
+from bkk_sub_gw import bkk_sub
+from bkk_sub_gw import bkk_cache
+from bkk_sub_gw import bkk_catalog
+
+# Scenario name for heads simulated with the pumping stored in the Pastas model
+MODEL_PUMPING = "model"
+
+
+# %%###########################################################################
+# Reading the archive
+###############################################################################
+
+class HeadArchive:
+    """Read-only memory-mapped archive of daily heads (scenario, well, day).
+
+    Wells are named after their Pastas model file without "_model.pas", e.g.
+    LCBKK013_PD32_GW_1978_2005. The memory map is opened when first used, so
+    archives can be sent to other processes cheaply.
+    """
+
+    def __init__(self, path):
+
+        self.path = path  # Folder of the archive
+
+        # Sidecar index
+        with open(os.path.join(path, "index.json")) as f:
+            self.index = json.load(f)
+
+        self.scenarios = self.index["scenarios"]  # Pumping scenario names
+        self.wells = self.index["wells"]  # Well names
+        self.dates = pd.date_range(self.index["start"],
+                                   periods=self.index["ndays"], freq="D")
+
+        # Position of each scenario and well in the array
+        self._scen_pos = {s: i for i, s in enumerate(self.scenarios)}
+        self._well_pos = {w: i for i, w in enumerate(self.wells)}
+
+        # Memory map, opened when needed
+        self._heads = None
+
+    def __getstate__(self):
+        """Only the path and index are sent to other processes."""
+        state = self.__dict__.copy()
+        state["_heads"] = None
+
+        return state
+
+    def __contains__(self, item):
+        """(scenario, well) in archive."""
+        scenario, well = item
+
+        return scenario in self._scen_pos and well in self._well_pos
+
+    @property
+    def heads(self):
+        """Memory-mapped float32 array of heads (scenario, well, day)."""
+        if self._heads is None:
+            self._heads = np.memmap(os.path.join(self.path, "heads.f32"),
+                                    dtype=np.float32, mode="r",
+                                    shape=(len(self.scenarios), len(self.wells),
+                                           len(self.dates)))
+
+        return self._heads
+
+    def covers(self, tmin, tmax):
+        """True if the archive has daily heads from tmin to tmax (str)."""
+        return np.logical_and(self.dates[0] <= pd.Timestamp(tmin),
+                              self.dates[-1] >= pd.Timestamp(tmax))
+
+    def _window(self, tmin, tmax):
+        """Slice of days between tmin and tmax (inclusive)."""
+        start = 0 if tmin is None else \
+            self.dates.searchsorted(pd.Timestamp(tmin), side="left")
+        stop = len(self.dates) if tmax is None else \
+            self.dates.searchsorted(pd.Timestamp(tmax), side="right")
+
+        return slice(start, stop)
+
+    def get(self, scenario, well, tmin=None, tmax=None):
+        """Series of daily heads for one scenario and well (no copy).
+
+        scenario - pumping scenario name
+        well - well name
+        tmin, tmax - (str) optional window (inclusive)
+        """
+        window = self._window(tmin, tmax)
+        values = self.heads[self._scen_pos[scenario], self._well_pos[well],
+                            window]
+
+        return pd.Series(values, index=self.dates[window], name=well,
+                         copy=False)
+
+    def frame(self, scenario, wells=None, tmin=None, tmax=None):
+        """Dataframe of daily heads for one scenario, one column per well.
+
+        scenario - pumping scenario name
+        wells - list of well names, all wells if None
+        tmin, tmax - (str) optional window (inclusive)
+        """
+        window = self._window(tmin, tmax)
+
+        # If all wells, only a view of the memory map
+        if wells is None:
+            wells = self.wells
+            values = self.heads[self._scen_pos[scenario], :, window]
+
+        else:
+            values = self.heads[self._scen_pos[scenario],
+                                [self._well_pos[w] for w in wells], window]
+
+        return pd.DataFrame(values.T, index=self.dates[window], columns=wells,
+                            copy=False)
+
+
+# %%###########################################################################
+# Writing the archive
+###############################################################################
+
+def build_head_archive(path, model_path, wellnestlist, pump_path, pump_sheets,
+                       tmax, tmin="1950", warmup=365*30):
+    """Simulate daily heads of all Pastas models for each pumping scenario.
+
+    Written once: if an archive with the same models, pumping file, scenarios,
+    and window is already in path, it is opened instead.
+    path - folder of the archive
+    model_path - path to Pastas models
+    wellnestlist - list of well nests
+    pump_path - path to pumping excel sheet
+    pump_sheets - list of pumping scenario sheets; None for the pumping already
+    in the Pastas model
+    tmin, tmax - (str) simulation window
+    warmup - warmup (days)
+
+    Returns
+    archive - HeadArchive
+    """
+    # Pastas model files of the well nests, shallow to deep aquifers
+    catalog = bkk_catalog.load_catalog(models_path=model_path)
+    modelfiles = [modelfile for wellnest in wellnestlist
+                  for modelfile in catalog.model_files(wellnest)]
+
+    wells = [f.replace("_model.pas", "") for f in modelfiles]
+    scenarios = [MODEL_PUMPING if s is None else s for s in pump_sheets]
+    dates = pd.date_range(tmin, tmax, freq="D")
+
+    # What the heads were simulated from
+    sources = [bkk_cache.hash_file(os.path.join(model_path, f))
+               for f in modelfiles]
+    if pump_path is not None:
+        sources.append(bkk_cache.hash_file(pump_path))
+    index = {"scenarios": scenarios,
+             "wells": wells,
+             "start": str(dates[0].date()),
+             "ndays": len(dates),
+             "warmup": warmup,
+             "sources": bkk_cache.hash_series(pd.Series(sources))}
+
+    # If already written
+    index_file = os.path.join(path, "index.json")
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            if json.load(f) == index:
+                return HeadArchive(path)
+
+        # Outdated archive
+        os.remove(index_file)
+
+    os.makedirs(path, exist_ok=True)
+
+    # Pumping scenarios read once
+    pump_data = {}
+    for sheet in pump_sheets:
+        if sheet is not None:
+            pump_data[sheet] = bkk_cache.read_excel(pump_path,
+                                                    sheet_name=sheet,
+                                                    index_col=0,
+                                                    parse_dates=["Date"]).Pump
+
+    # Warmup contributions shared by the pumping scenarios
+    warmup_cache = bkk_cache.WarmupCache()
+
+    # Memory map to write to
+    heads = np.memmap(os.path.join(path, "heads.f32"), dtype=np.float32,
+                      mode="w+", shape=(len(scenarios), len(wells),
+                                        len(dates)))
+
+    # For each model
+    for num_well, modelfile in enumerate(modelfiles):
+
+        # For each pumping scenario
+        for num_scen, sheet in enumerate(pump_sheets):
+
+            # Pumping stored in the model
+            if sheet is None:
+                model = ps.io.load(model_path + "/" + modelfile)
+
+            # Changing pumping scenario
+            else:
+                if num_scen == 0 or pump_sheets[num_scen-1] is None:
+                    model = ps.io.load(model_path + "/" + modelfile)
+                model = bkk_sub.pastas_setparam(model,
+                                                pump_series=pump_data[sheet])
+
+            temp = bkk_sub.pastas_simulate(model, tmin, tmax, warmup=warmup,
+                                           warmup_cache=warmup_cache)
+            heads[num_scen, num_well] = temp.reindex(dates).values
+
+        print("Head archive: " + wells[num_well] + " simulated")
+
+    heads.flush()
+    del heads
+
+    warmup_cache.report()
+
+    # Index written last so an incomplete archive is never opened
+    with open(index_file, "w") as f:
+        json.dump(index, f, indent=1)
+
+    return HeadArchive(path)
@@ -0,0 +1,443 @@
+# ##############################################################################
+"""Disk caches for intermediate results of the BKK subsidence workflow.
+
+Pastas simulated heads only depend on the Pastas model, the pumping series and
+the simulation window. They are saved to disk so that subsidence runs that only
+change clay settings (Nz, CC, Sskv, Sske, K, thickness) skip Pastas entirely.
+The warmup contribution of each Pastas stress model is kept in memory so that
+pumping scenarios only convolve the stress after the warmup. Excel sheets in
+inputs are parsed once and saved as pickled dataframes, which are read again
+until the excel file changes. Whole subsidence runs are saved by the hash of
+all their inputs, so a run with the same inputs is read instead of computed.
+
+Article Title: Hybrid data-driven, physics-based modeling of ground-
+water and subsidence with application to Bangkok, Thailand
+
+Jenny Soonthornrangsan 2023
+TU Delft
+
+"""
+# ##############################################################################
+
+###############################################################################
+# import statements
+###############################################################################
+
+import os
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+import pastas as ps
+
+# Storage precision of saved results
+from bkk_sub_gw import bkk_results
+
+# Bumped whenever the way heads are simulated changes so old files are not used
+CACHE_VERSION = "1"
+
+# Hashes of files already read, keyed by (path, size, modification time)
+_file_hashes = {}
+
+# Folder of cached excel sheets (relative to the working directory, like the
+# other caches of the scripts)
+EXCEL_CACHE_PATH = os.path.join("cache", "excel")
+
+# Excel sheets already read in this session, keyed by cache file
+_excel_frames = {}
+
+
+# %%###########################################################################
+# Hashing inputs
+###############################################################################
+
+def hash_file(path):
+    """Return the sha1 hash of the contents of a file.
+
+    path - path to file
+
+    Hashes are remembered for as long as the file size and modification time do
+    not change
+    """
+    stat = os.stat(path)
+    file_id = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+    # If file not hashed yet
+    if file_id not in _file_hashes:
+
+        sha = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        _file_hashes[file_id] = sha.hexdigest()
+
+    return _file_hashes[file_id]
+
+
+def hash_series(series):
+    """Return the sha1 hash of a pandas series or dataframe (index and values)."""
+    values = pd.util.hash_pandas_object(series, index=True).values
+
+    return hashlib.sha1(values.tobytes()).hexdigest()
+
+
+def head_key(model_file, tmin, tmax, warmup, pumpflag, well_name,
+             pump_series=None, pump_path=None, pump_sheet=None,
+             initoptiparam=None):
+    """Cache key of the heads simulated by one Pastas model.
+
+    Follows the same choice of pumping as load_Pastas
+    model_file - path to the Pastas model file (.pas)
+    tmin, tmax - (str) simulation window
+    warmup - warmup (days)
+    pumpflag - 1 if changing pumping scenario for Pastas
+    well_name - name of well
+    pump_series - if pump series given already
+    pump_path - path to pumping excel sheet
+    pump_sheet - sheet of specific pumping scenario
+    initoptiparam - optimal parameters provided or not
+
+    Returns
+    key - (str) hex digest of the Pastas version, model, pumping and window
+    """
+    # Pastas version (simulated heads can change between versions) and model
+    # hash
+    parts = [CACHE_VERSION, ps.__version__, hash_file(model_file)]
+
+    # Pumping hash
+    # If keeping the pumping stored in the model
+    if pumpflag != 1:
+
+        parts.append("model")
+
+    else:
+
+        # If providing optimal parameters
+        if initoptiparam is not None:
+
+            parts.append(hash_series(initoptiparam.loc[well_name]))
+
+        # If pumping time series used
+        if pump_series is not None and (pump_path is None or
+                                        initoptiparam is None):
+
+            parts.append(hash_series(pump_series[well_name]))
+
+        # If path and sheet used instead
+        elif pump_path is not None:
+
+            parts.extend([hash_file(pump_path), str(pump_sheet)])
+
+        else:
+
+            parts.append("model")
+
+    # Window
+    parts.extend([str(tmin), str(tmax), str(warmup)])
+
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+
+# %%###########################################################################
+# Pastas simulated heads cache
+###############################################################################
+
+class HeadCache:
+    """On-disk cache of Pastas simulated heads with a least recently used limit.
+
+    One compressed .npz file is saved per (model hash, pump hash, window) key.
+    Files are touched when read, and the least recently used files are removed
+    once the total size of the cache is over max_size.
+    """
+
+    name = "Head cache"  # Name in the statistics
+    suffix = ".npz"  # Extension of cache files
+
+    def __init__(self, path, max_size=2 * 1024**3):
+
+        self.path = path  # Folder of cache files
+        self.max_size = max_size  # Size limit of the cache (bytes)
+        self.hits = 0  # Number of heads read from the cache
+        self.misses = 0  # Number of heads not in the cache
+        self.evictions = 0  # Number of files removed to keep below max_size
+
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        """Path of the cache file for a key."""
+        return os.path.join(self.path, key + self.suffix)
+
+    def load(self, key):
+        """Return cached heads as a series or None if not cached.
+
+        key - cache key from head_key
+        """
+        fname = self._file(key)
+
+        # If not cached
+        if not os.path.exists(fname):
+
+            self.misses += 1
+
+            return None
+
+        with np.load(fname, allow_pickle=False) as data:
+
+            head = pd.Series(data["head"],
+                             index=pd.DatetimeIndex(data["dates"],
+                                                    freq="infer"),
+                             name=str(data["name"]))
+
+        # Marks file as recently used
+        os.utime(fname)
+        self.hits += 1
+
+        return head
+
+    def save(self, key, head):
+        """Save heads to the cache and evict old files if over the size limit.
+
+        key - cache key from head_key
+        head - series of simulated heads with a DatetimeIndex
+        """
+        fname = self._file(key)
+
+        # Writes to a temporary file first so that a stopped run does not leave
+        # a broken cache file
+        tmpname = fname + ".tmp.npz"
+        np.savez_compressed(tmpname,
+                            head=head.values.astype(float),
+                            dates=head.index.values.astype("datetime64[ns]"),
+                            name=str(head.name))
+        os.replace(tmpname, fname)
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used files until below max_size."""
+        files = [os.path.join(self.path, f) for f in os.listdir(self.path)
+                 if f.endswith(self.suffix) and ".tmp" not in f]
+        stats = [(os.stat(f).st_mtime, os.stat(f).st_size, f) for f in files]
+        total = sum(s[1] for s in stats)
+
+        # Oldest first
+        for mtime, size, f in sorted(stats):
+
+            if total <= self.max_size:
+                break
+
+            os.remove(f)
+            total -= size
+            self.evictions += 1
+
+    def report(self):
+        """Print the cache statistics."""
+        files = [f for f in os.listdir(self.path) if f.endswith(self.suffix)]
+        size = sum(os.path.getsize(os.path.join(self.path, f)) for f in files)
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total > 0 else 0
+
+        print(self.name + ": " + str(self.hits) + " hits, " +
+              str(self.misses) + " misses (" + "%.0f" % rate + "% hit rate), " +
+              str(self.evictions) + " evictions, " + str(len(files)) +
+              " files, " + "%.1f" % (size / 1024**2) + " MB")
+
+
+# %%###########################################################################
+# Subsidence run cache
+###############################################################################
+
+class RunCache(HeadCache):
+    """On-disk cache of whole bkk_subsidence runs with a least recently used
+    limit.
+
+    One pickle of (all_results, sub_total, subv_total) is saved per key, the
+    hash of all inputs of the run (bkk_sub.subsidence_key). Heads and
+    cumulative subsidence are saved at a storage precision (see
+    bkk_results.PRECISIONS) and read back as float64.
+    """
+
+    name = "Run cache"  # Name in the statistics
+    suffix = ".pkl"  # Extension of cache files
+
+    def __init__(self, path, max_size=8 * 1024**3, precision="float64",
+                 step=bkk_results.QUANTUM):
+
+        super().__init__(path, max_size=max_size)
+
+        self.precision = precision  # Storage precision of the histories
+        self.step = step  # Step of quantized histories (m)
+
+    def _file(self, key):
+        """Path of the cache file for a key at the precision of the cache."""
+        precision = self.precision
+        if precision == "quantized":
+            precision += "%g" % self.step
+
+        return os.path.join(self.path, key + "_" + precision + self.suffix)
+
+    def load(self, key):
+        """Return the cached results of a run or None if not cached.
+
+        key - cache key from bkk_sub.subsidence_key
+        """
+        fname = self._file(key)
+
+        # If not cached
+        if not os.path.exists(fname):
+
+            self.misses += 1
+
+            return None
+
+        with open(fname, "rb") as f:
+            results = bkk_results.decode_run(pickle.load(f))
+
+        # Marks file as recently used
+        os.utime(fname)
+        self.hits += 1
+
+        return results
+
+    def save(self, key, results):
+        """Save the results of a run and evict old files if over the size
+        limit.
+
+        key - cache key from bkk_sub.subsidence_key
+        results - (all_results, sub_total, subv_total) from bkk_subsidence
+        """
+        fname = self._file(key)
+
+        # Writes to a temporary file first so that a stopped run does not leave
+        # a broken cache file
+        tmpname = fname + ".tmp"
+        with open(tmpname, "wb") as f:
+            pickle.dump(bkk_results.encode_run(results, self.precision,
+                                               self.step),
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, fname)
+
+        self.evict()
+
+
+# %%###########################################################################
+# Pastas warmup cache
+###############################################################################
+
+def warmup_key(warmup_stress, block, nsim):
+    """Key of the warmup contribution of one Pastas stress model.
+
+    The block response is hashed itself, so the key covers everything it
+    depends on (response function, its parameters, cutoff and maxtmax)
+    warmup_stress - stress during the warmup
+    block - block response of the stress model (rfunc.block)
+    nsim - number of days simulated after the warmup
+    """
+    sha = hashlib.sha1()
+    sha.update(np.asarray(warmup_stress, dtype=float).tobytes())
+    sha.update(np.asarray(block, dtype=float).tobytes())
+    sha.update(str(nsim).encode())
+
+    return sha.hexdigest()
+
+
+class WarmupCache:
+    """In-memory cache of the warmup contribution of Pastas stress models.
+
+    Pumping scenarios only differ after the warmup, so the contribution of the
+    stress during the warmup to the heads after tmin is the same for every
+    scenario with the same parameters. It is convolved once and reused.
+    """
+
+    def __init__(self):
+
+        self.states = {}  # Warmup contributions (arrays) by warmup_key
+        self.hits = 0  # Number of warmup contributions reused
+        self.misses = 0  # Number of warmup contributions convolved
+
+    def load(self, key):
+        """Return the warmup contribution or None if not cached."""
+        warm = self.states.get(key)
+
+        if warm is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return warm
+
+    def save(self, key, warm):
+        """Save the warmup contribution of a stress model."""
+        self.states[key] = warm
+
+    def report(self):
+        """Print the cache statistics."""
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total > 0 else 0
+        size = sum(warm.nbytes for warm in self.states.values())
+
+        print("Warmup cache: " + str(self.hits) + " hits, " +
+              str(self.misses) + " misses (" + "%.0f" % rate + "% hit rate), " +
+              "%.1f" % (size / 1024**2) + " MB")
+
+
+# %%###########################################################################
+# Excel ingestion cache
+###############################################################################
+
+def read_excel(path, sheet_name=0, **kwargs):
+    """Read an excel sheet like pd.read_excel, parsing the excel file only once.
+
+    The dataframe of each (file, sheet, read options) is pickled to
+    EXCEL_CACHE_PATH with the hash of the excel file. It is read from there
+    until the excel file changes (size, modification time and then contents are
+    checked).
+    path - path to excel file
+    sheet_name - sheet name or number
+    kwargs - other options of pd.read_excel (index_col, usecols, skiprows...)
+
+    Returns
+    data - dataframe of the sheet, or dictionary of dataframes of the sheets
+    (copies, free to change)
+    """
+    # Cache file of this sheet and these options
+    options = [CACHE_VERSION, pd.__version__, os.path.abspath(path),
+               repr(sheet_name)] + [key + "=" + repr(kwargs[key])
+                                    for key in sorted(kwargs)]
+    fname = os.path.join(EXCEL_CACHE_PATH,
+                         hashlib.sha1("|".join(options).encode()).hexdigest()
+                         + ".pkl")
+
+    # Contents of the excel file now
+    source = hash_file(path)
+
+    # If not read in this session or excel file changed
+    if fname not in _excel_frames or _excel_frames[fname][0] != source:
+
+        cached = None
+        if os.path.exists(fname):
+            with open(fname, "rb") as f:
+                cached = pickle.load(f)
+
+        # If not cached or excel file changed, parses the excel file
+        if cached is None or cached[0] != source:
+
+            cached = (source, pd.read_excel(path, sheet_name=sheet_name,
+                                            **kwargs))
+
+            # Writes to a temporary file first so that a stopped run does not
+            # leave a broken cache file
+            os.makedirs(EXCEL_CACHE_PATH, exist_ok=True)
+            tmpname = fname + ".tmp"
+            with open(tmpname, "wb") as f:
+                pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, fname)
+
+        _excel_frames[fname] = cached
+
+    # Dictionary of dataframes if sheet_name is None or a list
+    frames = _excel_frames[fname][1]
+    if isinstance(frames, dict):
+        return {sheet: frame.copy() for sheet, frame in frames.items()}
+
+    return frames.copy()
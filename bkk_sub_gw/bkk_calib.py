@@ -0,0 +1,387 @@
+# ##############################################################################
+"""Calibrating the Pastas models of all wells on a process pool.
+
+Each well is fit independently (first without noise, then with noise), so the
+fits are run at the same time on all processors. Observed heads are prepared
+once in the main process, models are saved as .pas files, and the fit time and
+statistics of each well are appended to a csv file so that a stopped
+calibration can be resumed.
+
+Article Title: Hybrid data-driven, physics-based modeling of ground-
+water and subsidence with application to Bangkok, Thailand
+
+Jenny Soonthornrangsan 2023
+TU Delft
+
+"""
+# ##############################################################################
+
+###############################################################################
+# import statements
+###############################################################################
+
+import os
+import time
+import warnings
+import numpy as np
+import pandas as pd
+import pastas as ps
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Importing script for pre-processing Thai GW data
+import main_functions as mfs
+
+# Cached reading of excel inputs
+from bkk_sub_gw import bkk_cache
+
+# Catalog of well nests and Pastas models
+from bkk_sub_gw import bkk_catalog
+
+
+# %%###########################################################################
+# Model specifications
+###############################################################################
+
+def model_filename(wellnest, well_name, calitime_min, calitime_max):
+    """Name of the Pastas model file of a well."""
+    return wellnest + "_" + well_name + "_GW_" + calitime_min + "_" + \
+        calitime_max + "_model.pas"
+
+
+def well_specs(wellnestlist, tot_path):
+    """Observed heads and initial constant for each well of the well nests.
+
+    wellnestlist - list of well nests
+    tot_path - path to inputs (well nest excel files, land surface elevation
+    and steady state heads)
+
+    Returns
+    specs - list of dictionaries with the well nest, well name, observed heads
+    relative to the land surface datum, and initial d (steady state head)
+    """
+    # Reading in land surface elevation and steady state heads once
+    landsurf_data = bkk_cache.read_excel(os.path.join(
+        tot_path, "LandSurfElev_GWWellLocs.xlsx"),
+                                         sheet_name="2.1",
+                                         usecols="C:F",
+                                         index_col=0)
+    SS_data = bkk_cache.read_excel(os.path.join(tot_path,
+                                                "SS_Head_GWWellLocs.xlsx"),
+                                   sheet_name="SS_Py",
+                                   index_col=0)
+
+    specs = []
+
+    # For each well nest
+    for Wellnest_name in wellnestlist:
+
+        # Reading in groundwater data
+        data = bkk_cache.read_excel(os.path.join(tot_path,
+                                                 Wellnest_name + ".xlsx"),
+                                    skiprows=3)
+
+        # For all wells in well nest
+        for well_name in data.columns[-(len(data.columns)-2):]:
+
+            # Head data relative to 0 m for specific well
+            _, gw_well_head = mfs.GW_Data_Process(data, well_name)
+
+            # Correcting head relative to 0 m to be head relative to a
+            # global datum
+            gw_well_head.Head += (landsurf_data.RASTERVALU.loc[Wellnest_name])
+
+            # If GW well does not have data, skips this well
+            if gw_well_head.Head.isnull().all():
+                print("\nSkipping ", well_name,
+                      "because no head values in time period\n\n\n")
+                continue
+
+            # Getting steady state heads according to aquifer
+            aquifer = [aq for aq in ["BK", "PD", "NL", "NB"]
+                       if aq in well_name][0]
+
+            specs.append({"wellnest": Wellnest_name,
+                          "well": well_name,
+                          "head": gw_well_head.Head,
+                          "initial_d": SS_data.loc[Wellnest_name, aquifer]})
+
+    return specs
+
+
+def previous_model(catalog, wellnest, well_name):
+    """Path of the latest Pastas model file of a well, None if there is none.
+
+    catalog - bkk_catalog.WellCatalog of the models folder
+    Models of later calibration periods are sorted last by file name
+    """
+    modelfile = catalog.model_file(wellnest, well_name)
+
+    return None if modelfile is None else \
+        os.path.join(catalog.models_path, modelfile)
+
+
+# %%###########################################################################
+# Calibrating
+###############################################################################
+
+def calibrate_well(spec, pump, modelpath, calitime_min, calitime_max,
+                   noise_TF=True, pump_rfunc=None, prev_model=None):
+    """Create, solve and save the Pastas model of one well.
+
+    Runs in a worker process
+    spec - well specification from well_specs
+    pump - basin-wide pumping time series
+    modelpath - folder to save the model to
+    calitime_min, calitime_max - (str) calibration period
+    noise_TF - if using a noise model in the second solve
+    pump_rfunc - pumping response function, ps.Gamma() if None
+    prev_model - path to a previous model of the well; if given, its optimal
+    parameters are the initial parameters (warm start) and, if it already had a
+    noise model, the solve without noise is skipped
+
+    Returns
+    stats - dictionary of the fit time, number of function evaluations,
+    and fit statistics of the well (error message if the fit failed)
+    """
+    # Ignoring Pastas warnings
+    warnings.simplefilter(action="ignore", category=FutureWarning)
+
+    start = time.time()
+
+    stats = {"wellnest": spec["wellnest"],
+             "well": spec["well"],
+             "file": model_filename(spec["wellnest"], spec["well"],
+                                    calitime_min, calitime_max),
+             "fit_time": np.nan, "nfev": np.nan, "rsq": np.nan,
+             "rmse": np.nan, "evp": np.nan, "aic": np.nan, "error": ""}
+
+    # Initializing model
+    model = ps.Model(spec["head"])
+
+    # Setting d parameter to SS heads and to vary +/- initial estimates
+    initial_d = spec["initial_d"]
+    model.set_parameter(name="constant_d",
+                        initial=initial_d,
+                        pmin=initial_d-10,
+                        pmax=initial_d+10,
+                        vary=True)
+
+    # Adding basin-wide pumping
+    rfunc = ps.Gamma() if pump_rfunc is None else pump_rfunc
+    model.add_stressmodel(ps.StressModel(pump, rfunc=rfunc,
+                                         name="well", settings="well",
+                                         up=False))
+
+    # If warm starting from the previous model
+    prev_noise = False
+    if prev_model is not None:
+
+        prev = ps.io.load(prev_model)
+        optimal = prev.parameters.optimal
+
+        # Previous optimal parameters as initial parameters, within bounds
+        names = model.parameters.index.intersection(optimal.index)
+        model.parameters.loc[names, "initial"] = optimal[names].clip(
+            model.parameters.loc[names, "pmin"],
+            model.parameters.loc[names, "pmax"])
+
+        # If previous model was already solved with a noise model
+        prev_noise = prev.noisemodel is not None and prev.settings["noise"]
+
+    try:
+
+        # If warm started with noise parameters, only solving with noise
+        if noise_TF and prev_noise:
+
+            model.solve(tmin=calitime_min, tmax=calitime_max,
+                        report=False, noise=noise_TF,
+                        solver=ps.LeastSquares(), warmup=365*30)
+            nfev = model.solver.nfev
+
+        else:
+
+            # First run is not with noise model
+            # Gets first parameter estimates
+            # Warm up is 30 years
+            model.solve(tmin=calitime_min, tmax=calitime_max,
+                        report=False, noise=False,
+                        solver=ps.LeastSquares(), warmup=365*30)
+            nfev = model.solver.nfev
+
+            # Second run with noise model using initial parameters as the
+            # calibrated parameters from first run
+            model.solve(tmin=calitime_min, tmax=calitime_max,
+                        initial=False, report=False,
+                        noise=noise_TF, solver=ps.LeastSquares(),
+                        warmup=365*30)
+            nfev += model.solver.nfev
+
+    # If time series out of bounds
+    except ValueError as err:
+
+        stats["error"] = str(err)
+
+        return stats
+
+    # Saving model to a temporary file first so that a stopped run does not
+    # leave a broken model file
+    fname = os.path.join(modelpath, stats["file"])
+    tmpname = os.path.join(modelpath, "." + stats["file"])
+    model.to_file(tmpname)
+    os.replace(tmpname, fname)
+
+    stats.update({"fit_time": time.time() - start,
+                  "nfev": nfev,
+                  "rsq": model.stats.rsq(),
+                  "rmse": model.stats.rmse(),
+                  "evp": model.stats.evp(),
+                  "aic": model.stats.aic()})
+
+    return stats
+
+
+def calibrate_wells(wellnestlist, tot_path, modelpath, pumppath, pumpsheet,
+                    calitime_min, calitime_max, noise_TF=True, n_jobs=None,
+                    resume=True, pump_rfunc=None, warm_start=False):
+    """Calibrate the Pastas models of all wells on a process pool.
+
+    Must be called under if __name__ == "__main__" in scripts
+    wellnestlist - list of well nests
+    tot_path - path to inputs
+    modelpath - folder to save models and calibration statistics to
+    pumppath - path to pumping excel sheet
+    pumpsheet - sheet of pumping scenario
+    calitime_min, calitime_max - (str) calibration period
+    noise_TF - if using a noise model
+    n_jobs - number of processes, number of processors if None
+    resume - if True, wells with a saved model and statistics are not
+    calibrated again, unless their observations changed since (hash of the
+    observed heads, obs_hash in the statistics)
+    pump_rfunc - pumping response function, ps.Gamma() if None
+    warm_start - if True, recalibrating from the optimal parameters of the
+    latest model of each well (e.g. after adding observations or changing
+    calitime_max); statistics are saved to recalibration_stats_*.csv with the
+    number of function evaluations of the first calibration
+
+    Returns
+    stats - dataframe of the fit time and statistics of each well
+    """
+    # First calibration or recalibration statistics
+    statsname = "recalibration_stats_" if warm_start else "calibration_stats_"
+    statspath = os.path.join(modelpath, statsname + calitime_min +
+                             "_" + calitime_max + ".csv")
+
+    # Observed heads of each well and their hash
+    specs = well_specs(wellnestlist, tot_path)
+    obs_hash = {model_filename(spec["wellnest"], spec["well"], calitime_min,
+                               calitime_max): bkk_cache.hash_series(
+                                   spec["head"]) for spec in specs}
+
+    # Wells already calibrated with the same observations
+    done = set()
+    prev = None
+    if resume and os.path.exists(statspath):
+        prev = pd.read_csv(statspath, keep_default_na=False, dtype=str)
+
+    if prev is not None and "obs_hash" in prev.columns:
+
+        # Latest statistics of each well
+        prev = prev.drop_duplicates(subset="file", keep="last")
+        done = set(prev.file[(prev.error == "") & np.array(
+            [os.path.exists(os.path.join(modelpath, f)) and
+             obs_hash.get(f) == h
+             for f, h in zip(prev.file, prev.obs_hash)])])
+
+    # Starting over (also if saved without the hash of the observations)
+    elif os.path.exists(statspath):
+        os.remove(statspath)
+
+    os.makedirs(modelpath, exist_ok=True)
+
+    # Daily interpolated and estimated pumping rates for the basin
+    pump = bkk_cache.read_excel(pumppath, sheet_name=pumpsheet,
+                                index_col=0, parse_dates=["Date"]).Pump
+
+    specs = [spec for spec in specs
+             if model_filename(spec["wellnest"], spec["well"], calitime_min,
+                               calitime_max) not in done]
+
+    print("\nCalibrating " + str(len(specs)) + " wells (" + str(len(done)) +
+          " already calibrated)\n")
+
+    # Previous models and number of function evaluations of the latest first
+    # calibration of each well
+    prev_models = [None] * len(specs)
+    nfev_first = {}
+    if warm_start:
+
+        catalog = bkk_catalog.load_catalog(tot_path, modelpath)
+        prev_models = [previous_model(catalog, spec["wellnest"],
+                                      spec["well"]) for spec in specs]
+
+        firstfiles = sorted([os.path.join(modelpath, f)
+                             for f in os.listdir(modelpath)
+                             if f.startswith("calibration_stats_")],
+                            key=os.path.getmtime)
+        for firstfile in firstfiles:
+            first = pd.read_csv(firstfile).dropna(subset=["nfev"])
+            nfev_first.update(zip(zip(first.wellnest, first.well),
+                                  first.nfev))
+
+    start = time.time()
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+
+        futures = {pool.submit(calibrate_well, spec, pump, modelpath,
+                               calitime_min, calitime_max, noise_TF,
+                               pump_rfunc, prev_model): prev_model
+                   for spec, prev_model in zip(specs, prev_models)}
+
+        # Saving statistics as soon as each well is done
+        for future in as_completed(futures):
+
+            stats = future.result()
+
+            # Observations the well was calibrated on
+            stats["obs_hash"] = obs_hash[stats["file"]]
+
+            # If warm started, saving which model and the first calibration
+            if warm_start:
+                prev_model = futures[future]
+                stats["prev_model"] = "" if prev_model is None else \
+                    os.path.basename(prev_model)
+                stats["nfev_first"] = nfev_first.get((stats["wellnest"],
+                                                      stats["well"]), np.nan)
+
+            pd.DataFrame([stats]).to_csv(statspath, mode="a", index=False,
+                                         header=not os.path.exists(statspath))
+
+            if stats["error"]:
+                print("Failed " + stats["file"] + ": " + stats["error"])
+            else:
+                print("Calibrated " + stats["file"] + " in " +
+                      "%.1f" % stats["fit_time"] + " s, RMSE " +
+                      "%.2f" % stats["rmse"] + " m, " +
+                      str(stats["nfev"]) + " function evaluations")
+
+    print("\nCalibration done in " + "%.1f" % (time.time() - start) + " s\n")
+
+    # Latest statistics of each well
+    stats = pd.read_csv(statspath, keep_default_na=False,
+                        na_values=[""]).drop_duplicates(subset="file",
+                                                        keep="last")
+    stats["error"] = stats.error.fillna("")
+
+    # Drop in the number of function evaluations from warm starting
+    if warm_start:
+
+        both = stats.nfev.notna() & stats.nfev_first.notna()
+        nfev, nfev_first = stats.nfev[both].sum(), stats.nfev_first[both].sum()
+
+        if nfev_first > 0:
+            print("Function evaluations: " + "%d" % nfev + " warm started vs " +
+                  "%d" % nfev_first + " in the first calibration (" +
+                  "%.0f" % ((1 - nfev / nfev_first) * 100) + "% fewer, " +
+                  str(both.sum()) + " wells)\n")
+
+    return stats.reset_index(drop=True)
@@ -0,0 +1,231 @@
+# ##############################################################################
+"""Catalog of the well nests, wells and Pastas models in inputs and models.
+
+The inputs and models folders are scanned once for the observation sheet,
+wells, aquifers, Pastas model files and coordinates of each well nest. The
+catalog is saved to disk and only scanned again when the files it was built
+from change, so finding the wells or models of a well nest is a dictionary
+lookup instead of listing and filtering the folders.
+
+Article Title: Hybrid data-driven, physics-based modeling of ground-
+water and subsidence with application to Bangkok, Thailand
+
+Jenny Soonthornrangsan 2023
+TU Delft
+
+"""
+# ##############################################################################
+
+###############################################################################
+# import statements
+###############################################################################
+
+import os
+import json
+
+# Cached reading of excel inputs
+from bkk_sub_gw import bkk_cache
+
+# Catalog file (relative to the working directory, like the other caches of the
+# scripts)
+CATALOG_PATH = os.path.join("cache", "catalog.json")
+
+# Aquifers from shallowest to deepest
+AQUIFERS = ["BK", "PD", "NL", "NB"]
+
+# Spatial coordinates of the wells
+LOCATIONS_FILE = "GroundwaterWellLocs.xls"
+
+# Catalogs already loaded in this session, keyed by (inputs path, models path)
+_catalogs = {}
+
+
+# %%###########################################################################
+# Catalog
+###############################################################################
+
+class WellCatalog:
+    """Index of well nest -> wells -> aquifer, model files, and of each well
+    nest's observation sheet and coordinates.
+
+    Well nests are those with an observation sheet (inputs/LC*.xlsx). Wells are
+    in the order of the sheet. Model file names are relative to models_path.
+    """
+
+    def __init__(self, inputs_path, models_path, index):
+
+        self.inputs_path = inputs_path  # Folder of inputs
+        self.models_path = models_path  # Folder of Pastas models
+        self.index = index  # Well nests (dictionary from scan)
+
+    def __contains__(self, wellnest):
+
+        return wellnest in self.index["wellnests"]
+
+    def wellnests(self):
+        """Well nests with an observation sheet."""
+        return list(self.index["wellnests"])
+
+    def wells(self, wellnest):
+        """Wells of a well nest in the order of its observation sheet."""
+        return list(self.index["wellnests"][wellnest]["wells"])
+
+    def aquifer(self, wellnest, well):
+        """Aquifer (BK, PD, NL, NB) of a well."""
+        return self.index["wellnests"][wellnest]["wells"][well]["aquifer"]
+
+    def observation_sheet(self, wellnest):
+        """Path of the observation sheet of a well nest."""
+        return os.path.join(self.inputs_path,
+                            self.index["wellnests"][wellnest]["sheet"])
+
+    def coordinates(self, wellnest):
+        """(Long, Lat) of a well nest, None if not in GroundwaterWellLocs."""
+        coords = self.index["locations"].get(wellnest)
+
+        return None if coords is None else tuple(coords)
+
+    def model_file(self, wellnest, well):
+        """Latest Pastas model file of a well, None if there is none.
+
+        Models of later calibration periods are sorted last by file name
+        """
+        models = self.index["models"].get(wellnest, {}).get(well, [])
+
+        return models[-1] if models else None
+
+    def model_files(self, wellnest):
+        """Latest Pastas model file of each well of a well nest with a model,
+        from the shallowest to the deepest aquifer.
+        """
+        models = self.index["models"].get(wellnest, {})
+
+        return [files[-1] for aquifer in AQUIFERS
+                for well, files in models.items()
+                if well_aquifer(well) == aquifer]
+
+
+# %%###########################################################################
+# Scanning
+###############################################################################
+
+def well_aquifer(well):
+    """Aquifer of a well from its name (e.g. PD32 -> PD), None if unknown."""
+    aquifers = [aq for aq in AQUIFERS if aq in well]
+
+    return aquifers[0] if aquifers else None
+
+
+def signature(inputs_path, models_path):
+    """Names, sizes and modification times of the files the catalog is built
+    from. Only the folder listings and file stats are read.
+    """
+    sheets = [[f.name, f.stat().st_size, f.stat().st_mtime_ns]
+              for f in os.scandir(inputs_path)
+              if f.name == LOCATIONS_FILE or is_sheet(f.name)]
+    models = [f for f in os.listdir(models_path) if f.endswith("_model.pas")]
+
+    return {"inputs": sorted(sheets), "models": sorted(models)}
+
+
+def is_sheet(filename):
+    """True if a file in inputs is an observation sheet of a well nest."""
+    return filename.startswith("LC") and "_" not in filename and \
+        filename.endswith(".xlsx")
+
+
+def scan(inputs_path, models_path):
+    """Build the catalog index from the inputs and models folders.
+
+    inputs_path - folder with the observation sheets and GroundwaterWellLocs
+    models_path - folder with the Pastas models
+
+    Returns
+    index - dictionary of the well nests, their models and locations
+    """
+    wellnests = {}
+
+    # Observation sheets and their wells
+    for sheet in sorted(f for f in os.listdir(inputs_path) if is_sheet(f)):
+
+        data = bkk_cache.read_excel(os.path.join(inputs_path, sheet),
+                                    skiprows=3)
+        wells = data.columns[-(len(data.columns)-2):]
+        wellnests[sheet.replace(".xlsx", "")] = {
+            "sheet": sheet,
+            "wells": {well: {"aquifer": well_aquifer(well)} for well in wells}}
+
+    # Pastas model files of each well: <wellnest>_<well>_GW_<tmin>_<tmax>
+    models = {}
+    for modelfile in sorted(f for f in os.listdir(models_path)
+                            if f.endswith("_model.pas") and "_GW_" in f):
+
+        name = modelfile[:modelfile.find("_GW_")]
+        wellnest, well = name[:name.find("_")], name[name.find("_")+1:]
+        models.setdefault(wellnest, {}).setdefault(well, []).append(modelfile)
+
+    # Coordinates of each well nest (first well of the well nest)
+    locations = {}
+    locs_file = os.path.join(inputs_path, LOCATIONS_FILE)
+    if os.path.exists(locs_file):
+        gwwell_locs = bkk_cache.read_excel(locs_file)
+        gwwell_locs = gwwell_locs.drop_duplicates("WellNest_Name",
+                                                  keep="first")
+        locations = {name: [float(x), float(y)] for name, x, y in
+                     zip(gwwell_locs.WellNest_Name, gwwell_locs.Long,
+                         gwwell_locs.Lat)}
+
+    return {"wellnests": wellnests, "models": models, "locations": locations}
+
+
+def load_catalog(inputs_path=None, models_path=None):
+    """Catalog of the well nests, scanned again only if inputs or models
+    changed.
+
+    inputs_path - folder of inputs, inputs in the working directory if None
+    models_path - folder of Pastas models, models in the working directory if
+    None
+
+    Returns
+    catalog - WellCatalog
+    """
+    if inputs_path is None:
+        inputs_path = os.path.abspath("inputs")
+    if models_path is None:
+        models_path = os.path.abspath("models")
+    inputs_path = os.path.abspath(inputs_path)
+    models_path = os.path.abspath(models_path)
+
+    key = (inputs_path, models_path)
+    sig = signature(inputs_path, models_path)
+
+    # If loaded in this session and nothing changed
+    if key in _catalogs and _catalogs[key][0] == sig:
+        return _catalogs[key][1]
+
+    # Saved catalogs, by folders
+    saved = {}
+    if os.path.exists(CATALOG_PATH):
+        with open(CATALOG_PATH) as f:
+            saved = json.load(f)
+
+    entry = saved.get("|".join(key))
+
+    # If not saved or inputs or models changed
+    if entry is None or entry["signature"] != sig:
+
+        entry = {"signature": sig, "index": scan(inputs_path, models_path)}
+        saved["|".join(key)] = entry
+
+        # Writes to a temporary file first so that a stopped run does not leave
+        # a broken catalog
+        os.makedirs(os.path.dirname(CATALOG_PATH), exist_ok=True)
+        tmpname = CATALOG_PATH + ".tmp"
+        with open(tmpname, "w") as f:
+            json.dump(saved, f, indent=1)
+        os.replace(tmpname, CATALOG_PATH)
+
+    _catalogs[key] = (sig, WellCatalog(inputs_path, models_path,
+                                       entry["index"]))
+
+    return _catalogs[key][1]
@@ -0,0 +1,454 @@
+# ##############################################################################
+"""Append-only store of observed groundwater heads from the TGMS portal.
+
+Each well has two column files (dates and heads) that new observations are
+appended to, and each well nest has a watermark: the last date ingested. An
+export from http://tgms.dgr.go.th/ is ingested by processing only the rows after
+the watermark, so the whole history of a well nest is not processed again. The
+first new date of the last ingest is kept for reporting. Cached subsidence runs
+are keyed on the observations up to the end of their window (window_key), so
+observations ingested after the end of a run do not invalidate it. Outliers of
+all wells are screened in one batch with a rolling Hampel filter and the masks
+are saved next to the observations.
+
+Article Title: Hybrid data-driven, physics-based modeling of ground-
+water and subsidence with application to Bangkok, Thailand
+
+Jenny Soonthornrangsan 2023
+TU Delft
+
+"""
+# ##############################################################################
+
+###############################################################################
+# import statements
+###############################################################################
+
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+# Importing script for pre-processing Thai GW data
+import main_functions as mfs
+
+# Cached reading of excel inputs
+from bkk_sub_gw import bkk_cache
+
+
+# %%###########################################################################
+# Observation store
+###############################################################################
+
+class ObservationStore:
+    """Observed heads (relative to 0 m, not depth to water) of each well.
+
+    Dates (days, int64) and heads (float64) of a well are saved in
+    <wellnest>_<well>.date.i8 and <wellnest>_<well>.head.f8 and only appended
+    to. index.json has, for each well nest, its wells, the number of
+    observations of each well, the watermark and the first new date of the last
+    ingest. It is written last, so observations appended by a stopped ingest
+    are ignored.
+    """
+
+    def __init__(self, path):
+
+        self.path = path  # Folder of the store
+
+        os.makedirs(path, exist_ok=True)
+
+        # Well nests in the store
+        self.index = {}
+        if os.path.exists(self._index_file()):
+            with open(self._index_file()) as f:
+                self.index = json.load(f)
+
+    def _index_file(self):
+        """Path of index.json."""
+        return os.path.join(self.path, "index.json")
+
+    def _files(self, wellnest, well):
+        """Paths of the date and head column files of a well."""
+        name = os.path.join(self.path, wellnest + "_" + well)
+
+        return name + ".date.i8", name + ".head.f8"
+
+    def _mask_file(self, wellnest, well):
+        """Path of the outlier mask file of a well."""
+        return os.path.join(self.path, wellnest + "_" + well + ".mask.b1")
+
+    def __contains__(self, wellnest):
+
+        return wellnest in self.index
+
+    def wells(self, wellnest):
+        """Wells of a well nest in the order of the TGMS export."""
+        return list(self.index[wellnest]["wells"])
+
+    def watermark(self, wellnest):
+        """Last date ingested for a well nest, None if not ingested yet."""
+        if wellnest not in self.index:
+            return None
+
+        return pd.Timestamp(self.index[wellnest]["watermark"])
+
+    def changed_from(self, wellnest):
+        """First date added by the last ingest of a well nest, None if not
+        ingested yet.
+
+        Runs ending before this date are only out of date if no observation
+        after their end was ingested before (see window_key).
+        """
+        if wellnest not in self.index:
+            return None
+
+        return pd.Timestamp(self.index[wellnest]["changed_from"])
+
+    def window_key(self, wellnest, tmax=None):
+        """Hash of the observations of a well nest a run up to year tmax uses.
+
+        Heads up to the end of tmax are interpolated from the observations
+        before the end of tmax and the first observation after it, so only
+        these are hashed; observations ingested later than that do not change
+        the key.
+        wellnest - (str) name of well nest
+        tmax - (str) last year of the run, all observations if None
+
+        Returns
+        key - (str) hex digest
+        """
+        sha = hashlib.sha1()
+
+        for well in self.wells(wellnest):
+
+            date_file, head_file = self._files(wellnest, well)
+            num = self.index[wellnest]["count"][well]
+            dates = np.fromfile(date_file, dtype=np.int64, count=num)
+            heads = np.fromfile(head_file, dtype=np.float64, count=num)
+
+            # Observations before the end of tmax and the first one after
+            if tmax is not None:
+                end = np.datetime64(str(int(tmax) + 1) + "-01-01", "D").astype(
+                    np.int64)
+                used = dates < end
+                if (~used).any():
+                    used[np.flatnonzero(~used)[dates[~used].argmin()]] = True
+                dates, heads = dates[used], heads[used]
+
+            sha.update(well.encode())
+            sha.update(dates.tobytes())
+            sha.update(heads.tobytes())
+
+        return sha.hexdigest()
+
+    def get(self, wellnest, well):
+        """Series of observed heads of one well.
+
+        wellnest - (str) name of well nest
+        well - (str) name of well
+        """
+        date_file, head_file = self._files(wellnest, well)
+        num = self.index[wellnest]["count"][well]
+
+        # Only the observations recorded in the index
+        dates = np.fromfile(date_file, dtype=np.int64, count=num)
+        heads = np.fromfile(head_file, dtype=np.float64, count=num)
+
+        return pd.Series(heads, index=pd.DatetimeIndex(
+            dates.astype("datetime64[D]").astype("datetime64[ns]"),
+            name="EngDate"), name=well)
+
+    def frame(self, wellnest, clean=False):
+        """Dataframe of observed heads of all wells of a well nest, one column
+        per well, NaN where a well has no observation.
+
+        wellnest - (str) name of well nest
+        clean - if True, outliers from the last screen_outliers are removed
+        """
+        return pd.concat([self.clean(wellnest, well) if clean else
+                          self.get(wellnest, well)
+                          for well in self.wells(wellnest)], axis=1)
+
+    def mask(self, wellnest, well, window_size=None, n_sigma=None):
+        """Outlier mask of one well saved by screen_outliers.
+
+        wellnest - (str) name of well nest
+        well - (str) name of well
+        window_size, n_sigma - if given, the mask must have been screened with
+        these settings
+
+        Returns
+        mask - boolean array (True for outliers), None if not screened since
+        the last ingest of the well
+        """
+        screen = self.index[wellnest].get("screen", {}).get(well)
+
+        # If not screened or observations appended since
+        if screen is None or \
+                screen["count"] != self.index[wellnest]["count"][well]:
+            return None
+        if window_size is not None and screen["window_size"] != window_size:
+            return None
+        if n_sigma is not None and screen["n_sigma"] != n_sigma:
+            return None
+
+        return np.fromfile(self._mask_file(wellnest, well), dtype=np.bool_,
+                           count=screen["count"])
+
+    def clean(self, wellnest, well):
+        """Series of observed heads of one well without outliers.
+
+        All observations if the well has not been screened since its last
+        ingest.
+        """
+        head = self.get(wellnest, well)
+        mask = self.mask(wellnest, well)
+
+        if mask is None:
+            return head
+
+        return head[~mask]
+
+    def save_masks(self, masks, window_size, n_sigma):
+        """Save outlier masks of wells next to their observations.
+
+        masks - dictionary of boolean arrays keyed by (wellnest, well)
+        window_size, n_sigma - settings of the Hampel filter
+        """
+        for (wellnest, well), mask in masks.items():
+
+            mask.astype(np.bool_).tofile(self._mask_file(wellnest, well))
+            self.index[wellnest].setdefault("screen", {})[well] = {
+                "count": len(mask),
+                "window_size": window_size,
+                "n_sigma": n_sigma}
+
+        self._write_index()
+
+    def _write_index(self):
+        """Write index.json (to a temporary file first)."""
+        tmpname = self._index_file() + ".tmp"
+        with open(tmpname, "w") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmpname, self._index_file())
+
+    def append(self, wellnest, all_data):
+        """Append new observations of a well nest and move its watermark.
+
+        wellnest - (str) name of well nest
+        all_data - dataframe from GW_Data_Process of the new rows only (EngDate
+        and one column of heads per well)
+
+        Returns
+        changed_from - first new date, None if nothing after the watermark
+        """
+        watermark = self.watermark(wellnest)
+
+        # Only dates after the watermark
+        dates = pd.DatetimeIndex(all_data.EngDate)
+        if watermark is not None:
+            all_data = all_data[dates > watermark]
+            dates = dates[dates > watermark]
+
+        if len(dates) == 0:
+            return None
+
+        # Wells of the well nest
+        wells = [well for well in all_data.columns if well != "EngDate"]
+        entry = self.index.get(wellnest, {"wells": [], "count": {}})
+
+        # For each well
+        for well in wells:
+
+            if well not in entry["wells"]:
+                entry["wells"].append(well)
+                entry["count"][well] = 0
+
+            # Observations with heads
+            heads = all_data[well].values.astype(float)
+            valid = ~np.isnan(heads)
+            days = dates.values.astype("datetime64[D]").astype(np.int64)
+
+            date_file, head_file = self._files(wellnest, well)
+
+            # Removing anything appended by a stopped ingest before appending
+            for fname, itemsize in [(date_file, 8), (head_file, 8)]:
+                if os.path.exists(fname):
+                    with open(fname, "r+b") as f:
+                        f.truncate(entry["count"][well] * itemsize)
+
+            with open(date_file, "ab") as f:
+                days[valid].tofile(f)
+            with open(head_file, "ab") as f:
+                heads[valid].tofile(f)
+
+            entry["count"][well] += int(valid.sum())
+
+        # New watermark and first new date
+        changed_from = dates.min()
+        entry["watermark"] = str(dates.max().date())
+        entry["changed_from"] = str(changed_from.date())
+        self.index[wellnest] = entry
+
+        # Index written last
+        self._write_index()
+
+        return changed_from
+
+
+# %%###########################################################################
+# Ingesting TGMS exports
+###############################################################################
+
+def ingest_tgms(store, excel_path, wellnest=None):
+    """Ingest the observations of a TGMS export newer than the watermark.
+
+    store - ObservationStore
+    excel_path - path to the excel export of one well nest (same format as
+    inputs/LC*.xlsx)
+    wellnest - (str) name of well nest, excel file name if None
+
+    Returns
+    changed_from - first new date, None if no new observations
+    """
+    if wellnest is None:
+        wellnest = os.path.splitext(os.path.basename(excel_path))[0]
+
+    data = bkk_cache.read_excel(excel_path, skiprows=3)
+
+    # Last five lines of the export are not observations
+    rows = data.iloc[0:len(data)-5]
+    footer = data.iloc[len(data)-5:]
+
+    # Only rows after the watermark are processed
+    watermark = store.watermark(wellnest)
+    if watermark is not None:
+        dates = mfs.Thai_Dates(rows.iloc[:, 1])
+        rows = rows[(dates > watermark).values]
+
+    if len(rows) == 0:
+        print("Ingest: " + wellnest + " has no observations after " +
+              str(watermark.date()))
+        return None
+
+    # Head data relative to 0 m of the new rows
+    all_data, _ = mfs.GW_Data_Process(pd.concat([rows, footer]))
+    changed_from = store.append(wellnest, all_data)
+
+    print("Ingest: " + wellnest + " " + str(len(rows)) + " new rows from " +
+          str(changed_from.date()) + " to " + str(store.watermark(wellnest).
+                                                  date()))
+
+    return changed_from
+
+
+# %%###########################################################################
+# Outlier screening
+###############################################################################
+
+def hampel_mask(values, window_size=5, n_sigma=3.0, chunk=2**24):
+    """Rolling Hampel filter of many series at once.
+
+    A point is an outlier if it is further than n_sigma * 1.4826 * MAD from
+    the median of the window centred on it (MAD is the median absolute
+    deviation in the window). Same as hampel.hampel, but every window of every
+    series is taken from one strided view and the medians are computed
+    together. The first and last window_size // 2 points of a series are not
+    screened, and neither are points with a NaN in their window, so series of
+    different lengths can be padded with NaN.
+    values - array of series (series, time) or one series
+    window_size - number of points in the window (odd)
+    n_sigma - number of standard deviations for an outlier
+    chunk - maximum number of window values in memory at once
+
+    Returns
+    mask - boolean array the shape of values, True for outliers
+    """
+    values = np.asarray(values, dtype=float)
+    single = values.ndim == 1
+    values = np.atleast_2d(values)
+
+    half_window = window_size // 2
+    mask = np.zeros(values.shape, dtype=bool)
+
+    # If series shorter than one window
+    if values.shape[1] < 2 * half_window + 1:
+        return mask[0] if single else mask
+
+    # Windows (series, centre, window) without copying
+    windows = np.lib.stride_tricks.sliding_window_view(
+        values, 2 * half_window + 1, axis=1)
+
+    # Series per step so that the windows copied by median stay below chunk
+    step = max(1, chunk // (windows.shape[1] * windows.shape[2]))
+
+    for start in range(0, len(values), step):
+
+        window = windows[start:start+step]
+        centre = values[start:start+step, half_window:
+                        values.shape[1]-half_window]
+
+        # Median and MAD of each window, NaN if NaN in the window
+        median = np.median(window, axis=2)
+        mad = np.median(np.abs(window - median[:, :, None]), axis=2)
+
+        # Comparisons with NaN are False, so windows with NaN are not outliers
+        mask[start:start+step, half_window:values.shape[1]-half_window] = \
+            np.abs(centre - median) > n_sigma * 1.4826 * mad
+
+    return mask[0] if single else mask
+
+
+def screen_outliers(store, wellnestlist=None, window_size=5, n_sigma=3.0):
+    """Screen the observed heads of all wells for outliers in one batch.
+
+    The observations of all wells (in the order observed) are padded with NaN
+    to the longest well and filtered together with hampel_mask. Wells already
+    screened with the same settings since their last ingest are not screened
+    again. Masks are saved in the store.
+    store - ObservationStore
+    wellnestlist - list of well nests, all well nests in the store if None
+    window_size - number of observations in the Hampel window
+    n_sigma - number of standard deviations for an outlier
+
+    Returns
+    masks - dictionary of boolean arrays (True for outliers) keyed by
+    (wellnest, well)
+    """
+    if wellnestlist is None:
+        wellnestlist = list(store.index)
+
+    masks = {}  # Outlier masks
+    todo = []  # Wells to screen
+
+    # For each well
+    for wellnest in wellnestlist:
+        for well in store.wells(wellnest):
+
+            mask = store.mask(wellnest, well, window_size, n_sigma)
+
+            if mask is None:
+                todo.append((wellnest, well))
+            else:
+                masks[(wellnest, well)] = mask
+
+    if len(todo) > 0:
+
+        # Observations of all wells, padded with NaN
+        heads = [store.get(wellnest, well).values for wellnest, well in todo]
+        values = np.full((len(heads), max(len(h) for h in heads)), np.nan)
+        for i, head in enumerate(heads):
+            values[i, :len(head)] = head
+
+        batch = hampel_mask(values, window_size, n_sigma)
+
+        new = {key: batch[i, :len(heads[i])] for i, key in enumerate(todo)}
+        store.save_masks(new, window_size, n_sigma)
+        masks.update(new)
+
+    print("Outliers: " + str(len(todo)) + " wells screened, " +
+          str(len(masks) - len(todo)) + " already screened, " +
+          str(sum(int(m.sum()) for m in masks.values())) + " outliers")
+
+    return masks
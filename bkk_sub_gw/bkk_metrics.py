@@ -0,0 +1,260 @@
+# ##############################################################################
+"""Skill of simulated against observed subsidence and groundwater.
+
+RMSE, NSE, KGE and bias are computed for all well nests (or wells) and periods
+in one call on padded (..., time) arrays, where NaN marks a time without an
+observation. Bootstrap confidence intervals resample the observation times of
+each series, in chunks of resamples that can be run in parallel. Skill of
+annual subsidence against the benchmark leveling feeds the bar graphs and the
+RMSE map; skill of the Pastas models feeds the groundwater maps.
+
+Article Title: Hybrid data-driven, physics-based modeling of ground-
+water and subsidence with application to Bangkok, Thailand
+
+Jenny Soonthornrangsan 2023
+TU Delft
+
+"""
+# ##############################################################################
+
+###############################################################################
+# import statements
+###############################################################################
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Benchmark leveling
+from bkk_sub_gw import bkk_sub
+
+# Skill metrics
+# rmse - root mean squared error
+# nse - Nash-Sutcliffe efficiency
+# kge - Kling-Gupta efficiency
+# bias - mean of simulated - observed
+METRICS = ["rmse", "nse", "kge", "bias"]
+
+
+# %%###########################################################################
+# Metrics
+###############################################################################
+
+def skill(sim, obs):
+    """Skill metrics of simulated against observed values along the last axis.
+
+    sim - array (..., time) of simulated values
+    obs - array (..., time) of observed values, NaN if not observed (times
+    with NaN in sim are not used either)
+
+    Returns
+    metrics - dictionary of arrays (...) of each of METRICS and n, the number
+    of observations used; NaN where there are no observations
+    """
+    sim, obs = np.broadcast_arrays(np.asarray(sim, dtype=float),
+                                   np.asarray(obs, dtype=float))
+    valid = np.isfinite(sim) & np.isfinite(obs)
+    n = valid.sum(axis=-1)
+
+    # Times without observations add zero to all sums
+    with np.errstate(invalid="ignore", divide="ignore"):
+
+        err = np.where(valid, sim - obs, 0.)
+        mean_sim = np.where(valid, sim, 0.).sum(axis=-1) / n
+        mean_obs = np.where(valid, obs, 0.).sum(axis=-1) / n
+        dev_sim = np.where(valid, sim - mean_sim[..., None], 0.)
+        dev_obs = np.where(valid, obs - mean_obs[..., None], 0.)
+        var_sim = np.sum(dev_sim**2, axis=-1)
+        var_obs = np.sum(dev_obs**2, axis=-1)
+
+        # Correlation, variability and bias ratios of KGE
+        r = np.sum(dev_sim * dev_obs, axis=-1) / np.sqrt(var_sim * var_obs)
+        alpha = np.sqrt(var_sim / var_obs)
+        beta = mean_sim / mean_obs
+
+        metrics = {"rmse": np.sqrt(np.sum(err**2, axis=-1) / n),
+                   "nse": 1 - np.sum(err**2, axis=-1) / var_obs,
+                   "kge": 1 - np.sqrt((r - 1)**2 + (alpha - 1)**2 +
+                                      (beta - 1)**2),
+                   "bias": np.sum(err, axis=-1) / n,
+                   "n": n}
+
+    return metrics
+
+
+def _bootstrap_chunk(sim, obs, n, seed, chunk, size):
+    """Metrics of size resamples of compacted series (see bootstrap)."""
+    rng = np.random.default_rng([seed, chunk])
+
+    # Random observation of each series for each position; positions after
+    # the number of observations of a series are not used
+    pick = (rng.random((size,) + sim.shape) * n[..., None]).astype(int)
+    used = np.arange(sim.shape[-1]) < n[..., None]
+    sim_b = np.where(used, np.take_along_axis(
+        np.broadcast_to(sim, pick.shape), pick, axis=-1), np.nan)
+    obs_b = np.where(used, np.take_along_axis(
+        np.broadcast_to(obs, pick.shape), pick, axis=-1), np.nan)
+
+    metrics = skill(sim_b, obs_b)
+
+    return np.stack([metrics[metric] for metric in METRICS])
+
+
+def bootstrap(sim, obs, n_boot=1000, ci=95, seed=0, n_jobs=1, chunk=100):
+    """Bootstrap confidence intervals of the skill metrics.
+
+    The observed times of each series are resampled with replacement.
+    sim, obs - arrays (..., time) as for skill
+    n_boot - number of resamples
+    ci - confidence level (%)
+    seed - seed of the random resamples (same intervals for the same seed,
+    whatever n_jobs)
+    n_jobs - number of processes; resamples are run in chunks
+    chunk - number of resamples per chunk
+
+    Returns
+    intervals - dictionary of (lower, upper) arrays (...) of each of METRICS
+    """
+    sim, obs = np.broadcast_arrays(np.asarray(sim, dtype=float),
+                                   np.asarray(obs, dtype=float))
+    valid = np.isfinite(sim) & np.isfinite(obs)
+    n = valid.sum(axis=-1)
+
+    # Observations of each series moved to the front
+    order = np.argsort(~valid, axis=-1, kind="stable")
+    sim = np.take_along_axis(sim, order, axis=-1)
+    obs = np.take_along_axis(obs, order, axis=-1)
+
+    sizes = [min(chunk, n_boot - start) for start in range(0, n_boot, chunk)]
+    args = [(sim, obs, n, seed, num, size) for num, size in enumerate(sizes)]
+
+    if n_jobs == 1:
+        results = [_bootstrap_chunk(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_bootstrap_chunk, *zip(*args)))
+
+    # (metric, resample, ...)
+    results = np.concatenate(results, axis=1)
+    with np.errstate(invalid="ignore"):
+        lower, upper = np.nanpercentile(results, [(100 - ci) / 2,
+                                                  (100 + ci) / 2], axis=1)
+
+    return {metric: (lower[num], upper[num])
+            for num, metric in enumerate(METRICS)}
+
+
+def skill_frame(labels, sim, obs, n_boot=0, ci=95, seed=0, n_jobs=1):
+    """Dataframe of the skill of each series, with bootstrap intervals.
+
+    labels - dataframe with one row per series (rows of sim and obs after
+    flattening all but the last axis)
+    sim, obs - arrays (..., time) as for skill
+    n_boot - number of bootstrap resamples; no intervals if 0
+    ci, seed, n_jobs - as for bootstrap
+
+    Returns
+    skill - labels with a column for each of METRICS and n, and if
+    bootstrapped <metric>_lower and <metric>_upper
+    """
+    frame = labels.reset_index(drop=True).copy()
+
+    metrics = skill(sim, obs)
+    for metric in METRICS + ["n"]:
+        frame[metric] = metrics[metric].ravel()
+
+    if n_boot > 0:
+        intervals = bootstrap(sim, obs, n_boot=n_boot, ci=ci, seed=seed,
+                              n_jobs=n_jobs)
+        for metric in METRICS:
+            frame[metric + "_lower"] = intervals[metric][0].ravel()
+            frame[metric + "_upper"] = intervals[metric][1].ravel()
+
+    return frame
+
+
+# %%###########################################################################
+# Subsidence and groundwater skill
+###############################################################################
+
+def sub_skill(annual_data, wellnestlist, periods, n_boot=0, ci=95, seed=0,
+              n_jobs=1):
+    """Skill of simulated annual subsidence rates against the benchmark
+    leveling, for all well nests and periods at once (cm/yr).
+
+    Years are compared at the end of each year. Years without leveling, or
+    with a leveling rate of 0, are not used (as in the bar graphs); years
+    without a simulated rate are compared with 0.
+    annual_data - lists of lists: wellnestname, annual dataframe with AnnRates
+    (m), or ResultHandle["ann_sub"]
+    wellnestlist - list of wellnests that were simualted
+    periods - list of (first year, last year) of each period
+    n_boot, ci, seed, n_jobs - bootstrap intervals (see skill_frame)
+
+    Returns
+    skill - dataframe of wellnest, tmin, tmax and the metrics
+    """
+    first = min(int(tmin) for tmin, _ in periods)
+    last = max(int(tmax) for _, tmax in periods)
+    dates = pd.date_range(str(first) + "-12-31", str(last) + "-12-31",
+                          freq="Y")
+
+    # Annual rates (cm/yr) of all well nests at the end of each year
+    benchmarks = bkk_sub.load_benchmarks()
+    sim = np.zeros((len(wellnestlist), len(dates)))
+    obs = np.full((len(wellnestlist), len(dates)), np.nan)
+    for num_well, wellnest in enumerate(wellnestlist):
+
+        sim[num_well] = (annual_data[num_well][1].AnnRates * 100).reindex(
+            dates).fillna(0).values
+
+        if wellnest in benchmarks:
+            bench = benchmarks.leveling(wellnest).reindex(dates).values
+            obs[num_well] = np.where(bench != 0, bench, np.nan)
+
+    # Observations of each period (period, well nest, year)
+    in_period = np.array([(dates.year >= int(tmin)) & (dates.year <= int(tmax))
+                          for tmin, tmax in periods])
+    obs = np.where(in_period[:, None, :], obs[None], np.nan)
+
+    labels = pd.DataFrame({
+        "wellnest": np.tile(wellnestlist, len(periods)),
+        "tmin": np.repeat([str(tmin) for tmin, _ in periods],
+                          len(wellnestlist)),
+        "tmax": np.repeat([str(tmax) for _, tmax in periods],
+                          len(wellnestlist))})
+
+    return skill_frame(labels, np.broadcast_to(sim, obs.shape), obs,
+                       n_boot=n_boot, ci=ci, seed=seed, n_jobs=n_jobs)
+
+
+def gw_skill(models, names, tmin=None, tmax=None, n_boot=0, ci=95, seed=0,
+             n_jobs=1):
+    """Skill of Pastas simulated heads against the observed heads of all
+    wells at once (m).
+
+    models - list of Pastas models
+    names - list of (wellnest, well) of each model
+    tmin, tmax - period of the observations used
+    n_boot, ci, seed, n_jobs - bootstrap intervals (see skill_frame)
+
+    Returns
+    skill - dataframe of wellnest, well and the metrics
+    """
+    # Observations and simulated heads at the observation times, padded with
+    # NaN to the longest
+    obs = [model.observations(tmin=tmin, tmax=tmax) for model in models]
+    res = [model.residuals(tmin=tmin, tmax=tmax) for model in models]
+    length = max(len(o) for o in obs)
+
+    obs_ = np.full((len(models), length), np.nan)
+    sim_ = np.full((len(models), length), np.nan)
+    for i, (o, r) in enumerate(zip(obs, res)):
+        o = o.reindex(r.index)
+        obs_[i, :len(o)] = o.values
+        sim_[i, :len(o)] = (o - r).values
+
+    labels = pd.DataFrame(list(names), columns=["wellnest", "well"])
+
+    return skill_frame(labels, sim_, obs_, n_boot=n_boot, ci=ci, seed=seed,
+                       n_jobs=n_jobs)
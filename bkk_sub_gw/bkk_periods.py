@@ -0,0 +1,232 @@
+# ##############################################################################
+"""Cumulative subsidence, change and rate over periods for all well nests and
+scenarios at once.
+
+Periods are given by a spec: "month", "year", "decade" or a list of (start,
+end) windows. The cumulative subsidence of every well nest of every scenario
+is stacked into one (series, time) array and sampled at all period ends in one
+pass; the change over a period is the difference between the cumulative
+subsidence at its end and at its start. Percentiles over the well nests of each
+scenario and period are computed from the same table. Summaries of a result
+store are cached by period spec (see bkk_results.ResultStore.periods).
+
+Article Title: Hybrid data-driven, physics-based modeling of ground-
+water and subsidence with application to Bangkok, Thailand
+
+Jenny Soonthornrangsan 2023
+TU Delft
+
+"""
+# ##############################################################################
+
+###############################################################################
+# import statements
+###############################################################################
+
+import numpy as np
+import pandas as pd
+
+# Periods of a spec given by name (end of each period)
+# decade - 1980-1989, 1990-1999... (ending with Dec 31 of years ending in 9)
+PERIOD_SPECS = ["month", "year", "decade"]
+
+# Default percentiles over the well nests of a scenario
+PERCENTILES = [5, 50, 95]
+
+
+# %%###########################################################################
+# Periods
+###############################################################################
+
+def spec_key(spec):
+    """Text of a period spec, used as a cache key."""
+    if isinstance(spec, str):
+        return spec
+
+    return "windows:" + ";".join(str(pd.Timestamp(start).date()) + "/" +
+                                 str(pd.Timestamp(end).date())
+                                 for start, end in spec)
+
+
+def forecast_window(tmin, tmax):
+    """Window from the end of year tmin to the end of the last year before
+    tmax, the change shown in the forecast maps."""
+    return [(str(tmin) + "-12-31", str(int(tmax) - 1) + "-12-31")]
+
+
+def period_bounds(spec, first, last):
+    """Start and end dates of the periods of a spec.
+
+    spec - one of PERIOD_SPECS or list of (start, end) windows
+    first, last - first and last date of the results; named periods start at
+    the end of the period before the first date and only periods ending by the
+    last date are kept
+
+    Returns
+    starts, ends - arrays of datetime64[ns]
+    """
+    # Windows are kept as given
+    if not isinstance(spec, str):
+        starts = pd.to_datetime([start for start, _ in spec]).values
+        ends = pd.to_datetime([end for _, end in spec]).values
+        return starts, ends
+
+    first, last = pd.Timestamp(first), pd.Timestamp(last)
+
+    if spec == "month":
+        bounds = pd.date_range(first - pd.offsets.MonthEnd(1), last, freq="M")
+
+    elif spec == "year":
+        bounds = pd.date_range(first - pd.offsets.YearEnd(1), last, freq="Y")
+
+    elif spec == "decade":
+        year = first.year - 1
+        year -= (year - 9) % 10
+        bounds = pd.to_datetime([str(y) + "-12-31"
+                                 for y in range(year, last.year + 1, 10)])
+        bounds = bounds[bounds <= last]
+
+    else:
+        raise ValueError("Unknown period spec " + str(spec) + ", use one of " +
+                         ", ".join(PERIOD_SPECS) + " or (start, end) windows")
+
+    return bounds[:-1].values, bounds[1:].values
+
+
+# %%###########################################################################
+# Stacking and sampling
+###############################################################################
+
+def stack(results, column="CumTotSum"):
+    """Cumulative subsidence of all well nests of all scenarios as one padded
+    (series, time) array.
+
+    results - ann_sub list of lists (wellnest, dataframe or series with a
+    DatetimeIndex) of one scenario, or list or dictionary of them for several
+    scenarios (e.g. all_ann_subs)
+    column - column of the dataframes with the cumulative subsidence (m)
+
+    Returns
+    labels - dataframe of scenario and wellnest of each series
+    dates - dates (series, time), NaT after the last date of shorter series
+    values - cumulative subsidence (series, time), NaN after the last date
+    length - number of dates of each series
+    """
+    # One scenario
+    if not isinstance(results, dict) and len(results) > 0 and \
+            isinstance(results[0][0], str):
+        results = [results]
+    if not isinstance(results, dict):
+        results = dict(enumerate(results))
+
+    scenarios, wellnests, series = [], [], []
+    for scenario, ann_sub in results.items():
+        for wellnest, data in ann_sub:
+
+            scenarios.append(scenario)
+            wellnests.append(wellnest)
+            series.append(data[column] if isinstance(data, pd.DataFrame)
+                          else data)
+
+    length = np.array([len(data) for data in series])
+    dates = np.full((len(series), length.max()), np.datetime64("NaT"),
+                    dtype="datetime64[ns]")
+    values = np.full((len(series), length.max()), np.nan)
+    for i, data in enumerate(series):
+        dates[i, :length[i]] = data.index.values
+        values[i, :length[i]] = data.values
+
+    labels = pd.DataFrame({"scenario": scenarios, "wellnest": wellnests})
+
+    return labels, dates, values, length
+
+
+def sample(dates, values, length, at):
+    """Value of each series at the last date on or before each date.
+
+    dates, values, length - from stack
+    at - array of datetime64[ns] to sample at
+
+    Returns
+    sampled - array (series, len(at)); dates before the first date of a series
+    give its first value
+    """
+    # Position of each date; series with the same dates (all well nests of a
+    # run, usually) are searched once
+    pos = np.empty((len(values), len(at)), dtype=int)
+    searched = {}
+    for row in range(len(values)):
+        key = dates[row, :length[row]].tobytes()
+        if key not in searched:
+            searched[key] = np.searchsorted(dates[row, :length[row]], at,
+                                            side="right") - 1
+        pos[row] = searched[key]
+
+    return np.take_along_axis(values, np.maximum(pos, 0), axis=1)
+
+
+# %%###########################################################################
+# Summaries
+###############################################################################
+
+def summarize(labels, dates, values, length, spec, percentiles=PERCENTILES):
+    """Cumulative subsidence, change and rate over the periods of a spec for
+    all series at once.
+
+    labels, dates, values, length - from stack
+    spec - one of PERIOD_SPECS or list of (start, end) windows
+    percentiles - percentiles over the well nests of each scenario and period
+
+    Returns
+    summary - dictionary of
+    periods - dataframe of scenario, wellnest, start, end, cumulative (at the
+    end, m), change (end - start, m) and rate (m/yr) of each period
+    percentiles - dataframe of scenario, start, end, percentile and the
+    percentiles of cumulative, change and rate over the well nests
+    """
+    first = dates[:, 0].min()
+    last = np.max(dates[np.arange(len(dates)), length - 1])
+    starts, ends = period_bounds(spec, first, last)
+
+    # Cumulative subsidence at all starts and ends at once
+    sampled = sample(dates, values, length, np.concatenate([starts, ends]))
+    start_values, cumulative = np.split(sampled, 2, axis=1)
+    change = cumulative - start_values
+    years = (ends - starts) / np.timedelta64(1, "D") / 365.25
+
+    num_series, num_period = cumulative.shape
+    periods = pd.DataFrame({
+        "scenario": np.repeat(labels.scenario.values, num_period),
+        "wellnest": np.repeat(labels.wellnest.values, num_period),
+        "start": np.tile(starts, num_series),
+        "end": np.tile(ends, num_series),
+        "cumulative": cumulative.ravel(),
+        "change": change.ravel(),
+        "rate": (change / years).ravel()})
+
+    # Percentiles over the well nests
+    stats = periods.groupby(["scenario", "start", "end"], sort=False)[
+        ["cumulative", "change", "rate"]].quantile(
+            np.asarray(percentiles) / 100)
+    stats.index = stats.index.set_names("percentile", level=-1)
+    stats = stats.reset_index()
+    stats["percentile"] = stats.percentile * 100
+
+    return {"periods": periods, "percentiles": stats}
+
+
+def period_summary(results, spec, column="CumTotSum",
+                   percentiles=PERCENTILES):
+    """Cumulative subsidence, change and rate over the periods of a spec for
+    all well nests and scenarios.
+
+    results - ann_sub of one scenario, or list or dictionary of them (e.g.
+    all_ann_subs); daily cumulative series give sub-annual periods
+    spec - one of PERIOD_SPECS or list of (start, end) windows
+    column - column of the dataframes with the cumulative subsidence (m)
+    percentiles - percentiles over the well nests of each scenario and period
+
+    Returns
+    summary - dictionary of periods and percentiles dataframes (see summarize)
+    """
+    return summarize(*stack(results, column), spec, percentiles=percentiles)
@@ -33,21 +33,41 @@ TU Delft
 ###############################################################################
 
 import os
+import pickle
+import hashlib
 import pandas as pd
 import datetime as dt
-from sklearn.metrics import mean_squared_error
 import numpy as np
 import matplotlib.pyplot as plt
+import mpl_toolkits.basemap
 from mpl_toolkits.basemap import Basemap
 from mycolorpy import colorlist as mcp
 from matplotlib.ticker import (AutoMinorLocator)
 import matplotlib.ticker as mticker
-from matplotlib.collections import PatchCollection
+from matplotlib.collections import PatchCollection, LineCollection
 from matplotlib.patches import Wedge
 from statistics import median
 import string
 import matplotlib.lines as mlines
 
+# Cached reading of excel inputs
+from bkk_sub_gw import bkk_cache
+
+# Benchmark leveling
+from bkk_sub_gw import bkk_sub
+
+# Coordinates of well nests
+from bkk_sub_gw import bkk_catalog
+
+# Subsidence over periods
+from bkk_sub_gw import bkk_periods
+
+# Skill of simulated subsidence
+from bkk_sub_gw import bkk_metrics
+
+# Rendering figures of many well nests
+from bkk_sub_gw import bkk_render
+
 
 # %%###########################################################################
 # Plotting settings
@@ -60,20 +80,32 @@ plt.rc("xtick", labelsize=6)  # fontsize of the x tick labels
 plt.rc("ytick", labelsize=6)  # fontsize of the y tick labels
 plt.rc("legend", fontsize=8)  # fontsize of the legend
 
+# Extent and projection of the maps of Bangkok
+BKK_MAP = {"llcrnrlon": 100.3, "llcrnrlat": 13.4, "urcrnrlon": 100.8,
+           "urcrnrlat": 14, "resolution": "h", "ellps": "WGS84",
+           "lat_0": 13.6, "lon_0": 100.4}
+
+# Thailand province boundaries (shapefile without extension)
+PROVINCES_PATH = os.path.join("inputs", "GIS", "provinces")
+
+# Folder of cached basemaps (relative to the working directory, like the other
+# caches of the scripts)
+BASEMAP_CACHE_PATH = os.path.join("cache", "basemap")
+
+# Pickled basemaps already built or read in this session, keyed by cache file
+_basemaps = {}
+
 
 # %%###########################################################################
 # Plotting results
 ##############################################################################
 
-def nse(predictions, targets):
-    return 1-(np.sum((targets-predictions)**2) /
-              np.sum((targets-np.mean(targets))**2))
 
 
-def sub_bar(path, wellnestlist, all_results,
-            sub_total, subv_total,
-            annual_data, tmin=None, tmax=None, save=0,
-            benchflag=0):
+def sub_bar(path, wellnestlist, all_results=None,
+            sub_total=None, subv_total=None,
+            annual_data=None, tmin=None, tmax=None, save=0,
+            benchflag=0, skill=None, n_jobs=1):
     """Plot annual subsidence results.
 
     Bar graphs of annual subsidence (cm) for each well nest during 1978-2020
@@ -81,199 +113,182 @@ def sub_bar(path, wellnestlist, all_results,
 
     path - str: path to save figures
     wellnestlist - list of wellnests that were simualted
-    all_results - lists of lists: wellnestname, well name, head matrix with
-    head series of each node
-    sub_total - lists of lists: wellnestname, well_name, total cum sub
-    subv_total - lists of lists: wellnestname, well_name, inelastic cum sub
+    all_results, sub_total, subv_total - not used (only annual data drawn)
     annual_data - lists of lists: wellnestname, well_name, total cum sub for
-    all four clay at a wellnest location
+    all four clay at a wellnest location, or ResultHandle["ann_sub"] (read
+    when drawn)
     save - if 1, save; if 0, don't save
     benchflag: no benchmark - if 0, no plot, if 1, benchmark, plot
     Assume also that benchmark comparison starts at 0
+    skill - dataframe from bkk_metrics.sub_skill with the 1990-2010 period of
+    the graphs; computed if None
+    n_jobs - number of processes rendering the saved figures (see
+    bkk_render.render), number of processors if None
 
     # ASSUMES FOUR WELLS IN WELLNEST
     """
-    # saving rmse
-    rmse = []
+    # RMSE (cm/yr) of all well nests during the years of the graphs
+    if benchflag == 1 and skill is None:
+        skill = bkk_metrics.sub_skill(annual_data, wellnestlist,
+                                      [("1990", "2010")])
+    if benchflag == 1:
+        skill = skill[(skill.tmin == "1990") & (skill.tmax == "2010")]
+
+    # Figures of each well nest
+    jobs = []
 
     # For each wellnest in list
     # num_well is the index, wellnest = name
     # Figures for each well nest
     for num_well, wellnest in enumerate(wellnestlist):
 
+        kwargs = {"wellnest": wellnest, "annual": annual_data[num_well][1],
+                  "batch": len(wellnestlist) > 1, "benchflag": benchflag}
+
         if benchflag == 1:
 
             # Subsidence plotting
-            # Getting benchmark time series
-            loc = os.path.join(os.path.abspath("inputs"), "SurveyingLevels.xlsx")
-            try:
-                subdata = pd.read_excel(loc, sheet_name=wellnest + "_Leveling",
-                                        index_col=3)
-                subdata = pd.DataFrame(subdata)
-                subdata.index = pd.to_datetime(subdata.index)
-
-                # Getting rid of benchmarks outside time period
-                subdata = subdata[(subdata.Year <= 2020)]
-
-                # Benchmarks should start at 0 at the first year.
-                bench = subdata.loc[:, subdata.columns.str.contains("Land")]
-                bench = bench.fillna(0)
-
-                if (bench.iloc[0] != 0).any():
-                    bench.iloc[0] = 0
-
-                # IMPORTANT INFO
-                # For benchmark measurements, the first year is 0, the second year
-                # is the compaction rate over that first year.
-                # For implicit Calc, the first year has a compaction rate over that
-                # year, so to shift benchmarks value to the previouse year to match
-                # Index has the right years
-                bench.index = bench.index.shift(-1, freq="D")
-                bench["date"] = bench.index
-
-                # Gets the last date of each year
-                lastdate = bench.groupby(pd.DatetimeIndex(bench["date"]).year,
-                                         as_index=False).agg(
-                                             {"date": max}).reset_index(drop=True)
-                bench = bench.loc[lastdate.date]
-
-            except:
-
-                bench = pd.DataFrame()
-
-        # BAR PLOT preparation
-        daterange = pd.date_range(dt.datetime(1990, 12, 31), periods=21,
-                                  freq="Y").tolist()
-        df = pd.DataFrame(daterange, columns=["date"])
-
-        x = np.arange(21)
-        width = .5
-
-        # Figure plotting model results against measurements
-        # Converts to cm to match measurements
-        # set fig size certain way if running batch well nests
-        # Supplemental Information
-        if len(wellnestlist) > 1:
-
-            plt.figure(figsize=(6.75, 3.38), dpi=400)
-
-        # Paper size
+            # Annual benchmark rates (cm/yr) at the end of each year, empty if
+            # no benchmark leveling
+            kwargs["bench"] = bkk_sub.load_benchmarks().get(
+                wellnest).fillna(0)
+
+            # RMSE of the years with leveling
+            kwargs["rms"] = skill.rmse[skill.wellnest == wellnest].item()
+
+        # If saving figure
+        if np.logical_and(save == 1, benchflag == 1):
+
+            # set name of file certain way if running batch well nests
+            if len(wellnestlist) > 1:
+                fig_name = wellnest + "_BenchvsImplicit_AnnSubTotal"
+            else:
+                fig_name = wellnest + "_BenchvsImplicit_AnnSubTotal_PAPER"
+
+            jobs.append(bkk_render.FigureJob(
+                sub_bar_figure, wellnest, kwargs, path, fig_name,
+                savefig_kw={"bbox_inches": "tight"}))
+
+        # Not saved, left open
         else:
+            sub_bar_figure(**kwargs)
+
+    # Drawing and saving the figures
+    if jobs:
+        bkk_render.render(jobs, n_jobs=n_jobs)
+
 
-            plt.figure(figsize=(6.75, 2), dpi=400)
+def sub_bar_figure(wellnest, annual, batch, benchflag=0, bench=None,
+                   rms=None):
+    """Bar graph of annual subsidence of one well nest (see sub_bar).
 
-        # Bar graph
-        # annual data in cm
-        plot_data = df.merge(annual_data[num_well][1]*100, left_on=df.date,
-                             right_on=annual_data[num_well][1].index,
-                             how="left")
+    wellnest - well nest name
+    annual - dataframe of annual subsidence rates (AnnRates, m)
+    batch - True if drawn for many well nests (Supplemental Information),
+    False for the paper size
+    benchflag - if 1, benchmark plotted
+    bench - annual benchmark rates (cm/yr), empty if no benchmark leveling
+    rms - RMSE (cm/yr) of the years with leveling
 
-        # Renaming for second merge
-        plot_data = plot_data.rename(columns={"key_0": "key0"})
+    Returns
+    fig - figure
+    """
+    # BAR PLOT preparation
+    daterange = pd.date_range(dt.datetime(1990, 12, 31), periods=21,
+                              freq="Y").tolist()
+    df = pd.DataFrame(daterange, columns=["date"])
 
-        # Filling na with 0
-        plot_data = plot_data.fillna(0)
+    x = np.arange(21)
+    width = .5
 
-        plt.bar(x,
-                -plot_data.AnnRates,
-                label="Simulated", width=width,
-                linewidth=.5, edgecolor="k")
+    # Figure plotting model results against measurements
+    # Converts to cm to match measurements
+    # set fig size certain way if running batch well nests
+    # Supplemental Information
+    if batch:
 
-        # Plotting benchmarks
-        if benchflag == 1:
+        plt.figure(figsize=(6.75, 3.38), dpi=400)
 
-            if not bench.empty:
-                # Measurements
-                # Bar plot
-                # Benchamrks already in cm
-                plot_data = plot_data.merge(bench, left_on=plot_data.key0,
-                                            right_on=bench.index,
-                                            how="left")
-                # Renaming for other merge
-                plot_data = plot_data.rename(columns={"key_0": "key1"})
-
-                # Filling na with 0
-                plot_data = plot_data.fillna(0)
-
-                plt.bar(x+width, -plot_data[
-                    plot_data.columns[
-                        plot_data.columns.str.contains("Land")].item()],
-                        color="orange", linewidth=.5,
-                        label="Observed", width=width, edgecolor="k")
-
-            # Dropping NAs
-            plot_data = plot_data.dropna()
-
-            rms_data = plot_data[
-                plot_data.columns[
-                    plot_data.columns.str.contains("Land")].item()]
+    # Paper size
+    else:
 
-            # Calculating RMSE
-            rms = mean_squared_error(rms_data[rms_data != 0],
-                                     plot_data.AnnRates[rms_data != 0],
-                                     squared=False)
+        plt.figure(figsize=(6.75, 2), dpi=400)
 
-            # Plotting settings
-            plt.legend(loc="center right", fontsize=10)
-            # set y limits/title only if running batch well nests
-            if len(wellnestlist) > 1:
-                plt.ylim((-2, 10))
-                plt.title(wellnest)
-            plt.ylabel("Annual Subsidence \n Rate (cm/yr)", fontsize=12)
-            plt.xlabel("Years", fontsize=12)
-            plt.annotate("RMSE: " + "{:.1f}".format(rms) + " cm/year",
-                         xy=(.99, .97), xycoords="axes fraction",
-                         fontsize=10, horizontalalignment="right",
-                         verticalalignment="top")
-
-            # saving rmse
-            rmse.append(rms)
-
-            ax = plt.gca()
-            ax.tick_params(axis='both', which='major', labelsize=10)
-            plt.draw()
-            plt.axhline(y=0, color="k", linestyle="-", linewidth=1)
-            ax.set_xticklabels(ax.get_xticks(), rotation=45)
-            plt.xticks(x+width, ["1990", "", "1992",
-                                 "", "1994", "", "1996", "",
-                                 "1998", "", "2000", "", "2002",
-                                 "", "2004", "", "2006", "",
-                                 "2008", "", "2010"])
-        # Setting fig size again
-        # set fig size certain way if running batch well nests
-        # Supplemental Information
-        if len(wellnestlist) > 1:
-
-            plt.gcf().set_size_inches(6.75, 3.38)
-
-        # Paper size
-        else:
+    # Bar graph
+    # annual data in cm
+    plot_data = df.merge(annual*100, left_on=df.date,
+                         right_on=annual.index,
+                         how="left")
 
-            plt.gcf().set_size_inches(6.75, 2)
+    # Renaming for second merge
+    plot_data = plot_data.rename(columns={"key_0": "key0"})
 
-        # If saving figure
-        if np.logical_and(save == 1, benchflag == 1):
+    # Filling na with 0
+    plot_data = plot_data.fillna(0)
 
-            # set name of file certain way if running batch well nests
-            if len(wellnestlist) > 1:
+    plt.bar(x,
+            -plot_data.AnnRates,
+            label="Simulated", width=width,
+            linewidth=.5, edgecolor="k")
 
-                fig_name = wellnest + "_BenchvsImplicit_AnnSubTotal.eps"
-                full_figpath = os.path.join(path, fig_name)
-                plt.savefig(full_figpath, format="eps", bbox_inches="tight")
+    # Plotting benchmarks
+    if benchflag == 1:
 
-                fig_name = wellnest + "_BenchvsImplicit_AnnSubTotal.png"
-                full_figpath = os.path.join(path, fig_name)
-                plt.savefig(full_figpath, format="png", bbox_inches="tight")
+        if not bench.empty:
+            # Measurements
+            # Bar plot
+            # Benchamrks already in cm
+            plot_data = plot_data.merge(bench, left_on=plot_data.key0,
+                                        right_on=bench.index,
+                                        how="left")
+            # Renaming for other merge
+            plot_data = plot_data.rename(columns={"key_0": "key1"})
 
-            else:
+            # Filling na with 0
+            plot_data = plot_data.fillna(0)
+
+            plt.bar(x+width, -plot_data[
+                plot_data.columns[
+                    plot_data.columns.str.contains("Land")].item()],
+                    color="orange", linewidth=.5,
+                    label="Observed", width=width, edgecolor="k")
+
+        # Plotting settings
+        plt.legend(loc="center right", fontsize=10)
+        # set y limits/title only if running batch well nests
+        if batch:
+            plt.ylim((-2, 10))
+            plt.title(wellnest)
+        plt.ylabel("Annual Subsidence \n Rate (cm/yr)", fontsize=12)
+        plt.xlabel("Years", fontsize=12)
+        plt.annotate("RMSE: " + "{:.1f}".format(rms) + " cm/year",
+                     xy=(.99, .97), xycoords="axes fraction",
+                     fontsize=10, horizontalalignment="right",
+                     verticalalignment="top")
+
+        ax = plt.gca()
+        ax.tick_params(axis='both', which='major', labelsize=10)
+        plt.draw()
+        plt.axhline(y=0, color="k", linestyle="-", linewidth=1)
+        ax.set_xticklabels(ax.get_xticks(), rotation=45)
+        plt.xticks(x+width, ["1990", "", "1992",
+                             "", "1994", "", "1996", "",
+                             "1998", "", "2000", "", "2002",
+                             "", "2004", "", "2006", "",
+                             "2008", "", "2010"])
+    # Setting fig size again
+    # set fig size certain way if running batch well nests
+    # Supplemental Information
+    if batch:
+
+        plt.gcf().set_size_inches(6.75, 3.38)
+
+    # Paper size
+    else:
 
-                fig_name = wellnest + "_BenchvsImplicit_AnnSubTotal_PAPER.eps"
-                full_figpath = os.path.join(path, fig_name)
-                plt.savefig(full_figpath, format="eps", bbox_inches="tight")
+        plt.gcf().set_size_inches(6.75, 2)
 
-                fig_name = wellnest + "_BenchvsImplicit_AnnSubTotal_PAPER.png"
-                full_figpath = os.path.join(path, fig_name)
-                plt.savefig(full_figpath, format="png", bbox_inches="tight")
+    return plt.gcf()
 
 
 def gwlocs_map(path, save=0):
@@ -284,7 +299,7 @@ def gwlocs_map(path, save=0):
     """
     # Importing spatial coordinates
     full_path = os.path.join(os.path.abspath("inputs"), "GroundwaterWellLocs.xls")
-    gwwell_locs = pd.read_excel(full_path)
+    gwwell_locs = bkk_cache.read_excel(full_path)
 
     # Locations of wellnests removing duplicates
     gwwell_locs = gwwell_locs.drop_duplicates("WellNest_Name", keep="first")
@@ -355,8 +370,7 @@ def gwlocs_map(path, save=0):
     # Initializing figure
     fig, ax = plt.subplots(figsize=(3.2, 2.2), dpi=400)
     datalim = None
-    map = Basemap(llcrnrlon=100.3, llcrnrlat=13.4, urcrnrlon=100.8, urcrnrlat=14,
-                  resolution="h", ellps="WGS84", lat_0=13.6, lon_0=100.4)
+    map = load_basemap()
     draw_basemap(map, xs, ys, labels=labels, fig=fig, ax=ax,
                  datalim=datalim, mode="GW_WellNests", save=0,
                  figpath=path)
@@ -373,126 +387,43 @@ def gwlocs_map(path, save=0):
         plt.savefig(full_figpath, dpi=400, bbox_inches="tight", format="png")
 
 
-def sub_rmse_map(path, wellnestlist, all_results,
-                 sub_total, subv_total,
-                 annual_data, tmin=None, tmax=None, save=0):
+def sub_rmse_map(path, wellnestlist, all_results=None,
+                 sub_total=None, subv_total=None,
+                 annual_data=None, tmin=None, tmax=None, save=0, skill=None):
     """Spatial mapping of simulated subsidence and observed.
 
     path - path to save figures
     wellnestlist - list of wellnests that were simualted
-    all_results - lists of lists: wellnestname, well name, head matrix with
-    head series of each node
-    sub_total - lists of lists: wellnestname, well_name, total cum sub
-    subv_total - lists of lists: wellnestname, well_name, inelastic cum sub
+    all_results, sub_total, subv_total - not used (only annual data drawn)
     annual_data - lists of lists: wellnestname, well_name, total cum sub for
-    all four clay at a wellnest location
+    all four clay at a wellnest location, or ResultHandle["ann_sub"] (read
+    when drawn)
     save - if 1, save; if 0, don't save
+    skill - dataframe from bkk_metrics.sub_skill with the 1978-2020 period of
+    the map; computed if None
 
     ASSUMES FOUR WELLS IN WELLNEST
     """
-    # Importing spatial coordinates
-    full_GWpath = os.path.join(os.path.abspath("inputs"),
-                               "GroundwaterWellLocs.xls")
-    gwwell_locs = pd.read_excel(full_GWpath)
+    # Locations of wellnests
+    catalog = bkk_catalog.load_catalog()
 
-    # Locations of wellnests; removing duplicates
-    gwwell_locs = gwwell_locs.drop_duplicates("WellNest_Name", keep="first")
+    # RMSE (cm/yr) of all well nests during 1978-2020
+    if skill is None:
+        skill = bkk_metrics.sub_skill(annual_data, wellnestlist,
+                                      [("1978", "2020")])
+    skill = skill[(skill.tmin == "1978") & (skill.tmax == "2020")]
 
-    # BAR PLOT preparation
-    daterange = pd.date_range(dt.datetime(1978, 12, 31), periods=43,
-                              freq="Y").tolist()
-    df = pd.DataFrame(daterange, columns=["date"])
-
-    # Saving relevant xs, ys, and cumsum
-    xs = []
-    ys = []
-    cs_rmse = []
-
-    # For each wellnest in list
-    # num_well is the index, wellnest = name
-    # Figures for each well nest
-    for num_well, wellnest in enumerate(wellnestlist):
-
-        # Benchmark
-        loc = os.path.join(os.path.abspath("inputs"), "SurveyingLevels.xlsx")
-        subdata = pd.read_excel(loc, sheet_name=wellnest + "_Leveling",
-                                index_col=3)
-        subdata = pd.DataFrame(subdata)
-        subdata.index = pd.to_datetime(subdata.index)
-
-        # Getting rid of benchmarks outside time period
-        subdata = subdata[(subdata.Year <= 2020)]
-
-        # Benchmarks should start at 0 at the first year.
-        bench = subdata.loc[:, subdata.columns.str.contains("Land")]
-        bench = bench.fillna(0)
-
-        if (bench.iloc[0] != 0).any():
-            bench.iloc[0] = 0
-
-        # IMPORTANT INFO
-        # For benchmark measurements, the first year is 0, the second year is
-        # the compaction rate over that first year.
-        # For implicit Calc, the first year has a compaction rate over that
-        # year, so to shift benchmarks value to the previouse year to match
-        # Index has the right years
-        bench.index = bench.index.shift(-1, freq="D")
-        bench["date"] = bench.index
-
-        # Gets the last date of each year
-        lastdate = bench.groupby(pd.DatetimeIndex(bench["date"]).year,
-                                 as_index=False).agg(
-                                     {"date": max}).reset_index(drop=True)
-        bench = bench.loc[lastdate.date]
-        # preparation
-        daterange = pd.date_range(dt.datetime(1978, 12, 31), periods=43,
-                                  freq="Y").tolist()
-        df = pd.DataFrame(daterange, columns=["date"])
-
-        # annual data in cm
-        plot_data = df.merge(annual_data[num_well][1]*100, left_on=df.date,
-                             right_on=annual_data[num_well][1].index,
-                             how="left")
-        # Renaming for second merge
-        plot_data = plot_data.rename(columns={"key_0": "key0"})
-
-        # Filling na with 0
-        plot_data = plot_data.fillna(0)
-
-        # Benchamrks already in cm
-        plot_data = plot_data.merge(bench, left_on=plot_data.key0,
-                                    right_on=bench.index,
-                                    how="left")
-        # Renaming for other merge
-        plot_data = plot_data.rename(columns={"key_0": "key1"})
-
-        # Filling na with 0
-        plot_data = plot_data.fillna(0)
-
-        plot_data = plot_data.dropna()
-
-        landlevel = plot_data[
-            plot_data.columns[
-                plot_data.columns.str.contains(
-                    "Land")].item()]
-
-        # Calculating rmse
-        rms = mean_squared_error(landlevel[landlevel != 0],
-                                 plot_data.AnnRates[landlevel != 0],
-                                 squared=False)
-        cs_rmse.append(rms)
-
-        x_ = gwwell_locs.Long[gwwell_locs.WellNest_Name == wellnest].item()
-        y_ = gwwell_locs.Lat[gwwell_locs.WellNest_Name == wellnest].item()
-        xs.append(x_)
-        ys.append(y_)
+    # Saving relevant xs, ys, and rmse
+    cs_rmse = [skill.rmse[skill.wellnest == wellnest].item()
+               for wellnest in wellnestlist]
+    xs = [catalog.coordinates(wellnest)[0] for wellnest in wellnestlist]
+    ys = [catalog.coordinates(wellnest)[1] for wellnest in wellnestlist]
 
     # Printing average subsidence rmse (cm/yr)
     # Initializing figure
     fig, ax = plt.subplots(figsize=(3.2, 2.2), dpi=400)
     datalim = None
-    map = Basemap(llcrnrlon=100.3, llcrnrlat=13.4, urcrnrlon=100.8, urcrnrlat=14,
-                  resolution="h", ellps="WGS84", lat_0=13.6, lon_0=100.4)
+    map = load_basemap()
     draw_basemap(map, xs, ys, cs_rmse, fig=fig, ax=ax,
                  datalim=datalim, mode="Sub_RMSE", save=0,
                  time_min=tmin, time_max=tmax, figpath=path)
@@ -511,20 +442,18 @@ def sub_rmse_map(path, wellnestlist, all_results,
         plt.savefig(full_figpath, dpi=400, bbox_inches="tight", format="png")
 
 
-def sub_sens_line(path, wellnestlist, all_results,
-                  sub_total, subv_total,
-                  annual_data, tmin=None, tmax=None, mode=None, num=None,
+def sub_sens_line(path, wellnestlist, all_results=None,
+                  sub_total=None, subv_total=None,
+                  annual_data=None, tmin=None, tmax=None, mode=None, num=None,
                   save=0):
     """Sensitivity analysis on subsidence based on either Sskv, Sske, K, thickness.
 
     path - path to save figures
     wellnestlist - list of wellnests that were simualted
-    all_results - lists of lists: wellnestname, well name, head matrix with
-    head series of each node
-    sub_total - lists of lists: wellnestname, well_name, total cum sub
-    subv_total - lists of lists: wellnestname, well_name, inelastic cum sub
-    annual_data - lists of lists: wellnestname, well_name, total cum sub for
-    all four clay at a wellnest location
+    all_results, sub_total, subv_total - not used (only annual data drawn)
+    annual_data - list of the annual data of each sensitivity: lists of lists
+    of wellnestname, total cum sub for all four clay at a wellnest location,
+    or ResultHandle["ann_sub"] (read when drawn)
     mode - which parameter is being adjusted for sensitivity (Sskv, Sske, K,
     thickness)
     num - number of parameter increases in sensitivity
@@ -541,7 +470,13 @@ def sub_sens_line(path, wellnestlist, all_results,
 
     # Saving rates
     lastrates = []
-    change2020_2060 = []
+
+    # Difference in cum sum between the end of tmin and the end of the last
+    # year before tmax of each sensitivity and well nest
+    # Cumulative sub in cm
+    change2020_2060 = list(bkk_periods.period_summary(
+        list(annual_data)[:num], bkk_periods.forecast_window(tmin, tmax))[
+            "periods"].change * -100)
 
     # For each sensitivity
     for i in range(num):
@@ -584,18 +519,6 @@ def sub_sens_line(path, wellnestlist, all_results,
                         annual_data[i][num_well][1].CumTotSum[-2])*-1000  # mm
             lastrates.append(lastrate)
 
-            # Get cumulative sum of highest year below tmax
-            max_year = annual_data[i][num_well][1].year[
-                annual_data[i][num_well][1].year < int(tmax)].max()
-
-            # Saving difference in cum sum between a time period
-            # Cumulative sub in cm
-            change2020_2060.append((annual_data[i][num_well][1].CumTotSum[
-                annual_data[i][num_well][1].year == max_year].item() -
-                annual_data[i][num_well][1].CumTotSum[
-                annual_data[i][num_well][1].year == int(tmin)].item()) *
-                -100)
-
         coeff += 10
         color_coeff -= .1
     print("Cum sub (cm): " +
@@ -720,7 +643,7 @@ def sub_sens_line(path, wellnestlist, all_results,
         plt.savefig(full_figpath, dpi=400, format="png")
 
 
-def sub_forecast(path, wellnestlist, all_ann_subs, save=0):
+def sub_forecast(path, wellnestlist, all_ann_subs, save=0, n_jobs=1):
     """Forecasts of subsidence based on five pumping scenarios.
 
     1. 500,000 m3/day
@@ -731,9 +654,12 @@ def sub_forecast(path, wellnestlist, all_ann_subs, save=0):
 
     path - path to save figures
     wellnestlist - list of wellnests that were simualted
-    all_ann_subs - lists of lists: wellnestname, dataframe with annual subsidence
-    rates
+    all_ann_subs - list of the annual data of each pumping scenario: lists of
+    lists of wellnestname, dataframe with annual subsidence rates, or
+    ResultHandle["ann_sub"] (read when drawn)
     save - if 1, save; if 0, don't save
+    n_jobs - number of processes rendering the saved figures (see
+    bkk_render.render), number of processors if None
 
     ASSUMES FOUR WELLS IN WELLNEST
     """
@@ -752,128 +678,38 @@ def sub_forecast(path, wellnestlist, all_ann_subs, save=0):
     ann_2060_1000 = []
     ann_2060_0 = []
 
+    # Figures of each well nest
+    jobs = []
+
     # For each well nest
     for num_well, wellnest in enumerate(wellnestlist):
 
-        # Figure plotting model results forecast for each scenario
-        fig, ax = plt.subplots(figsize=(3.2, 2.2), dpi=400)
-
-        # -1000 is to convert to mm and negative because subsidence is positive
-        # while uplift is negative
-        # 500,000 m3/day scenario
-        plt.plot(all_ann_subs[0][num_well][1].index,
-                 all_ann_subs[0][num_well][1].CumTotSum*-100,
-                 label="500,000 m$^3$/day", linewidth=1.5,
-                 color="hotpink")
-        lastrate = (all_ann_subs[0][num_well][1].CumTotSum[-1] -
-                    all_ann_subs[0][num_well][1].CumTotSum[-2])*-1000  # mm
-        ann_2060_500.append(lastrate)
-        ax.annotate("mm/yr",
-                    xy=(180, 120),
-                    xycoords="axes points",
-                    color="k",
-                    weight="bold")
-        ax.annotate("{:.1f}".format(lastrate),
-                    xy=(185, 105),
-                    xycoords="axes points",
-                    color="hotpink")
-
-        # 250,000 m3/day scenario
-        plt.plot(all_ann_subs[1][num_well][1].index,
-                 all_ann_subs[1][num_well][1].CumTotSum*-100,
-                 label="250,000 m$^3$/day", linewidth=1.5,
-                 color="tab:orange")
-        lastrate = (all_ann_subs[1][num_well][1].CumTotSum[-1] -
-                    all_ann_subs[1][num_well][1].CumTotSum[-2])*-1000   # mm
-        ann_2060_250.append(lastrate)
-        ax.annotate("{:.1f}".format(lastrate),
-                    xy=(185, 95),
-                    xycoords="axes points",
-                    color="tab:orange")
-
-        # 500,000 -> 250,000 m3/day scenario
-        plt.plot(all_ann_subs[3][num_well][1].index,
-                 all_ann_subs[3][num_well][1].CumTotSum*-100,
-                 label="Delayed\n250,000 m$^3$/day", linewidth=1.5,
-                 color="tab:green")
-        lastrate = (all_ann_subs[3][num_well][1].CumTotSum[-1] -
-                    all_ann_subs[3][num_well][1].CumTotSum[-2])*-1000  # mm
-        ann_2060_d250.append(lastrate)
-        ax.annotate("{:.1f}".format(lastrate),
-                    xy=(185, 100),
-                    xycoords="axes points",
-                    color="tab:green")
-
-        # 1,000,000 m3/day scenario
-        plt.plot(all_ann_subs[2][num_well][1].index,
-                 all_ann_subs[2][num_well][1].CumTotSum*-100,
-                 label="1,000,000 m$^3$/day", linewidth=1.5,
-                 color="tab:red")
-        lastrate = (all_ann_subs[2][num_well][1].CumTotSum[-1] -
-                    all_ann_subs[2][num_well][1].CumTotSum[-2])*-1000  # mm
-        ann_2060_1000.append(lastrate)
-        ax.annotate("{:.1f}".format(lastrate),
-                    xy=(185, 110),
-                    xycoords="axes points",
-                    color="tab:red")
-
-        # No pumping scenario
-        plt.plot(all_ann_subs[4][num_well][1].index,
-                 all_ann_subs[4][num_well][1].CumTotSum*-100,
-                 label="No Pumping", linewidth=1.5,
-                 color="tab:purple")
-        lastrate = (all_ann_subs[4][num_well][1].CumTotSum[-1] -
-                    all_ann_subs[4][num_well][1].CumTotSum[-2])*-1000  # mm
-        ann_2060_0.append(lastrate)
-        ax.annotate("{:.1f}".format(lastrate),
-                    xy=(185, 90),
-                    xycoords="axes points",
-                    color="tab:purple")
-
-        # Observed pumping
-        plt.plot(all_ann_subs[4][num_well][1].index[:44],
-                 all_ann_subs[4][num_well][1].CumTotSum.iloc[:44]*-100,  # mm
-                 color="black", linewidth=1.5,
-                 label="Observed Pumping")
-        plt.legend()
+        # Annual data of each scenario for this well nest
+        scenarios = [ann_sub[num_well][1] for ann_sub in all_ann_subs[:5]]
 
-        # Plotting settings
-        plt.ylabel("Cumulative Subsidence (cm)")
-        plt.xlabel("Years")
-        plt.title(wellnest)
-        fig.set_size_inches(3.2, 2.2)
-        ax.yaxis.set_minor_locator(AutoMinorLocator(2))
-        plt.grid(True, linestyle=(0, (1, 10)), which="minor")
-        plt.grid(True, linestyle="dashed", which="major")
-
-        # Annotating specific points
-        index_1990 = all_ann_subs[4][num_well][1].year == 1990
-        index_2000 = all_ann_subs[4][num_well][1].year == 2000
-        cum_value_1990 = all_ann_subs[4][num_well][1].CumTotSum[index_1990]*-100
-        cum_value_2000 = all_ann_subs[4][num_well][1].CumTotSum[index_2000]*-100
-        ann_value_1990 = all_ann_subs[4][num_well][1].AnnRates[index_1990]*-1000
-        ann_value_2000 = all_ann_subs[4][num_well][1].AnnRates[index_2000]*-1000
-        plt.scatter(cum_value_1990.index, cum_value_1990[0], color="cyan")
-        plt.scatter(cum_value_2000.index, cum_value_2000[0], color="cyan")
-        # annotation
-        plt.text(cum_value_1990.index, cum_value_1990[0] - 4, "1990: " +
-                 f"{ann_value_2000[0]:.1f}" + " mm/yr")
-        # annotation
-        plt.text(cum_value_2000.index, cum_value_2000[0] - 4, "2000: " +
-                 f"{ann_value_1990[0]:.1f}" + " mm/yr")
-        plt.show()
+        ann_2060_500.append(last_rate(scenarios[0]))
+        ann_2060_250.append(last_rate(scenarios[1]))
+        ann_2060_d250.append(last_rate(scenarios[3]))
+        ann_2060_1000.append(last_rate(scenarios[2]))
+        ann_2060_0.append(last_rate(scenarios[4]))
+
+        kwargs = {"wellnest": wellnest, "scenarios": scenarios}
 
         # Saving figure
         if save == 1:
-            fig_name = wellnest + "_CumSubForecast_ALLPUMP.eps"
-            full_figpath = os.path.join(path, fig_name)
-            plt.savefig(full_figpath, bbox_inches="tight",
-                        format="eps")
+            jobs.append(bkk_render.FigureJob(
+                sub_forecast_figure, wellnest, kwargs, path,
+                wellnest + "_CumSubForecast_ALLPUMP",
+                savefig_kw={"bbox_inches": "tight"}))
+
+        # Not saved, shown
+        else:
+            sub_forecast_figure(**kwargs)
+            plt.show()
 
-            fig_name = wellnest + "_CumSubForecast_ALLPUMP.png"
-            full_figpath = os.path.join(path, fig_name)
-            plt.savefig(full_figpath, bbox_inches="tight",
-                        format="png")
+    # Drawing and saving the figures
+    if jobs:
+        bkk_render.render(jobs, n_jobs=n_jobs)
 
     # Printing statistics
     print("\n500,000 scenario min, avg, max, med 2060 rate mm/yr: " +
@@ -907,6 +743,182 @@ def sub_forecast(path, wellnestlist, all_ann_subs, save=0):
           f"{median(ann_2060_0):.4f}")
 
 
+def last_rate(annual):
+    """Last annual subsidence rate (mm/yr, positive for subsidence) from the
+    cumulative subsidence (CumTotSum, m) of annual data."""
+    return (annual.CumTotSum[-1] - annual.CumTotSum[-2])*-1000
+
+
+def sub_forecast_figure(wellnest, scenarios):
+    """Line graph of the cumulative subsidence forecast of one well nest for
+    the five pumping scenarios (see sub_forecast).
+
+    wellnest - well nest name
+    scenarios - annual data (CumTotSum, AnnRates, year) of the 500,000,
+    250,000, 1,000,000, delayed 250,000 m3/day and no pumping scenarios
+
+    Returns
+    fig - figure
+    """
+    # Figure plotting model results forecast for each scenario
+    fig, ax = plt.subplots(figsize=(3.2, 2.2), dpi=400)
+
+    # -1000 is to convert to mm and negative because subsidence is positive
+    # while uplift is negative
+    # 500,000 m3/day scenario
+    plt.plot(scenarios[0].index,
+             scenarios[0].CumTotSum*-100,
+             label="500,000 m$^3$/day", linewidth=1.5,
+             color="hotpink")
+    lastrate = last_rate(scenarios[0])  # mm
+    ax.annotate("mm/yr",
+                xy=(180, 120),
+                xycoords="axes points",
+                color="k",
+                weight="bold")
+    ax.annotate("{:.1f}".format(lastrate),
+                xy=(185, 105),
+                xycoords="axes points",
+                color="hotpink")
+
+    # 250,000 m3/day scenario
+    plt.plot(scenarios[1].index,
+             scenarios[1].CumTotSum*-100,
+             label="250,000 m$^3$/day", linewidth=1.5,
+             color="tab:orange")
+    lastrate = last_rate(scenarios[1])  # mm
+    ax.annotate("{:.1f}".format(lastrate),
+                xy=(185, 95),
+                xycoords="axes points",
+                color="tab:orange")
+
+    # 500,000 -> 250,000 m3/day scenario
+    plt.plot(scenarios[3].index,
+             scenarios[3].CumTotSum*-100,
+             label="Delayed\n250,000 m$^3$/day", linewidth=1.5,
+             color="tab:green")
+    lastrate = last_rate(scenarios[3])  # mm
+    ax.annotate("{:.1f}".format(lastrate),
+                xy=(185, 100),
+                xycoords="axes points",
+                color="tab:green")
+
+    # 1,000,000 m3/day scenario
+    plt.plot(scenarios[2].index,
+             scenarios[2].CumTotSum*-100,
+             label="1,000,000 m$^3$/day", linewidth=1.5,
+             color="tab:red")
+    lastrate = last_rate(scenarios[2])  # mm
+    ax.annotate("{:.1f}".format(lastrate),
+                xy=(185, 110),
+                xycoords="axes points",
+                color="tab:red")
+
+    # No pumping scenario
+    plt.plot(scenarios[4].index,
+             scenarios[4].CumTotSum*-100,
+             label="No Pumping", linewidth=1.5,
+             color="tab:purple")
+    lastrate = last_rate(scenarios[4])  # mm
+    ax.annotate("{:.1f}".format(lastrate),
+                xy=(185, 90),
+                xycoords="axes points",
+                color="tab:purple")
+
+    # Observed pumping
+    plt.plot(scenarios[4].index[:44],
+             scenarios[4].CumTotSum.iloc[:44]*-100,  # mm
+             color="black", linewidth=1.5,
+             label="Observed Pumping")
+    plt.legend()
+
+    # Plotting settings
+    plt.ylabel("Cumulative Subsidence (cm)")
+    plt.xlabel("Years")
+    plt.title(wellnest)
+    fig.set_size_inches(3.2, 2.2)
+    ax.yaxis.set_minor_locator(AutoMinorLocator(2))
+    plt.grid(True, linestyle=(0, (1, 10)), which="minor")
+    plt.grid(True, linestyle="dashed", which="major")
+
+    # Annotating specific points
+    index_1990 = scenarios[4].year == 1990
+    index_2000 = scenarios[4].year == 2000
+    cum_value_1990 = scenarios[4].CumTotSum[index_1990]*-100
+    cum_value_2000 = scenarios[4].CumTotSum[index_2000]*-100
+    ann_value_1990 = scenarios[4].AnnRates[index_1990]*-1000
+    ann_value_2000 = scenarios[4].AnnRates[index_2000]*-1000
+    plt.scatter(cum_value_1990.index, cum_value_1990[0], color="cyan")
+    plt.scatter(cum_value_2000.index, cum_value_2000[0], color="cyan")
+    # annotation
+    plt.text(cum_value_1990.index, cum_value_1990[0] - 4, "1990: " +
+             f"{ann_value_2000[0]:.1f}" + " mm/yr")
+    # annotation
+    plt.text(cum_value_2000.index, cum_value_2000[0] - 4, "2000: " +
+             f"{ann_value_1990[0]:.1f}" + " mm/yr")
+
+    return fig
+
+
+def load_basemap(**kwargs):
+    """Basemap of Bangkok with its coastlines, rivers and province boundaries
+    read, built only once.
+
+    Building a high resolution Basemap (coastline processing) and reading the
+    rivers and the provinces shapefile take seconds. The Basemap is pickled to
+    BASEMAP_CACHE_PATH by its options, the Basemap version and the hash of the
+    shapefile, and read from there until one of them changes.
+    kwargs - Basemap options replacing those of BKK_MAP
+
+    Returns
+    map - new Basemap for one figure (drawing on a Basemap keeps state of the
+    figure, so each figure gets its own copy)
+    """
+    options = dict(BKK_MAP, **kwargs)
+    shapefiles = [PROVINCES_PATH + ext for ext in [".shp", ".shx", ".dbf"]]
+
+    # Cache file of these options and this shapefile
+    parts = [mpl_toolkits.basemap.__version__] + \
+        [key + "=" + repr(options[key]) for key in sorted(options)] + \
+        [bkk_cache.hash_file(f) for f in shapefiles]
+    fname = os.path.join(BASEMAP_CACHE_PATH,
+                         hashlib.sha1("|".join(parts).encode()).hexdigest()
+                         + ".pkl")
+
+    # If not built or read in this session
+    if fname not in _basemaps:
+
+        # If cached
+        if os.path.exists(fname):
+            with open(fname, "rb") as f:
+                _basemaps[fname] = f.read()
+
+        # If not cached, builds the basemap
+        else:
+
+            map = Basemap(**options)
+            map.readshapefile(os.path.abspath(PROVINCES_PATH),
+                              name="provinces", drawbounds=False)
+
+            # Rivers are only read (and kept by the basemap) when first drawn
+            fig = plt.figure()
+            map.drawrivers(ax=fig.gca())
+            plt.close(fig)
+
+            _basemaps[fname] = pickle.dumps(map,
+                                            protocol=pickle.HIGHEST_PROTOCOL)
+
+            # Writes to a temporary file first so that a stopped run does not
+            # leave a broken cache file
+            os.makedirs(BASEMAP_CACHE_PATH, exist_ok=True)
+            tmpname = fname + ".tmp"
+            with open(tmpname, "wb") as f:
+                f.write(_basemaps[fname])
+            os.replace(tmpname, fname)
+
+    return pickle.loads(_basemaps[fname])
+
+
 def draw_basemap(map, xs, ys, cs=None, fig=None, ax=None,
                  datalim=None, mode=None, save=0, aq=None, labels=None,
                  perc=None, time_min=None, time_max=None, figpath=None, crit=None):
@@ -914,7 +926,7 @@ def draw_basemap(map, xs, ys, cs=None, fig=None, ax=None,
 
     mode - Mode can be RMSE_full (Pastas), step_full (Pastas t90)
     sub_RMSE (subsidence RMSE), sub_forecast (subsidence forecast)
-    Map contains the basemap
+    Map contains the basemap (load_basemap)
     xs - x locations (longitude) in list
     ys - y locations (latitude) in list
     cs - data to plot in list
@@ -937,8 +949,21 @@ def draw_basemap(map, xs, ys, cs=None, fig=None, ax=None,
     map.fillcontinents(color="#4d9c83")
 
     # Adding Thailand province boundaries
-    map.readshapefile(os.path.join(os.path.abspath("inputs/GIS"), "provinces"),
-                      name="provinces", drawbounds=True, zorder=1, linewidth=.5)
+    # Basemaps from load_basemap have them read already; drawn as readshapefile
+    # draws them (clipped to the map boundary)
+    if hasattr(map, "provinces"):
+        bounds = LineCollection(map.provinces, antialiaseds=(1,))
+        bounds.set_color("k")
+        bounds.set_linewidth(.5)
+        bounds.set_label("_nolabel_")
+        bounds.set_zorder(1)
+        ax.add_collection(bounds)
+        bounds.set_clip_path(ax.patch)
+    else:
+        map.readshapefile(os.path.join(os.path.abspath("inputs/GIS"),
+                                       "provinces"),
+                          name="provinces", drawbounds=True, zorder=1,
+                          linewidth=.5, ax=ax)
 
     # Drawing rivers
     map.drawrivers(color="teal", linewidth=1)
@@ -1348,14 +1373,12 @@ def draw_basemap(map, xs, ys, cs=None, fig=None, ax=None,
         plt.savefig(full_figpath, dpi=400, bbox_inches="tight", format="eps")
 
 
-def sub_forecast_map(path, wellnestlist, all_ann_subs,
-                     tmin=None, tmax=None, save=0):
+def sub_forecast_map(path, wellnestlist, all_ann_subs=None,
+                     tmin=None, tmax=None, save=0, summary=None):
     """Plot subsidence forecast maps that are in main paper.
 
-    all_results - lists of lists: wellnestname, well name, head matrix with
-    head series of each node
     all_ann_subs - list of list of list of subsidence results for each well nest
-    for each pumping scenario
+    for each pumping scenario (or ResultHandle["ann_sub"], read when drawn)
     [0] 500,000
     [1] 250,000
     [2] 1,000,000
@@ -1364,60 +1387,46 @@ def sub_forecast_map(path, wellnestlist, all_ann_subs,
     tmin - time min
     tmax - time max
     save - if 1, save; if 0, don't save
+    summary - summary of the pumping scenarios (in the order above) over
+    bkk_periods.forecast_window(tmin, tmax), e.g. from ResultStore.periods;
+    computed from all_ann_subs if None
 
     Assumes four wells in well nest
     """
-    # Importing spatial coordinates
-    full_GWpath = os.path.join(os.path.abspath("inputs"),
-                               "GroundwaterWellLocs.xls")
-    gwwell_locs = pd.read_excel(full_GWpath)
-
-    # Locations of wellnests; removing duplicates
-    gwwell_locs = gwwell_locs.drop_duplicates("WellNest_Name", keep="first")
+    # Locations of wellnests
+    catalog = bkk_catalog.load_catalog()
 
     # Preallocation
     # Empty dictionary
     d_dict = {}
 
+    # Difference in cum sum between the end of tmin and the end of the last
+    # year before tmax, for all scenarios and well nests at once
+    if summary is None:
+        summary = bkk_periods.period_summary(
+            list(all_ann_subs), bkk_periods.forecast_window(tmin, tmax))
+
     # For each pumping scenario
     # num_scenario is the pumping scenario index,scen_res = pumping scenario result
-    for num_scenario, scen_res in enumerate(all_ann_subs):
-
-        # Preallocation
-        # Saving relevant xs, ys, and cumsum
-        xs = []
-        ys = []
-        cs = []
-
-        # For each well nest
-        for i in range(len(scen_res)):
-
-            # Get cumulative sum of highest year below tmax
-            max_year = scen_res[i][1].year[
-                scen_res[i][1].year < int(tmax)].max()
-
-            # Saving difference in cum sum between a time period
-            # Cumulative sub in cm
-            cs.append((scen_res[i][1].CumTotSum[
-                scen_res[i][1].year == max_year].item() -
-                scen_res[i][1].CumTotSum[
-                    scen_res[i][1].year == int(tmin)].item()) * -100)
-
-            x_ = gwwell_locs.Long[
-                gwwell_locs.WellNest_Name == scen_res[i][0]].item()
-            y_ = gwwell_locs.Lat[
-                gwwell_locs.WellNest_Name == scen_res[i][0]].item()
-            xs.append(x_)
-            ys.append(y_)
+    for num_scenario, (_, scen_res) in enumerate(
+            summary["periods"].groupby("scenario", sort=False)):
+
+        # Locations of the well nests
+        xs = [catalog.coordinates(wellnest)[0]
+              for wellnest in scen_res.wellnest]
+        ys = [catalog.coordinates(wellnest)[1]
+              for wellnest in scen_res.wellnest]
 
         # Creates a dictionary with location and cum sub
-        d_dict[num_scenario] = pd.DataFrame({"x": xs, "y": ys, "cs": cs})
+        # Cumulative sub in cm
+        d_dict[num_scenario] = pd.DataFrame({"x": xs, "y": ys,
+                                             "cs": scen_res.change.values *
+                                             -100})
 
     # Initializing figure
     fig, ax = plt.subplots(figsize=(3.2, 2.2), dpi=400)
     datalim = [-5, 25]
-    map = Basemap(llcrnrlon=100.3, llcrnrlat=13.4, urcrnrlon=100.8, urcrnrlat=14,
-                  resolution="h", ellps="WGS84", lat_0=13.6, lon_0=100.4)
+    map = load_basemap()
     draw_basemap(map, xs, ys, d_dict, fig=fig, ax=ax,
                  datalim=datalim, mode="Sub_Forecast_Map", save=0,
                  time_min=tmin, time_max=tmax, figpath=path)
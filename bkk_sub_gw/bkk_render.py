@@ -0,0 +1,150 @@
+# ##############################################################################
+"""Rendering and saving figures of many well nests on a pool of processes.
+
+A figure job is a function drawing one figure (of one well nest, usually), its
+arguments and the files it is saved to. Jobs are rendered with the Agg backend
+and the matplotlib settings of the caller, in separate processes if asked.
+Each file is written to a temporary file first and then renamed, so a stopped
+run does not leave a half-written figure. The time taken by each figure is
+printed.
+
+Article Title: Hybrid data-driven, physics-based modeling of ground-
+water and subsidence with application to Bangkok, Thailand
+
+Jenny Soonthornrangsan 2023
+TU Delft
+
+"""
+# ##############################################################################
+
+###############################################################################
+# import statements
+###############################################################################
+
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+
+# Default output formats of the figures
+FORMATS = ["eps", "png"]
+
+# Folder (in the folder of the figures) figures are written to before being
+# renamed; same file names, as EPS files keep their file name as title
+TMP_FOLDER = ".rendering"
+
+
+# %%###########################################################################
+# Figure jobs
+###############################################################################
+
+class FigureJob:
+    """One figure to draw and save.
+
+    func is called with kwargs and returns the figure it drew. The figure is
+    saved to path/name.<format> for each format.
+    """
+
+    def __init__(self, func, wellnest, kwargs, path, name, formats=None,
+                 savefig_kw=None):
+
+        self.func = func  # Function drawing the figure
+        self.wellnest = wellnest  # Well nest of the figure
+        self.kwargs = kwargs  # Arguments of func
+        self.path = path  # Folder of the files
+        self.name = name  # File name without extension
+        self.formats = list(FORMATS if formats is None else formats)
+        self.savefig_kw = {} if savefig_kw is None else savefig_kw
+
+    def files(self):
+        """Paths of the files of the figure, one per format."""
+        return [os.path.join(self.path, self.name + "." + fmt)
+                for fmt in self.formats]
+
+
+def render_job(job, rc=None):
+    """Draws and saves one figure.
+
+    job - FigureJob
+    rc - matplotlib settings to draw with (see render), current if None
+
+    Returns
+    name - file name of the figure
+    seconds - time taken to draw and save it
+    """
+    start = time.perf_counter()
+
+    with plt.rc_context(rc):
+
+        fig = job.func(**job.kwargs)
+
+        for fmt, fname in zip(job.formats, job.files()):
+
+            # Writes to a temporary file first so that a stopped run does not
+            # leave a broken figure
+            tmpname = os.path.join(job.path, TMP_FOLDER,
+                                   os.path.basename(fname))
+            fig.savefig(tmpname, format=fmt, **job.savefig_kw)
+            os.replace(tmpname, fname)
+
+        plt.close(fig)
+
+    return job.name, time.perf_counter() - start
+
+
+def _init_worker():
+    """Agg backend in the rendering processes (no windows are opened)."""
+    plt.switch_backend("Agg")
+
+
+def render(jobs, n_jobs=1):
+    """Draws and saves figures, in parallel if n_jobs > 1.
+
+    Figures are drawn with the matplotlib settings (rcParams) at the time of
+    the call, whatever the process. Processes are forked so that scripts do not
+    need to be run under if __name__ == "__main__"; where processes cannot be
+    forked (Windows), figures are drawn one at a time.
+    jobs - list of FigureJob
+    n_jobs - number of processes, number of processors if None
+
+    Returns
+    timing - list of (name, seconds) of each job, in the order of jobs
+    """
+    start = time.perf_counter()
+
+    # Settings of the caller (the backend is left to each process)
+    rc = {key: mpl.rcParams[key] for key in mpl.rcParams if key != "backend"}
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count()
+
+    if n_jobs > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        print("Processes cannot be forked, rendering one figure at a time")
+        n_jobs = 1
+
+    for job in jobs:
+        os.makedirs(os.path.join(job.path, TMP_FOLDER), exist_ok=True)
+
+    if n_jobs == 1 or len(jobs) < 2:
+        timing = [render_job(job, rc) for job in jobs]
+
+    else:
+        with ProcessPoolExecutor(
+                max_workers=min(n_jobs, len(jobs)),
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_worker) as pool:
+            timing = list(pool.map(render_job, jobs, [rc] * len(jobs)))
+
+    # Temporary folders are empty once all figures are renamed
+    for folder in {os.path.join(job.path, TMP_FOLDER) for job in jobs}:
+        os.rmdir(folder)
+
+    # Time of each figure
+    for name, seconds in timing:
+        print("Rendered " + name + " in " + "%.2f" % seconds + " s")
+    print("Rendered " + str(len(jobs)) + " figures in " +
+          "%.2f" % (time.perf_counter() - start) + " s")
+
+    return timing
@@ -0,0 +1,672 @@
+# ##############################################################################
+"""Chunked store of subsidence results (scenario, well nest, layer, time).
+
+Each run (a pumping scenario, a sensitivity value...) is saved as one scenario
+of the store. The results of each clay layer of each well nest are one chunk:
+a compressed .npz file with one array per variable, so one variable of one layer
+of one well nest is read without reading the rest. Settings of the run (CC, Nz,
+proxyflag, pumping scenario...) are kept as attributes in index.json, which is
+written last so that scenarios can be appended as runs finish. Replaces the
+pickled model_sub dictionaries in models.
+
+Article Title: Hybrid data-driven, physics-based modeling of ground-
+water and subsidence with application to Bangkok, Thailand
+
+Jenny Soonthornrangsan 2023
+TU Delft
+
+"""
+# ##############################################################################
+
+###############################################################################
+# import statements
+###############################################################################
+
+import os
+import json
+import time
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+
+# Summaries over periods
+from bkk_sub_gw import bkk_periods
+
+# Variables of each layer chunk
+# t - time original (days since the first date)
+# sub, subv - cum sub total and inelastic at the original dates (m)
+# t_model - time of the clay model (days)
+# sub_model, subv_model - cum sub total and inelastic at t_model (m)
+# heads - heads in clay nodes (node, t_model)
+# z - z distribution of the nodes
+# t_ic, h_ic - time and heads of the spin up run (if run)
+VARIABLES = ["t", "sub", "subv", "t_model", "sub_model", "subv_model",
+             "heads", "z", "t_ic", "h_ic"]
+
+# Keys of model_sub with the clay parameters of the run
+PARAM_KEYS = ["Thick_data", "Sske_data", "Sskv_data", "K_data"]
+
+# Keys of model_sub with the results
+RESULT_KEYS = ["wellnestlist", "all_results", "sub_total", "subv_total",
+               "ann_sub", "avgsub"]
+
+# Variables of each layer chunk saved at the storage precision of the store;
+# times and node depths are always saved as computed
+HISTORIES = ["sub", "subv", "sub_model", "subv_model", "heads", "h_ic"]
+
+# Storage precisions of the histories
+# float64 - as computed
+# float32 - single precision, relative error below 6e-8 (2**-24), half the size
+# quantized - rounded to a step (m) and saved as int16/int32 differences in
+# time, absolute error below step/2
+PRECISIONS = ["float64", "float32", "quantized"]
+
+# Default step of quantized histories (m), 0.1 mm, one order of magnitude
+# below the accuracy of the leveling surveys (SurveyingLevels)
+QUANTUM = 1e-4
+
+
+# %%###########################################################################
+# Storage precision
+###############################################################################
+
+def encode(name, values, precision="float64", step=QUANTUM):
+    """Arrays to save one history at a storage precision.
+
+    name - name of the history (e.g. heads)
+    values - array of the history, time along the last axis
+    precision - one of PRECISIONS
+    step - step of quantized histories (m)
+
+    Returns
+    arrays - dictionary with the history saved under name and, if quantized,
+    its step under name + "_step"
+    """
+    if precision not in PRECISIONS:
+        raise ValueError("Unknown precision " + str(precision) +
+                         ", use one of " + ", ".join(PRECISIONS))
+
+    values = np.asarray(values, dtype=float)
+
+    if precision == "float64":
+        return {name: values}
+
+    # Histories with missing values are not quantized
+    if precision == "float32" or not np.all(np.isfinite(values)):
+        return {name: values.astype(np.float32)}
+
+    # Integer multiples of the step; differences in time are small and
+    # compress well, and are summed back without any error
+    codes = np.rint(values / step).astype(np.int64)
+    deltas = np.diff(codes, axis=-1, prepend=0) if codes.ndim > 0 else codes
+    for dtype in (np.int16, np.int32):
+        if deltas.size == 0 or np.abs(deltas).max() < np.iinfo(dtype).max:
+            deltas = deltas.astype(dtype)
+            break
+
+    return {name: deltas, name + "_step": np.array(step)}
+
+
+def decode(data, name):
+    """History saved by encode, as float64.
+
+    data - npz file or dictionary of arrays from encode
+    name - name of the history
+
+    Returns
+    values - array, None if not saved
+    """
+    if name not in data:
+        return None
+
+    values = data[name]
+
+    # If quantized
+    if name + "_step" in data:
+        codes = np.cumsum(values, axis=-1, dtype=np.int64) \
+            if values.ndim > 0 else values
+        return codes * float(data[name + "_step"])
+
+    return values.astype(float)
+
+
+def encode_run(results, precision="float64", step=QUANTUM):
+    """(all_results, sub_total, subv_total) of bkk_subsidence with the
+    histories at a storage precision, for saving or sending to another process.
+
+    results - (all_results, sub_total, subv_total)
+    precision - one of PRECISIONS
+    step - step of quantized histories (m)
+
+    Returns
+    results - same lists with each history replaced by its arrays from encode
+    """
+    all_results, sub_total, subv_total = results
+
+    # Heads in clay and of the spin up run
+    all_results = [[encode("values", item, precision, step)
+                    if j in (4, 7) else item for j, item in enumerate(row)]
+                   for row in all_results]
+
+    # Cum sub at the model time and at the original dates
+    sub_total, subv_total = (
+        [[encode("values", item, precision, step)
+          if j in (3, 4) else item for j, item in enumerate(row)]
+         for row in total] for total in (sub_total, subv_total))
+
+    return all_results, sub_total, subv_total
+
+
+def decode_run(results):
+    """(all_results, sub_total, subv_total) from encode_run, as float64."""
+    return tuple([[decode(item, "values") if isinstance(item, dict) else item
+                   for item in row] for row in rows] for rows in results)
+
+
+# %%###########################################################################
+# Result store
+###############################################################################
+
+class ResultStore:
+    """Subsidence results of many runs, readable one variable at a time.
+
+    Chunks are saved in <scenario>/<wellnest>/<layer>.npz (layer is the index
+    of the clay layer from shallow to deep) and the annual subsidence and dates
+    of a well nest in <scenario>/<wellnest>/annual.npz. Clay parameters of a
+    scenario are saved in <scenario>/params.json. Histories (HISTORIES) are
+    saved at the precision of the store and read back as float64.
+    """
+
+    def __init__(self, path, precision="float64", step=QUANTUM):
+
+        self.path = path  # Folder of the store
+        self.precision = precision  # Storage precision (one of PRECISIONS)
+        self.step = step  # Step of quantized histories (m)
+
+        os.makedirs(path, exist_ok=True)
+
+        # Scenarios in the store
+        self.index = {}
+        if os.path.exists(self._index_file()):
+            with open(self._index_file()) as f:
+                self.index = json.load(f)
+
+    def _index_file(self):
+        """Path of index.json."""
+        return os.path.join(self.path, "index.json")
+
+    def _folder(self, scenario, wellnest):
+        """Folder of the chunks of a well nest."""
+        return os.path.join(self.path, scenario, wellnest)
+
+    def __contains__(self, scenario):
+
+        return scenario in self.index
+
+    def scenarios(self):
+        """Scenarios in the order they were appended."""
+        return list(self.index)
+
+    def attrs(self, scenario):
+        """Settings of a scenario (tmin, tmax, CC, clay_nodes, proxyflag,
+        pumping_scenario, mode...)."""
+        return dict(self.index[scenario]["attrs"])
+
+    def params(self, scenario):
+        """Dictionary of the clay parameter dataframes of a scenario
+        (Thick_data, Sske_data, Sskv_data, K_data)."""
+        fname = os.path.join(self.path, scenario, "params.json")
+        if not os.path.exists(fname):
+            return {}
+
+        with open(fname) as f:
+            frames = json.load(f)
+
+        params = {}
+        for key, frame in frames.items():
+            index = pd.Index(frame["index"], name=frame["index_name"])
+            params[key] = pd.DataFrame(
+                {col: np.array(frame["data"][num], dtype=frame["dtypes"][num])
+                 for num, col in enumerate(frame["columns"])}, index=index)
+
+        return params
+
+    def wellnests(self, scenario):
+        """Well nests of a scenario."""
+        return list(self.index[scenario]["wellnests"])
+
+    def layers(self, scenario, wellnest):
+        """Well names of the clay layers of a well nest, shallow to deep."""
+        return list(self.index[scenario]["wellnests"][wellnest]["layers"])
+
+    def _layer_pos(self, scenario, wellnest, layer):
+        """Index of a layer given by index or well name."""
+        if isinstance(layer, str):
+            return self.layers(scenario, wellnest).index(layer)
+
+        return layer
+
+    def read(self, scenario, wellnest, layer, variable):
+        """One variable of one layer of one well nest.
+
+        scenario - name of scenario
+        wellnest - name of well nest
+        layer - index of clay layer (0 shallowest) or well name (first layer
+        with that name; proxy wells can share a name)
+        variable - one of VARIABLES
+
+        Returns
+        values - array, None if not saved (e.g. t_ic without spin up)
+        """
+        layer = self._layer_pos(scenario, wellnest, layer)
+        fname = os.path.join(self._folder(scenario, wellnest),
+                             str(layer) + ".npz")
+
+        # Only the variable is decompressed
+        with np.load(fname, allow_pickle=False) as data:
+
+            return decode(data, variable)
+
+    def dates(self, scenario, wellnest):
+        """Original dates of the results of a well nest."""
+        with np.load(os.path.join(self._folder(scenario, wellnest),
+                                  "annual.npz"), allow_pickle=False) as data:
+
+            return pd.DatetimeIndex(data["dates"])
+
+    def annual(self, scenario, wellnest):
+        """Dataframe of annual cumulative subsidence (CumTotSum), year and
+        annual rates (AnnRates) of a well nest, as from bkk_postproc."""
+        with np.load(os.path.join(self._folder(scenario, wellnest),
+                                  "annual.npz"), allow_pickle=False) as data:
+
+            return pd.DataFrame({"CumTotSum": data["CumTotSum"],
+                                 "year": data["year"],
+                                 "AnnRates": data["AnnRates"]},
+                                index=pd.DatetimeIndex(data["annual_dates"]))
+
+    def avgsub(self, scenario, wellnest):
+        """Average fraction of subsidence from each clay layer, None if not
+        saved."""
+        return self.index[scenario]["wellnests"][wellnest].get("avgsub")
+
+    def append(self, scenario, model_sub, precision=None, step=None):
+        """Save the results of one run as a scenario of the store.
+
+        Well nests of a scenario already in the store are replaced; other
+        well nests are kept.
+        scenario - name of scenario
+        model_sub - dictionary of one run as saved by the scripts: wellnestlist,
+        all_results, sub_total and subv_total (after bkk_postproc), ann_sub,
+        optionally avgsub and clay parameter dataframes; all other keys are
+        saved as attributes
+        precision - storage precision of the histories (one of PRECISIONS),
+        precision of the store if None
+        step - step of quantized histories (m), step of the store if None
+        """
+        if precision is None:
+            precision = self.precision
+        if step is None:
+            step = self.step
+        wellnestlist = model_sub["wellnestlist"]
+        all_results = model_sub["all_results"]
+        sub_total = model_sub["sub_total"]
+        subv_total = model_sub["subv_total"]
+
+        entry = self.index.get(scenario, {"attrs": {}, "wellnests": {}})
+        entry["attrs"].update({key: value for key, value in model_sub.items()
+                               if key not in RESULT_KEYS + PARAM_KEYS})
+
+        # For each well nest
+        for num_well, wellnest in enumerate(wellnestlist):
+
+            folder = self._folder(scenario, wellnest)
+            os.makedirs(folder, exist_ok=True)
+
+            # Layers of this well nest
+            rows = [i for i in range(len(all_results))
+                    if all_results[i][0] == wellnest]
+
+            # For each clay layer
+            for layer, i in enumerate(rows):
+
+                chunk = {"t": all_results[i][2],
+                         "sub": sub_total[i][4],
+                         "subv": subv_total[i][4],
+                         "t_model": sub_total[i][2],
+                         "sub_model": sub_total[i][3],
+                         "subv_model": subv_total[i][3],
+                         "heads": all_results[i][4],
+                         "z": all_results[i][5]}
+
+                # If spin up run
+                if len(all_results[i]) > 6:
+                    chunk["t_ic"] = all_results[i][6]
+                    chunk["h_ic"] = all_results[i][7]
+
+                # Histories at the storage precision
+                for name in HISTORIES:
+                    if name in chunk:
+                        chunk.update(encode(name, chunk.pop(name), precision,
+                                            step))
+
+                _save(os.path.join(folder, str(layer) + ".npz"), chunk)
+
+            # Dates and annual subsidence of the well nest
+            annual = [ann[1] for ann in model_sub["ann_sub"]
+                      if ann[0] == wellnest][0]
+            _save(os.path.join(folder, "annual.npz"),
+                  {"dates": np.asarray(all_results[rows[0]][3],
+                                       dtype="datetime64[ns]"),
+                   "annual_dates": annual.index.values.astype(
+                       "datetime64[ns]"),
+                   "CumTotSum": annual.CumTotSum.values,
+                   "year": annual.year.values,
+                   "AnnRates": annual.AnnRates.values})
+
+            nest_entry = {"layers": [all_results[i][1] for i in rows]}
+            if model_sub.get("avgsub") is not None:
+                nest_entry["avgsub"] = [avg[2] for avg in model_sub["avgsub"]
+                                        if avg[0] == wellnest]
+            entry["wellnests"][wellnest] = nest_entry
+
+        # Clay parameters of the run
+        frames = {key: {"columns": model_sub[key].columns.tolist(),
+                        "index": model_sub[key].index.tolist(),
+                        "index_name": model_sub[key].index.name,
+                        "dtypes": [str(dtype) for dtype in
+                                   model_sub[key].dtypes],
+                        "data": [model_sub[key][col].tolist()
+                                 for col in model_sub[key].columns]}
+                  for key in PARAM_KEYS if key in model_sub}
+        if len(frames) > 0:
+            _write_json(os.path.join(self.path, scenario, "params.json"),
+                        frames)
+
+        # Index written last; the time of writing tells cached summaries of
+        # the scenario apart
+        entry["written"] = time.time_ns()
+        entry["precision"] = {"precision": precision,
+                              "step": step if precision == "quantized"
+                              else None}
+        self.index[scenario] = entry
+        _write_json(self._index_file(), self.index)
+
+    def periods(self, spec, scenarios=None,
+                percentiles=bkk_periods.PERCENTILES):
+        """Cumulative subsidence, change and rate over periods of the daily
+        results of all well nests and scenarios, cached by period spec.
+
+        spec - one of bkk_periods.PERIOD_SPECS or list of (start, end) windows
+        scenarios - names of scenarios, all scenarios if None
+        percentiles - percentiles over the well nests of each scenario and
+        period
+
+        Returns
+        summary - dictionary of periods and percentiles dataframes (see
+        bkk_periods.summarize)
+        """
+        if scenarios is None:
+            scenarios = self.scenarios()
+
+        # Summaries are computed again if a scenario is appended again
+        key = hashlib.sha1("|".join(
+            [bkk_periods.spec_key(spec), str(list(percentiles))] +
+            [scenario + ":" + str(self.index[scenario].get("written"))
+             for scenario in scenarios]).encode()).hexdigest()
+        fname = os.path.join(self.path, "periods", key + ".pkl")
+
+        if os.path.exists(fname):
+            with open(fname, "rb") as f:
+                return pickle.load(f)
+
+        # Daily cum sub of all clay layers of each well nest
+        results = {}
+        for scenario in scenarios:
+            handle = ResultHandle(self, scenario)
+            results[scenario] = [[wellnest, handle.cumulative(wellnest)]
+                                 for wellnest in handle.wellnestlist]
+
+        summary = bkk_periods.period_summary(results, spec,
+                                             percentiles=percentiles)
+
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        tmpname = fname + ".tmp"
+        with open(tmpname, "wb") as f:
+            pickle.dump(summary, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, fname)
+
+        return summary
+
+    def model_sub(self, scenario):
+        """Dictionary of one scenario in the same form as the model_sub
+        dictionaries of the scripts (all arrays read)."""
+        model_sub = {"wellnestlist": self.wellnests(scenario),
+                     "all_results": [],
+                     "sub_total": [],
+                     "subv_total": [],
+                     "ann_sub": []}
+        avgsub = []
+
+        # For each well nest and clay layer
+        for wellnest in model_sub["wellnestlist"]:
+
+            dates = self.dates(scenario, wellnest)
+
+            for layer, well in enumerate(self.layers(scenario, wellnest)):
+
+                fname = os.path.join(self._folder(scenario, wellnest),
+                                     str(layer) + ".npz")
+                with np.load(fname, allow_pickle=False) as data:
+                    chunk = {key: decode(data, key) for key in data.files
+                             if not key.endswith("_step")}
+
+                results = [wellnest, well, chunk["t"], dates, chunk["heads"],
+                           chunk["z"]]
+                if "t_ic" in chunk:
+                    results.extend([chunk["t_ic"], chunk["h_ic"]])
+                model_sub["all_results"].append(results)
+
+                model_sub["sub_total"].append([wellnest, well,
+                                               chunk["t_model"],
+                                               chunk["sub_model"],
+                                               chunk["sub"]])
+                model_sub["subv_total"].append([wellnest, well,
+                                                chunk["t_model"],
+                                                chunk["subv_model"],
+                                                chunk["subv"]])
+
+            model_sub["ann_sub"].append([wellnest,
+                                         self.annual(scenario, wellnest)])
+
+            if self.avgsub(scenario, wellnest) is not None:
+                avgsub.extend([[wellnest, j, avg] for j, avg in
+                               enumerate(self.avgsub(scenario, wellnest))])
+
+        if len(avgsub) > 0:
+            model_sub["avgsub"] = avgsub
+
+        model_sub.update(self.attrs(scenario))
+        model_sub.update(self.params(scenario))
+
+        return model_sub
+
+
+def _save(fname, arrays):
+    """Save compressed arrays (to a temporary file first)."""
+    tmpname = fname + ".tmp.npz"
+    np.savez_compressed(tmpname, **arrays)
+    os.replace(tmpname, fname)
+
+
+def _write_json(fname, obj):
+    """Write a json file (to a temporary file first)."""
+    tmpname = fname + ".tmp"
+    with open(tmpname, "w") as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmpname, fname)
+
+
+# %%###########################################################################
+# Lazy results
+###############################################################################
+
+class ResultHandle:
+    """Results of one scenario of a ResultStore, read only when used.
+
+    Can be used like a model_sub dictionary: handle["ann_sub"] is a sequence
+    like the ann_sub list whose annual dataframes are read when indexed,
+    settings and parameters are read from the index, and all_results,
+    sub_total and subv_total (with all head matrices) are only read if asked
+    for. Accessors read one well nest or layer at a time.
+    """
+
+    def __init__(self, store, scenario):
+
+        self.store = store  # ResultStore
+        self.scenario = scenario  # Name of scenario
+        self.wellnestlist = store.wellnests(scenario)  # Well nests
+
+        # Annual dataframes already read, by well nest
+        self._annual = {}
+
+        # Full model_sub dictionary, read if all results are asked for
+        self._model_sub = None
+
+    def __getitem__(self, key):
+        """model_sub-style access."""
+        if key == "wellnestlist":
+            return self.wellnestlist
+
+        if key == "ann_sub":
+            return AnnualResults(self)
+
+        if key == "avgsub":
+            if any(self.store.avgsub(self.scenario, wellnest) is None
+                   for wellnest in self.wellnestlist):
+                raise KeyError(key)
+            return [[wellnest, j, avg] for wellnest in self.wellnestlist
+                    for j, avg in enumerate(self.store.avgsub(self.scenario,
+                                                              wellnest))]
+
+        attrs = self.store.attrs(self.scenario)
+        if key in attrs:
+            return attrs[key]
+
+        if key in PARAM_KEYS:
+            return self.store.params(self.scenario)[key]
+
+        # All results, head matrices included
+        if key in RESULT_KEYS:
+            if self._model_sub is None:
+                self._model_sub = self.store.model_sub(self.scenario)
+            return self._model_sub[key]
+
+        raise KeyError(key)
+
+    def annual(self, wellnest):
+        """Dataframe of annual cumulative subsidence (CumTotSum), year and
+        annual rates (AnnRates) of a well nest (m)."""
+        if wellnest not in self._annual:
+            self._annual[wellnest] = self.store.annual(self.scenario, wellnest)
+
+        return self._annual[wellnest]
+
+    def annual_rates(self, wellnest):
+        """Series of annual subsidence rates of a well nest (m/yr)."""
+        return self.annual(wellnest).AnnRates
+
+    def cumulative(self, wellnest, layer=None, inelastic=False):
+        """Series of cumulative subsidence at the original dates (m).
+
+        wellnest - name of well nest
+        layer - index of clay layer or well name; all clay layers if None
+        inelastic - if True, inelastic subsidence only
+        """
+        variable = "subv" if inelastic else "sub"
+
+        if layer is None:
+            layers = range(len(self.store.layers(self.scenario, wellnest)))
+        else:
+            layers = [layer]
+
+        values = sum(self.store.read(self.scenario, wellnest, layer, variable)
+                     for layer in layers)
+
+        return pd.Series(values, index=self.store.dates(self.scenario,
+                                                        wellnest))
+
+    def last_cumulative(self, wellnest):
+        """Cumulative subsidence of a well nest at the end of the last year
+        (m)."""
+        return self.annual(wellnest).CumTotSum.iloc[-1]
+
+    def heads(self, wellnest, layer):
+        """Heads in the clay nodes of one layer (node, model time step) and
+        the model time (days)."""
+        return (self.store.read(self.scenario, wellnest, layer, "heads"),
+                self.store.read(self.scenario, wellnest, layer, "t_model"))
+
+
+class AnnualResults:
+    """ann_sub list of a ResultHandle: item i is [wellnest, annual dataframe],
+    read when indexed."""
+
+    def __init__(self, handle):
+
+        self.handle = handle  # ResultHandle
+
+    def __len__(self):
+
+        return len(self.handle.wellnestlist)
+
+    def __getitem__(self, num_well):
+
+        wellnest = self.handle.wellnestlist[num_well]
+
+        return [wellnest, self.handle.annual(wellnest)]
+
+    def __iter__(self):
+
+        for num_well in range(len(self)):
+            yield self[num_well]
+
+
+# %%###########################################################################
+# Loading results
+###############################################################################
+
+def open_results(store, scenario, pickle_path=None):
+    """Lazy ResultHandle of a scenario, moving an old pickle to the store.
+
+    store - ResultStore
+    scenario - name of scenario
+    pickle_path - path to the pickled model_sub of the scenario, read and
+    appended to the store if the scenario is not in the store yet
+
+    Returns
+    results - ResultHandle
+    """
+    if scenario not in store:
+
+        with open(pickle_path, "rb") as f:
+            store.append(scenario, pickle.load(f))
+
+    return ResultHandle(store, scenario)
+
+
+def load_model_sub(store, scenario, pickle_path=None):
+    """model_sub dictionary of a scenario, moving an old pickle to the store.
+
+    store - ResultStore
+    scenario - name of scenario
+    pickle_path - path to the pickled model_sub of the scenario, read and
+    appended to the store if the scenario is not in the store yet
+
+    Returns
+    model_sub - dictionary of the scenario
+    """
+    open_results(store, scenario, pickle_path)
+
+    return store.model_sub(scenario)
@@ -20,23 +20,195 @@ TU Delft
 
 import re
 import os
+import hashlib
 import pandas as pd
 import numpy as np
 import scipy.linalg as lin
 import sys
-import functools
 import pastas as ps
+from scipy.signal import fftconvolve
 
 # Importing script for pre-processing Thai GW data
 import main_functions as mfs
 
+# Disk caches of Pastas simulated heads and excel inputs
+from bkk_sub_gw import bkk_cache
+
+# Catalog of well nests and Pastas models
+from bkk_sub_gw import bkk_catalog
+
 pd.options.mode.chained_assignment = None  # default='warn'
 
+# %%###########################################################################
+# Heads of the aquifers of a well nest
+###############################################################################
+
+# Aquifers from shallowest to deepest
+AQUIFERS = ["BK", "PD", "NL", "NB"]
+
+# Proxies for missing aquifers
+# For each set of aquifers with heads, the aquifer whose heads are used for
+# BK, PD, NL and NB. A missing aquifer uses the nearest aquifer with heads (the
+# deeper one if both are as near)
+PROXY_TABLE = {
+    frozenset(["BK", "PD", "NL", "NB"]): ("BK", "PD", "NL", "NB"),
+    frozenset(["BK", "PD", "NL"]): ("BK", "PD", "NL", "NL"),
+    frozenset(["BK", "PD", "NB"]): ("BK", "PD", "NB", "NB"),
+    frozenset(["BK", "NL", "NB"]): ("BK", "NL", "NL", "NB"),
+    frozenset(["PD", "NL", "NB"]): ("PD", "PD", "NL", "NB"),
+    frozenset(["BK", "PD"]): ("BK", "PD", "PD", "PD"),
+    frozenset(["BK", "NL"]): ("BK", "NL", "NL", "NL"),
+    frozenset(["BK", "NB"]): ("BK", "BK", "NB", "NB"),
+    frozenset(["PD", "NL"]): ("PD", "PD", "NL", "NL"),
+    frozenset(["PD", "NB"]): ("PD", "PD", "NB", "NB"),
+    frozenset(["NL", "NB"]): ("NL", "NL", "NL", "NB"),
+    frozenset(["BK"]): ("BK", "BK", "BK", "BK"),
+    frozenset(["PD"]): ("PD", "PD", "PD", "PD"),
+    frozenset(["NL"]): ("NL", "NL", "NL", "NL"),
+    frozenset(["NB"]): ("NB", "NB", "NB", "NB"),
+}
+
+
+class WellNestHeads:
+    """Daily heads of the BK, PD, NL and NB aquifers of a well nest.
+
+    Heads of all layers are one (4 x T) array on a shared DatetimeIndex, with
+    NaN where a layer has no heads. Each layer has a name (well name or
+    "Proxy BK" etc.) and the well whose heads it uses, so proxies are marked
+    without keeping renamed copies of series.
+    """
+
+    def __init__(self, index, heads, names, sources):
+
+        self.index = index  # Dates of the heads
+        self.heads = heads  # (layers x T) array of heads
+        self.names = names  # Name of each layer
+        self.sources = sources  # Well whose heads are used for each layer
+
+    @classmethod
+    def from_series(cls, series, names=None, sources=None):
+        """Stack series of heads, shallow to deep aquifers.
+
+        series - list of series of heads, one for each layer; the same series
+        can be used for more than one layer
+        names - name of each layer, names of the series if None
+        sources - well whose heads are used for each layer, names if None
+        """
+        if names is None:
+            names = [temp.name for temp in series]
+        if sources is None:
+            sources = names
+
+        # All dates of all layers
+        index = series[0].index
+        for temp in series[1:]:
+            if not temp.index.equals(index):
+                index = index.union(temp.index)
+
+        heads = np.empty((len(series), len(index)))
+        for layer, temp in enumerate(series):
+            heads[layer] = temp.values if temp.index.equals(index) else \
+                temp.reindex(index).values
+
+        return cls(index, heads, list(names), list(sources))
+
+    @property
+    def proxies(self):
+        """True for each layer that uses the heads of another well."""
+        return [name != source
+                for name, source in zip(self.names, self.sources)]
+
+    def __len__(self):
+        """Number of layers."""
+        return len(self.names)
+
+    def __iadd__(self, value):
+        """Adds value to all heads, e.g. to correct to land surface."""
+        self.heads += value
+
+        return self
+
+    def layer(self, layer):
+        """Series of heads of one layer (0 is the shallowest), no copy."""
+        return pd.Series(self.heads[layer], index=self.index,
+                         name=self.names[layer], copy=False)
+
+    def window(self, tmin=None, tmax=None):
+        """Heads on the dates all layers have heads, from year tmin to tmax.
+
+        Slice of the same array, no copy
+        tmin, tmax - (str) minimum and maximum year, None for no limit
+        """
+        # Dates all layers have heads
+        valid = ~np.isnan(self.heads).any(axis=0)
+        if valid.any():
+            start = valid.argmax()
+            stop = len(valid) - valid[::-1].argmax()
+        else:
+            start = stop = 0
+
+        # Years within tmin and tmax
+        if tmin is not None:
+            start = max(start, self.index.searchsorted(pd.Timestamp(tmin)))
+        if tmax is not None:
+            stop = min(stop, self.index.searchsorted(
+                pd.Timestamp(str(int(tmax) + 1))))
+        stop = max(start, stop)
+
+        return WellNestHeads(self.index[start:stop],
+                             self.heads[:, start:stop],
+                             self.names, self.sources)
+
+    def to_frame(self):
+        """Dataframe of heads with one column per layer."""
+        return pd.DataFrame(self.heads.T, index=self.index,
+                            columns=self.names)
+
+
+def proxy_heads(well_names, heads, proxyflag):
+    """Heads of BK, PD, NL and NB with available heads as proxy for missing.
+
+    Proxies are taken from PROXY_TABLE; each series is only used by reference
+    well_names - list of well names with heads, shallow to deep aquifers
+    heads - list of series of heads for each well
+    proxyflag - 1 if using available heads as proxy for missing heads
+
+    Returns
+    heads - WellNestHeads with a layer for each aquifer; proxy layers are named
+    "Proxy BK" etc.
+    """
+    # Aquifer of each well
+    aquifers = [[aq for aq in AQUIFERS if aq in name][0]
+                for name in well_names]
+
+    # If using only available heads
+    if proxyflag != 1:
+
+        # Needs all four wells if proxyflag is not on
+        if len(set(aquifers)) < 4:
+
+            sys.exit("Needs all four wells if proxyflag is not on")
+
+        return WellNestHeads.from_series(heads, names=well_names)
+
+    # Well used for each aquifer
+    well_pos = {aq: j for j, aq in enumerate(aquifers)}
+    proxies = PROXY_TABLE[frozenset(aquifers)]
+
+    series = [heads[well_pos[proxy]] for proxy in proxies]
+    names = [well_names[well_pos[aq]] if proxy == aq else "Proxy " + aq
+             for aq, proxy in zip(AQUIFERS, proxies)]
+    sources = [well_names[well_pos[proxy]] for proxy in proxies]
+
+    return WellNestHeads.from_series(series, names=names, sources=sources)
+
+
 # %%###########################################################################
 # Preprocessing GW well nest data
 ###############################################################################
 
-def bkk_wellnest_preproc(wellnestname, tmin, tmax, proxyflag):
+def bkk_wellnest_preproc(wellnestname, tmin, tmax, proxyflag,
+                         resample_daily=True, obs_store=None):
     """Take well nest name, load data, and clean it up.
 
     Returns data within tmin and tmax
@@ -46,272 +218,371 @@ def bkk_wellnest_preproc(wellnestname, tmin, tmax, proxyflag):
     tmin, tmax -- (str) minimum and maximum year, if min year = 1900 but
     data starts at 1960, will return data from 1960 onwards
     proxyflag - 1 if using available heads as proxy for missing
-
-    Returns: well_data_dates - dataframe with only matching dates and data
-    between wells
-    well_data - dataframe with matching dates, some wells have missing data
+    resample_daily - if True, heads interpolated to every day; if False, heads
+    only interpolated to the observation dates of all wells, the first day of
+    tmin and the end of each year (the subsidence model interpolates heads to
+    its own time steps anyway)
+    obs_store - bkk_ingest.ObservationStore of ingested TGMS observations; used
+    instead of the well nest excel file if the well nest was ingested
+
+    Returns: heads - WellNestHeads of the interpolated heads of the wells
+    (heads.window(tmin, tmax) for the matching dates only)
     """
-    # Reading in GW data
-    # Path to GW data
-    try:
-        full_path = os.path.join(os.path.abspath("inputs"), wellnestname + ".xlsx")
-        data = pd.read_excel(full_path, skiprows=3)
+    # If observations already ingested
+    if obs_store is not None and wellnestname in obs_store:
+
+        # List of wells in well nest
+        welllist = obs_store.wells(wellnestname)
+
+        # GW Head not DTW
+        all_head_data = obs_store.frame(wellnestname)
+
+    else:
+
+        # Reading in GW data
+        # Path to GW data
+        try:
+            full_path = os.path.join(os.path.abspath("inputs"),
+                                     wellnestname + ".xlsx")
+            data = bkk_cache.read_excel(full_path, skiprows=3)
+
+        # If well nest does not exist
+        except:
+            raise ValueError("\nWell nest or file for well nest does not "
+                             "exist.")
 
-    # If well nest does not exist
-    except:
-        raise ValueError("\nWell nest or file for well nest does not exist.")
+        # List of wells in well nest
+        welllist = data.columns[-(len(data.columns) - 2):]
 
-    # List of wells in well nest
-    welllist = data.columns[-(len(data.columns) - 2):]
+        # Returns all data, and specific well data if specified.
+        # GW Head not DTW
+        all_head_data, gw_well_head = mfs.GW_Data_Process(data)
+        all_head_data.index = all_head_data.EngDate
 
     # Reorder well list to shallow to deep aquifers
     # BK, PD, NL, NB
     welllist = [x for y in ["BK", "PD", "NL", "NB"] for x in welllist
                 if y in x]
 
-    # Returns all data, and specific well data if specified.
-    # GW Head not DTW
-    all_head_data, gw_well_head = mfs.GW_Data_Process(data)
-    all_head_data.index = all_head_data.EngDate
-
     # Stores interpolated data
     interp_welldata = []
 
-    # For each well in welllist
-    for i in welllist:
+    # If interpolating to every day
+    if resample_daily:
 
-        # Gets rid of NA, then resamples daily, then does cubic interpolation
-        # Interpolating 'inside'
-        interp_welldata.append(
-            all_head_data.loc[:, i].dropna().
-            resample("D").interpolate("linear"))
+        # For each well in welllist
+        for i in welllist:
 
-    lenlist = len(welllist)
+            # Gets rid of NA, then resamples daily, then does cubic
+            # interpolation
+            # Interpolating 'inside'
+            interp_welldata.append(
+                all_head_data.loc[:, i].dropna().
+                resample("D").interpolate("linear"))
 
-    # If using available heads as proxy for missing heads
-    if proxyflag == 1:
+    # If keeping observation dates
+    else:
 
-        well_data = []
+        # Gets rid of NA, averaging observations on the same day
+        obs_welldata = [all_head_data.loc[:, i].dropna().groupby(level=0).
+                        mean() for i in welllist]
 
-        # For those missing wells, checks which well is missing
-        if lenlist < 4:
+        # Observation dates of all wells
+        index = obs_welldata[0].index
+        for temp in obs_welldata[1:]:
+            index = index.union(temp.index)
 
-            # If only three files
-            # If first file in sorted list is PD, missing BK
-            if lenlist == 3:
+        # First day of tmin and end of each year (for annual subsidence)
+        extra = pd.date_range(index[0], index[-1], freq="Y").union(
+            [pd.Timestamp(tmin)])
+        index = index.union(extra[(extra >= index[0]) &
+                                  (extra <= index[-1])])
 
-                if not any("BK" in substring for substring in welllist):
+        # Days of each date
+        days = index.values.astype("datetime64[D]").astype(float)
 
-                    print("\nPROXY\n")
-                    # Using PD as BK Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy BK")
-                    well_data.append(temp)
+        # For each well in welllist
+        for temp in obs_welldata:
 
-                    # Adding rest of the wells
-                    [well_data.append(i) for i in interp_welldata]
+            # Linear interpolation between observations, 'inside' only
+            obs_days = temp.index.values.astype("datetime64[D]").astype(float)
+            head = np.interp(days, obs_days, temp.values.astype(float))
+            head[(days < obs_days[0]) | (days > obs_days[-1])] = np.nan
 
-            # If only two files
-            # If first file in sorted list is PD and next is NB
-            # missing BK and NL
-            elif lenlist == 2:
-
-                if np.logical_and(not any("BK" in substring
-                                          for substring in welllist),
-                                  not any("NL" in substring
-                                          for substring in welllist)):
+            interp_welldata.append(pd.Series(head, index=index,
+                                             name=temp.name))
 
-                    # Using PD as BK Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy BK")
-                    well_data.append(temp)
+    # Heads of each aquifer, with proxies for missing aquifers
+    heads = proxy_heads(welllist, interp_welldata, proxyflag)
 
-                    # PD
-                    temp = interp_welldata[0]
-                    well_data.append(temp)
+    return heads
 
-                    # Using NB as NL Proxy
-                    temp = interp_welldata[1]
-                    temp = temp.rename("Proxy NL")
-                    well_data.append(temp)
 
-                    # NB
-                    temp = interp_welldata[1]
-                    well_data.append(temp)
+# %%###########################################################################
+# Benchmark leveling
+###############################################################################
 
-            # If only two files
-            # If first file in sorted list is PD, next and NL
-            # missing BK and NB
+class BenchmarkLeveling:
+    """Annual subsidence rates (cm/yr) of the benchmarks of all well nests.
 
-                elif np.logical_and(
-                        not any("BK" in substring for substring in welllist),
-                        not any("NB" in substring for substring in welllist)):
+    All *_Leveling sheets of SurveyingLevels.xlsx are read in one pass and the
+    annual rates are prepared once for each well nest: benchmarks after
+    last_year are removed, the first year is set to 0, and dates are shifted
+    one day back and the last date of each year kept so that each rate is at
+    the end of the year it was measured over (same as the model).
+    Well nests are looked up by name, and years by position in the index.
+    """
 
-                    # Using PD as BK Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy BK")
-                    well_data.append(temp)
-
-                    # PD
-                    temp = interp_welldata[0]
-                    well_data.append(temp)
-
-                    # NL
-                    temp = interp_welldata[1]
-                    well_data.append(temp)
-
-                    # Using NL as NB proxy
-                    temp = interp_welldata[1]
-                    temp = temp.rename("Proxy NB")
-                    well_data.append(temp)
-
-            # If only two files
-            # If first file in sorted list is NL, next and NB
-            # missing BK and PD
-
-                elif np.logical_and(
-                        not any("BK" in substring for substring in welllist),
-                        not any("PD" in substring for substring in welllist)):
-
-                    # Using NL as BK Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy BK")
-                    well_data.append(temp)
-
-                    # Using NL as PD Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy PD")
-                    well_data.append(temp)
-
-                    # NL
-                    temp = interp_welldata[0]
-                    well_data.append(temp)
-
-                    # Using NL as NB proxy
-                    temp = interp_welldata[1]
-                    well_data.append(temp)
-
-            # If only 1 file
-            # missing others
-            if lenlist == 1:
-
-                # If only has BK
-                if any("BK" in substring for substring in welllist):
-
-                    # BK
-                    temp = interp_welldata[0]
-                    well_data.append(temp)
-
-                    # Using BK as PD Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy PD")
-                    well_data.append(temp)
-
-                    # Using BK as NL Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy NL")
-                    well_data.append(temp)
-
-                    # Using BK as NB Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy NB")
-                    well_data.append(temp)
-
-                # If only has PD
-                elif any("PD" in substring for substring in welllist):
-
-                    # Using PD as BK Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy BK")
-                    well_data.append(temp)
-
-                    # PD
-                    temp = interp_welldata[0]
-                    well_data.append(temp)
-
-                    # Using PD as NL Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy NL")
-                    well_data.append(temp)
-
-                    # Using PD as NB Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy NB")
-                    well_data.append(temp)
-
-                # If only has NL
-                elif any("NL" in substring for substring in welllist):
-
-                    # Using NL as BK Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy BK")
-                    well_data.append(temp)
-
-                    # Using NL as PD Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy PD")
-                    well_data.append(temp)
-
-                    # Using NL
-                    temp = interp_welldata[0]
-                    well_data.append(temp)
-
-                    # Using NL as NB Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy NB")
-                    well_data.append(temp)
-
-                # If only has NB
-                elif any("NB" in substring for substring in welllist):
-
-                    # Using NB as BK Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy BK")
-                    well_data.append(temp)
-
-                    # Using NB as PD Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy PD")
-                    well_data.append(temp)
-
-                    # Using NB as NL Proxy
-                    temp = interp_welldata[0]
-                    temp = temp.rename("Proxy NL")
-                    well_data.append(temp)
-
-                    # NB
-                    temp = interp_welldata[0]
-                    well_data.append(temp)
-
-        # No missing wells
-        else:
+    def __init__(self, path=None, last_year=2020):
 
-            well_data = interp_welldata
+        # Path to benchmark leveling
+        if path is None:
+            path = os.path.join(os.path.abspath("inputs"),
+                                "SurveyingLevels.xlsx")
 
-    # If using only available heads
-    else:
+        self.path = path  # Path to SurveyingLevels.xlsx
+        self.annual = {}  # Annual benchmark rates by well nest
 
-        well_data = interp_welldata
+        # All sheets in one pass
+        sheets = bkk_cache.read_excel(path, sheet_name=None, index_col=3)
 
-        # Needs all four wells if proxyflag is not on
-        if lenlist < 4:
+        for sheet, subdata in sheets.items():
 
-            sys.exit("Needs all four wells if proxyflag is not on")
+            if not sheet.endswith("_Leveling"):
+                continue
+
+            subdata.index = pd.to_datetime(subdata.index)
+
+            # Getting rid of benchmarks outside time period
+            subdata = subdata[(subdata.Year <= last_year)]
+
+            # Benchmarks should start at 0 at the first year.
+            bench = subdata.loc[:, subdata.columns.str.contains("Land")]
+            if (bench.iloc[0] != 0).any():
+                bench.iloc[0] = 0
+
+            # IMPORTANT INFO
+            # For benchmark measurements, the first year is 0, the second year
+            # is the compaction rate over that first year.
+            # For implicit Calc, the first year has a compaction rate over that
+            # year, so to shift benchmarks value to the previouse year to match
+            # Index has the right years
+            bench.index = bench.index.shift(-1, freq="D")
+
+            # Gets the last date of each year
+            last = ~bench.index.year.duplicated(keep="last")
+            self.annual[sheet[:-len("_Leveling")]] = bench[last]
 
-    # Well data with matching dates only
-    well_data_dates = functools.reduce(lambda left, right:
-                                       pd.merge(left, right, on=["EngDate"],
-                                                how="inner"), well_data)
-    well_data_dates = well_data_dates[(well_data_dates.index.year >= int(tmin)) &
-                                      well_data_dates.index.year <= int(tmax)]
+    def __contains__(self, wellnest):
 
-    # All well data
-    all_well_data = functools.reduce(lambda left, right:
-                                     pd.merge(left, right, on=["EngDate"],
-                                              how="outer", sort=True),
-                                     well_data)
+        return wellnest in self.annual
 
-    return well_data_dates, all_well_data
+    def get(self, wellnest, tmin=None, tmax=None):
+        """Annual benchmark rates (cm/yr) of a well nest, one column per
+        benchmark (Land_*), at the end of each year. NaN where not measured.
+
+        wellnest - (str) name of well nest
+        tmin, tmax - (str or int) optional first and last year
+
+        Returns
+        bench - dataframe (a copy); empty if the well nest has no leveling
+        """
+        # If no benchmark leveling for the well nest
+        if wellnest not in self.annual:
+            return pd.DataFrame()
+
+        bench = self.annual[wellnest]
+        years = bench.index.year
+        start = 0 if tmin is None else \
+            years.searchsorted(int(tmin), side="left")
+        stop = len(bench) if tmax is None else \
+            years.searchsorted(int(tmax), side="right")
+
+        return bench.iloc[start:stop].copy()
+
+    def leveling(self, wellnest, tmin=None, tmax=None):
+        """Annual rates (cm/yr) of the benchmark of a well nest as a series.
+
+        wellnest - (str) name of well nest
+        tmin, tmax - (str or int) optional first and last year
+        """
+        bench = self.get(wellnest, tmin, tmax)
+
+        return bench[bench.columns[bench.columns.str.contains("Land")].item()]
+
+
+# Benchmark leveling already read, by path
+_benchmarks = {}
+
+
+def load_benchmarks(path=None):
+    """Benchmark leveling of all well nests, read once per session.
+
+    path - path to SurveyingLevels.xlsx, inputs folder if None
+
+    Returns
+    benchmarks - BenchmarkLeveling
+    """
+    if path is None:
+        path = os.path.join(os.path.abspath("inputs"), "SurveyingLevels.xlsx")
+
+    # Read again if the excel file changed
+    key = (os.path.abspath(path), bkk_cache.hash_file(path))
+    if key not in _benchmarks:
+        _benchmarks[key] = BenchmarkLeveling(path)
+
+    return _benchmarks[key]
+
+
+# %%###########################################################################
+# Clay and aquifer parameters
+###############################################################################
+
+# Sheets of SUBParameters.xlsx
+PARAMETERS = ["Thickness", "K", "Sskv", "Sske"]
+
+# Clay layers and aquifers from shallowest to deepest
+# VSC = very soft clay, MSC = medium stiff clay, SC = stiff clay,
+# HC = hard clay
+LAYERS = ["VSC", "BK", "MSC", "PD", "SC", "NL", "HC", "NB"]
+CLAYS = ["VSC", "MSC", "SC", "HC"]
+
+
+class SubParameters:
+    """Thickness, K, Sskv and Sske of the clays and aquifers of all well nests.
+
+    The four tables are one (parameter x nest x layer) array. Perturbed
+    parameter sets (scaled, replaced) share this array and only keep, for each
+    parameter and layer, a factor and the layer the value is taken from, so
+    sensitivity runs do not copy or read the tables again.
+    """
+
+    def __init__(self, values, nests, layers, factor=None, source=None):
+
+        self.values = values  # (parameter x nest x layer) array
+        self.nests = nests  # Well nest names (index)
+        self.layers = list(layers)  # Clay and aquifer names
+
+        # Position of each well nest and layer in the array
+        self._nest_pos = {n: i for i, n in enumerate(nests)}
+        self._layer_pos = {c: i for i, c in enumerate(self.layers)}
+
+        # Factor of each parameter and layer
+        if factor is None:
+            factor = np.ones((len(PARAMETERS), len(self.layers)))
+        self.factor = factor
+
+        # Layer each value is taken from, for each parameter and layer
+        if source is None:
+            source = np.tile(np.arange(len(self.layers)),
+                             (len(PARAMETERS), 1))
+        self.source = source
+
+    @classmethod
+    def from_frames(cls, Thick_data, K_data, Sskv_data, Sske_data):
+        """Parameter set from the four tables (well nest x layer).
+
+        Thick_data - thickness data for each well nest and layer
+        K_data - vertical hydraulic conductivity data for each well nest and
+        layer
+        Sskv_data - inelastic specific storage data for each well nest and
+        layer
+        Sske_data - elastic specific storage data for each well nest and layer
+        """
+        nests = Thick_data.index
+        layers = Thick_data.columns
+        values = np.stack([data.reindex(index=nests, columns=layers).
+                           to_numpy(dtype=float)
+                           for data in [Thick_data, K_data, Sskv_data,
+                                        Sske_data]])
+
+        return cls(values, nests, layers)
+
+    def _param(self, param):
+        """Position of a parameter (sheet name)."""
+        return PARAMETERS.index(param)
+
+    def scaled(self, param, coeff, layers=None):
+        """Parameter set with param multiplied by coeff (no copy of tables).
+
+        param - "Thickness", "K", "Sskv" or "Sske"
+        coeff - multiplier
+        layers - list of clays and aquifers to scale, all if None
+        """
+        p = self._param(param)
+        cols = range(len(self.layers)) if layers is None else \
+            [self._layer_pos[c] for c in layers]
+
+        factor = self.factor.copy()
+        factor[p, cols] *= coeff
+
+        return SubParameters(self.values, self.nests, self.layers, factor,
+                             self.source)
+
+    def replaced(self, param, layers):
+        """Parameter set with param of some layers taken from other layers.
+
+        param - "Thickness", "K", "Sskv" or "Sske"
+        layers - dict of layer: layer its value is taken from, e.g.
+        {"BK": "VSC"} for the BK aquifer with the value of the clay above
+        """
+        p = self._param(param)
+
+        factor = self.factor.copy()
+        source = self.source.copy()
+        for layer, other in layers.items():
+            factor[p, self._layer_pos[layer]] = \
+                self.factor[p, self._layer_pos[other]]
+            source[p, self._layer_pos[layer]] = \
+                self.source[p, self._layer_pos[other]]
+
+        return SubParameters(self.values, self.nests, self.layers, factor,
+                             source)
+
+    def value(self, param, wellnest, layer):
+        """Value of a parameter for a well nest and clay or aquifer.
+
+        param - "Thickness", "K", "Sskv" or "Sske"
+        wellnest - (str) name of well nest
+        layer - clay or aquifer name
+        """
+        p = self._param(param)
+        col = self._layer_pos[layer]
+
+        return self.values[p, self._nest_pos[wellnest], self.source[p, col]] \
+            * self.factor[p, col]
+
+    def frame(self, param):
+        """Dataframe (well nest x layer) of a parameter, e.g. for saving."""
+        p = self._param(param)
+
+        return pd.DataFrame(self.values[p][:, self.source[p]] * self.factor[p],
+                            index=self.nests, columns=self.layers)
+
+
+# Parameter sets already read, by path
+_parameters = {}
+
+
+def load_parameters(path=None):
+    """Clay and aquifer parameters of all well nests, read once per session.
+
+    path - path to SUBParameters.xlsx, inputs folder if None
+
+    Returns
+    params - SubParameters
+    """
+    if path is None:
+        path = os.path.join(os.path.abspath("inputs"), "SUBParameters.xlsx")
+
+    # Read again if the excel file changed
+    key = (os.path.abspath(path), bkk_cache.hash_file(path))
+    if key not in _parameters:
+        _parameters[key] = SubParameters.from_frames(
+            *[bkk_cache.read_excel(path, sheet_name=sheet, index_col=0)
+              for sheet in PARAMETERS])
+
+    return _parameters[key]
 
 
 # %%###########################################################################
@@ -805,9 +1076,10 @@ def pastas_setparam(model, pump_series=None, pump_path=None, pump_sheet=None,
                 model.del_stressmodel("well")  # Deletes previous pumping
 
                 # Adds new pumping
-                EstTotPump = pd.read_excel(pump_path,
-                                           sheet_name=pump_sheet, index_col=0,
-                                           parse_dates=["Date"])
+                EstTotPump = bkk_cache.read_excel(pump_path,
+                                                  sheet_name=pump_sheet,
+                                                  index_col=0,
+                                                  parse_dates=["Date"])
 
                 EstTotPump_ = ps.StressModel(EstTotPump.Pump,
                                              rfunc=ps.Gamma(), name="well",
@@ -838,9 +1110,10 @@ def pastas_setparam(model, pump_series=None, pump_path=None, pump_sheet=None,
                 model.del_stressmodel("well")  # Deletes previous pumping
 
                 # Adds new pumping
-                EstTotPump = pd.read_excel(pump_path,
-                                           sheet_name=pump_sheet, index_col=0,
-                                           parse_dates=["Date"])
+                EstTotPump = bkk_cache.read_excel(pump_path,
+                                                  sheet_name=pump_sheet,
+                                                  index_col=0,
+                                                  parse_dates=["Date"])
                 EstTotPump_ = ps.StressModel(EstTotPump.Pump,
                                              rfunc=ps.Gamma(), name="well",
                                              settings="well", up=False)
@@ -864,13 +1137,79 @@ def pastas_setparam(model, pump_series=None, pump_path=None, pump_sheet=None,
     return model
 
 
+def pastas_simulate(model, tmin, tmax, warmup=365*30, warmup_cache=None):
+    """Simulate daily heads of a Pastas model, reusing warmup contributions.
+
+    Same as model.simulate(tmin=tmin, tmax=tmax, warmup=warmup,
+    return_warmup=False), but the contribution of each stress during the
+    warmup is convolved once and read from warmup_cache afterwards, so that
+    other pumping scenarios only convolve the stress after tmin
+    model - Pastas model instance
+    tmin, tmax - (str) simulation window
+    warmup - warmup (days)
+    warmup_cache - bkk_cache.WarmupCache, None to use model.simulate
+
+    Returns
+    sim - series of simulated heads from tmin to tmax
+    """
+    # Only for daily models with single stress models and no transform
+    if warmup_cache is None or model.transform is not None or \
+            model.settings["freq"] != "D" or \
+            not all(isinstance(sm, ps.StressModel)
+                    for sm in model.stressmodels.values()):
+
+        return model.simulate(tmin=tmin, tmax=tmax, warmup=warmup,
+                              return_warmup=False)
+
+    # Simulation index, including warmup
+    start = pd.Timestamp(tmin) - pd.Timedelta(warmup, "D")
+    sim_index = pd.date_range(start, tmax, freq="D")
+    nwarm = sim_index.searchsorted(pd.Timestamp(tmin))
+    nsim = len(sim_index) - nwarm
+
+    p = model.get_parameters()
+    sim = np.zeros(nsim)
+
+    # Contribution of each stress model
+    istart = 0
+    for sm in model.stressmodels.values():
+
+        p_sm = p[istart:istart + sm.nparam]
+        istart += sm.nparam
+
+        # Stress filled as in Pastas
+        sm.update_stress(tmin=start, tmax=sim_index[-1], freq="D")
+        stress = sm.stress[0].series.values
+        b = sm.rfunc.block(p_sm, 1.0,
+                           maxtmax=(sim_index[-1] - start).days)
+
+        # Warmup contribution to heads after tmin, only if not cached
+        key = bkk_cache.warmup_key(stress[:nwarm], b, nsim)
+        warm = warmup_cache.load(key)
+        if warm is None:
+
+            warm = fftconvolve(stress[:nwarm], b, "full")[nwarm:nwarm + nsim]
+            warm = np.pad(warm, (0, nsim - len(warm)))
+            warmup_cache.save(key, warm)
+
+        # Adding contribution of the stress after tmin
+        sim += warm + fftconvolve(stress[nwarm:], b, "full")[:nsim]
+
+    if model.constant:
+        sim += model.constant.simulate(p[istart])
+
+    return pd.Series(sim, index=sim_index[nwarm:], name="Simulation")
+
+
 def load_Pastas(Pastasfiles, lenfiles, proxyflag, models, well_names,
                 model_path, pumpflag, tmin, tmax, pump_series=None,
-                pump_path=None, pump_sheet=None, initoptiparam=None):
+                pump_path=None, pump_sheet=None, initoptiparam=None,
+                head_cache=None, head_archive=None, warmup_cache=None):
     """Loads Pastas models
 
     Pastasfiles - list of Pastas file names
-    models - lsit of Pastas model instances
+    models - lsit of Pastas model instances; an entry can be None if the model
+    has not been loaded yet (loaded only if its heads are not in head_cache)
     well_names - list of well names (str)
     lenfiles - how many files there are
     proxyflag - 1 if using available heads as proxy for missing heads
@@ -880,515 +1219,129 @@ def load_Pastas(Pastasfiles, lenfiles, proxyflag, models, well_names,
     pumpflag - 1 if changing pumping scenario for Pastas
     tmin, tmax - (str) minimum and maximum year to calculate sub
     initoptiparam - optimal parameters provided
+    head_cache - bkk_cache.HeadCache of simulated heads, None if not caching
+    head_archive - bkk_archive.HeadArchive of daily heads for pumping sheets;
+    used instead of simulating if it has the model and pump_sheet
+    warmup_cache - bkk_cache.WarmupCache of warmup contributions, None if
+    simulating with model.simulate
 
     Returns
-    well_data_dates - Well data with matching dates only
-    all_well4_data - all well data no matter the date
+    heads - WellNestHeads of all simulated heads no matter the date
+    (heads.window(tmin, tmax) for the matching dates only)
     """
-    # well_data - where to save the data after loading Pasta files
-    well_data = []
-
-    # If using avaialbe heads as proxy for missing heads
-    if proxyflag == 1:
-
-        # For those missing wells, checks which well is missing
-        if lenfiles < 4:
-
-            # If only three files
-            # If first file in sorted list is PD, missing BK
-            if lenfiles == 3:
-
-                # For each well model
-                for num_model in range(len(well_names)):
-
-                    # Loads model, PD as proxy for BK
-                    model = models[num_model]
-
-                    curr_well = well_names[num_model]
-
-                    # If changing pumping scenario
-                    if pumpflag == 1:
-
-                        # If providing optimal parameters from ESMDA
-                        if initoptiparam is None:
-
-                            # If pumping time series given
-                            if pump_series is not None:
-                                model = pastas_setparam(model,
-                                                        well_name=curr_well,
-                                                        pump_series=pump_series[
-                                                            curr_well])
-
-                            # If path and sheet given instead
-                            elif pump_path is not None:
-                                # Updating model with new pumping scenario
-                                model = pastas_setparam(model, pump_path=pump_path,
-                                                        pump_sheet=pump_sheet)
-
-                        else:
-
-                            # If pumping time series given
-                            if pump_path is None:
-                                if pump_series is not None:
-                                    model = pastas_setparam(model,
-                                                            initoptiparam=initoptiparam.
-                                                            loc[
-                                                                curr_well],
-                                                            pump_series=pump_series[
-                                                                curr_well],
-                                                            well_name=curr_well,)
-
-                                else:
-                                    model = pastas_setparam(model,
-                                                            initoptiparam=initoptiparam.
-                                                            loc[
-                                                                curr_well],
-                                                            well_name=curr_well,)
-
-                            # If path and sheet given instead
-                            else:
-
-                                # Updating model with new pumping scenario
-                                model = pastas_setparam(model,
-                                                        initoptiparam=initoptiparam.
-                                                        loc[
-                                                            curr_well],
-                                                        well_name=curr_well,
-                                                        pump_path=pump_path,
-                                                        pump_sheet=pump_sheet)
-
-                    # If list starts with PD, means BK is missing
-                    if "_PD" in Pastasfiles[0]:
-
-                        # Identifies missing well and index
-                        missing = "BK"
-
-                        temp = model.simulate(tmin="1950", tmax=tmax,
-                                              warmup=365*30, return_warmup=False)
-                        temp = temp.rename("Proxy BK")  # Renames column
-                        well_data.append(temp)  # Saves data
-
-                        # Loads model, PD
-                        temp = temp.rename(curr_well)  # Renames column
-                        well_data.append(temp)  # Saves data
-
-                    # Adds NL and NB simulations
-                    else:
+    # Simulated heads for each well model
+    # Each model is simulated once (or read from the cache)
+    sim_heads = []
 
-                        temp = model.simulate(tmin="1950", tmax=tmax,
-                                              warmup=365*30, return_warmup=False)
-                        temp = temp.rename(curr_well)  # Renames col
-                        well_data.append(temp)  # Saves data
-
-            # If only two files
-            # If first file in sorted list is PD and next is NB
-            # missing BK and NL
-            if lenfiles == 2:
-
-                # For each well model
-                for num_model in range(len(well_names)):
-
-                    # Loads model, PD as proxy for BK
-                    model = models[num_model]
-
-                    curr_well = well_names[num_model]
-
-                    # If changing pumping scenario
-                    if pumpflag == 1:
-
-                        # If providing optimal parameters from ESMDA
-                        if initoptiparam is None:
-
-                            # If pumping time series given
-                            if pump_series is not None:
-                                model = pastas_setparam(model,
-                                                        well_name=curr_well,
-                                                        pump_series=pump_series[
-                                                            curr_well])
-
-                            # If path and sheet given instead
-                            elif pump_path is not None:
-                                # Updating model with new pumping scenario
-                                model = pastas_setparam(model, pump_path=pump_path,
-                                                        pump_sheet=pump_sheet)
-
-                        else:
-
-                            # If pumping time series given
-                            if pump_path is None:
-                                if pump_series is not None:
-                                    model = pastas_setparam(model,
-                                                            initoptiparam=initoptiparam.
-                                                            loc[
-                                                                curr_well],
-                                                            pump_series=pump_series[
-                                                                curr_well],
-                                                            well_name=curr_well,)
-
-                                else:
-                                    model = pastas_setparam(model,
-                                                            initoptiparam=initoptiparam.
-                                                            loc[
-                                                                curr_well],
-                                                            well_name=curr_well,)
-
-                            # If path and sheet given instead
-                            else:
-
-                                # Updating model with new pumping scenario
-                                model = pastas_setparam(model,
-                                                        initoptiparam=initoptiparam.
-                                                        loc[
-                                                            curr_well],
-                                                        well_name=curr_well,
-                                                        pump_path=pump_path,
-                                                        pump_sheet=pump_sheet)
-
-                    # If only PD and NB models
-                    if np.logical_and("_PD" in Pastasfiles[0],
-                                      "_NB" in Pastasfiles[1]):
-
-                        # Identifies missing well and index
-                        missing = "NL"
-
-                        # If PD
-                        if num_model == 0:
-
-                            proxy_name = "Proxy BK"
-
-                        # If NB
-                        else:
-
-                            proxy_name = "Proxy NL"
+    # For each well model
+    for num_model in range(len(well_names)):
 
-                        temp = model.simulate(tmin="1950", tmax=tmax,
-                                              warmup=365*30, return_warmup=False)
-                        temp = temp.rename(proxy_name)
-                        well_data.append(temp)
-
-                        # Loads model, PD
-                        temp = temp.rename(curr_well)
-                        well_data.append(temp)
-
-                    # If only two files
-                    # If first file in sorted list is PD, next and NL
-                    # missing BK and NB
-                    if np.logical_and("_PD" in Pastasfiles[0],
-                                      "_NL" in Pastasfiles[1]):
-
-                        # Identifies missing well and index
-                        missing = "NB"
-
-                        # If PD
-                        if num_model == 0:
-
-                            proxy_name = "Proxy BK"
-                            temp = model.simulate(tmin="1950", tmax=tmax,
-                                                  warmup=365*30,
-                                                  return_warmup=False)
-                            temp = temp.rename(proxy_name)
-                            well_data.append(temp)
-
-                            # Loads model, PD
-                            temp = temp.rename(curr_well)
-                            well_data.append(temp)
-
-                        # If NB
-                        else:
-
-                            proxy_name = "Proxy NB"
-                            temp = model.simulate(tmin="1950", tmax=tmax,
-                                                  warmup=365*30,
-                                                  return_warmup=False)
-                            temp = temp.rename(curr_well)
-                            well_data.append(temp)
-
-                            # Loads model, NL as proxy for NB
-                            temp = temp.rename(proxy_name)
-                            well_data.append(temp)
-
-                # If only two files
-                # If first file in sorted list is NL, next and NB
-                # missing BK and PD
-
-                    if np.logical_and("_NL" in Pastasfiles[0],
-                                      "_NB" in Pastasfiles[1]):
-
-                        # Identifies missing well and index
-                        missing = "PD"
-
-                        # If NL
-                        if num_model == 0:
-
-                            temp = model.simulate(tmin="1950", tmax=tmax,
-                                                  warmup=365*30,
-                                                  return_warmup=False)
-                            temp = temp.rename("Proxy BK")
-                            well_data.append(temp)
-
-                            # Loads model, NL as proxy for PD, BK
-                            temp = temp.rename("Proxy PD")
-                            well_data.append(temp)
-
-                            # Loads model, NL
-                            temp = temp.rename(curr_well)
-                            well_data.append(temp)
-
-                        # NB
-                        else:
-
-                            temp = model.simulate(tmin="1950", tmax=tmax,
-                                                  warmup=365*30,
-                                                  return_warmup=False)
-                            temp = temp.rename(curr_well)
-                            well_data.append(temp)
-
-            # If only 1 file
-            # missing others
-            if lenfiles == 1:
-
-                missing = "others"
-
-                # For each well model
-                for num_model in range(len(well_names)):
-
-                    # Loads model, PD as proxy for BK
-                    model = models[num_model]
-
-                    curr_well = well_names[num_model]
-
-                    # If changing pumping scenario
-                    if pumpflag == 1:
-
-                        # If providing optimal parameters from ESMDA
-                        if initoptiparam is None:
-
-                            # If pumping time series given
-                            if pump_series is not None:
-                                model = pastas_setparam(model,
-                                                        well_name=curr_well,
-                                                        pump_series=pump_series[
-                                                            curr_well])
-
-                            # If path and sheet given instead
-                            elif pump_path is not None:
-                                # Updating model with new pumping scenario
-                                model = pastas_setparam(model, pump_path=pump_path,
-                                                        pump_sheet=pump_sheet)
-
-                        else:
-
-                            # If pumping time series given
-                            if pump_path is None:
-                                if pump_series is not None:
-                                    model = pastas_setparam(model,
-                                                            initoptiparam=initoptiparam.
-                                                            loc[
-                                                                curr_well],
-                                                            pump_series=pump_series[
-                                                                curr_well],
-                                                            well_name=curr_well,)
-
-                                else:
-                                    model = pastas_setparam(model,
-                                                            initoptiparam=initoptiparam.
-                                                            loc[
-                                                                curr_well],
-                                                            well_name=curr_well,)
-
-                            # If path and sheet given instead
-                            else:
-
-                                # Updating model with new pumping scenario
-                                model = pastas_setparam(model,
-                                                        initoptiparam=initoptiparam.
-                                                        loc[
-                                                            curr_well],
-                                                        well_name=curr_well,
-                                                        pump_path=pump_path,
-                                                        pump_sheet=pump_sheet)
-
-                    if "BK" in curr_well:
-                        temp = model.simulate(tmin="1950", tmax=tmax,
-                                              warmup=365*30,
-                                              return_warmup=False)
-                        temp = temp.rename(curr_well)
-                        well_data.append(temp)
-
-                        # Others proxy
-                        temp = temp.rename("Proxy PD")
-                        well_data.append(temp)
-
-                        # Others proxy
-                        temp = temp.rename("Proxy NL")
-                        well_data.append(temp)
-
-                        # Others proxy
-                        temp = temp.rename("Proxy NB")
-                        well_data.append(temp)
-
-                    elif "PD" in curr_well:
-
-                        temp = model.simulate(tmin="1950", tmax=tmax,
-                                              warmup=365*30,
-                                              return_warmup=False)
-                        temp = temp.rename("Proxy BK")
-                        well_data.append(temp)
-
-                        # Only head value as proxy for others that are
-                        # missing
-                        temp = temp.rename(curr_well)
-                        well_data.append(temp)
-
-                        # Proxy
-                        temp = temp.rename("Proxy NL")
-                        well_data.append(temp)
-
-                        # Proxy
-                        temp = temp.rename("Proxy NB")
-                        well_data.append(temp)
-
-                    elif "NL" in curr_well:
-
-                        temp = model.simulate(tmin="1950", tmax=tmax,
-                                              warmup=365*30,
-                                              return_warmup=False)
-                        temp = temp.rename("Proxy BK")
-                        well_data.append(temp)
-
-                        # Proxy
-                        temp = temp.rename("Proxy PD")
-                        well_data.append(temp)
-
-                        # Only head value as proxy for others that are
-                        # missing
-                        temp = temp.rename(curr_well)
-                        well_data.append(temp)
-
-                        # Proxy
-                        temp = temp.rename("Proxy NB")
-                        well_data.append(temp)
-
-                    elif "NB" in curr_well:
-
-                        temp = model.simulate(tmin="1950", tmax=tmax,
-                                              warmup=365*30,
-                                              return_warmup=False)
-                        temp = temp.rename("Proxy BK")
-                        well_data.append(temp)
-
-                        # Proxy
-                        temp = temp.rename("Proxy PD")
-                        well_data.append(temp)
-
-                        # Proxy
-                        temp = temp.rename("Proxy NL")
-                        well_data.append(temp)
-
-                        # Only head value as proxy for others that are
-                        # missing
-                        temp = temp.rename(curr_well)
-                        well_data.append(temp)
-
-        # No missing wells
-        else:
+        curr_well = well_names[num_model]
 
-            missing = None
+        # If heads already in the archive of daily heads
+        if head_archive is not None:
 
-    # If using only available heads
-    else:
-        missing = None
+            # Archive well and scenario names
+            arch_well = Pastasfiles[num_model].replace("_model.pas", "")
+            scenario = pump_sheet if pumpflag == 1 else "model"
 
-        # Needs all four wells if proxyflag is not on
-        if lenfiles < 4:
+            # Only for pumping sheets and optimal parameters of the models
+            if pump_series is None and initoptiparam is None and \
+                    (scenario, arch_well) in head_archive and \
+                    head_archive.covers("1950", tmax):
 
-            sys.exit("Needs all four wells if proxyflag is not on")
+                temp = head_archive.get(scenario, arch_well,
+                                        tmin="1950", tmax=tmax)
+                sim_heads.append(temp.astype(float))
+                continue
 
-    # If there is no missing data
-    if isinstance(missing, type(None)):
+        # If caching heads
+        if head_cache is not None:
 
-        # For each well model
-        for num_model in range(len(well_names)):
+            key = bkk_cache.head_key(os.path.join(model_path,
+                                                  Pastasfiles[num_model]),
+                                     "1950", tmax, 365*30, pumpflag,
+                                     curr_well, pump_series=pump_series,
+                                     pump_path=pump_path,
+                                     pump_sheet=pump_sheet,
+                                     initoptiparam=initoptiparam)
+            temp = head_cache.load(key)
 
-            # Loads model, PD as proxy for BK
-            model = models[num_model]
+            # Cached, no need for Pastas
+            if temp is not None:
+                sim_heads.append(temp)
+                continue
 
-            curr_well = well_names[num_model]
+        # Loads model
+        model = models[num_model]
+
+        # If model not loaded yet
+        if model is None:
+            model = ps.io.load(model_path + "/" + Pastasfiles[num_model])
+
+        # If changing pumping scenario
+        if pumpflag == 1:
+
+            # If providing optimal parameters from ESMDA
+            if initoptiparam is None:
 
-            # If changing pumping scenario
-            if pumpflag == 1:
+                # If pumping time series given
+                if pump_series is not None:
+                    model = pastas_setparam(model,
+                                            well_name=curr_well,
+                                            pump_series=pump_series[
+                                                curr_well])
 
-                # If providing optimal parameters from ESMDA
-                if initoptiparam is None:
+                # If path and sheet given instead
+                elif pump_path is not None:
+                    # Updating model with new pumping scenario
+                    model = pastas_setparam(model, pump_path=pump_path,
+                                            pump_sheet=pump_sheet)
 
-                    # If pumping time series given
+            else:
+
+                # If pumping time series given
+                if pump_path is None:
                     if pump_series is not None:
                         model = pastas_setparam(model,
-                                                well_name=curr_well,
+                                                initoptiparam=initoptiparam.
+                                                loc[
+                                                    curr_well],
                                                 pump_series=pump_series[
-                                                    curr_well])
+                                                    curr_well],
+                                                well_name=curr_well,)
 
-                    # If path and sheet given instead
-                    elif pump_path is not None:
-                        # Updating model with new pumping scenario
-                        model = pastas_setparam(model, pump_path=pump_path,
-                                                pump_sheet=pump_sheet)
+                    else:
+                        model = pastas_setparam(model,
+                                                initoptiparam=initoptiparam.
+                                                loc[
+                                                    curr_well],
+                                                well_name=curr_well,)
 
+                # If path and sheet given instead
                 else:
 
-                    # If pumping time series given
-                    if pump_path is None:
-                        if pump_series is not None:
-                            model = pastas_setparam(model,
-                                                    initoptiparam=initoptiparam.
-                                                    loc[
-                                                        curr_well],
-                                                    pump_series=pump_series[
-                                                        curr_well],
-                                                    well_name=curr_well,)
-
-                        else:
-                            model = pastas_setparam(model,
-                                                    initoptiparam=initoptiparam.
-                                                    loc[
-                                                        curr_well],
-                                                    well_name=curr_well,)
-
-                    # If path and sheet given instead
-                    else:
+                    # Updating model with new pumping scenario
+                    model = pastas_setparam(model,
+                                            initoptiparam=initoptiparam.loc[
+                                                curr_well],
+                                            well_name=curr_well,
+                                            pump_path=pump_path,
+                                            pump_sheet=pump_sheet)
 
-                        # Updating model with new pumping scenario
-                        model = pastas_setparam(model,
-                                                initoptiparam=initoptiparam.loc[
-                                                    curr_well],
-                                                well_name=curr_well,
-                                                pump_path=pump_path,
-                                                pump_sheet=pump_sheet)
-
-            temp = model.simulate(tmin="1950", tmax=tmax,
-                                  warmup=365*30, return_warmup=False)
-            temp = temp.rename(curr_well)
-            well_data.append(temp)
-
-    # Well data with matching dates only
-    well_data_dates = functools.reduce(lambda left, right:
-                                       pd.merge(left, right,
-                                                left_index=True,
-                                                right_index=True),
-                                       well_data)
-    well_data_dates = well_data_dates[
-        (well_data_dates.index.year >= int(tmin)) &
-        (well_data_dates.index.year <= int(tmax))]
-
-    # All well data
-    all_well4_data = functools.reduce(lambda left, right:
-                                      pd.concat([left, right], axis=1,
-                                                sort=True),
-                                      well_data)
-
-    # well_data_dates - Well data with matching dates only
-    # all_well4_data - all well data no matter the date
-    return well_data_dates, all_well4_data
+        temp = pastas_simulate(model, tmin="1950", tmax=tmax,
+                               warmup=365*30, warmup_cache=warmup_cache)
+        sim_heads.append(temp)
+
+        # Saving heads for the next run
+        if head_cache is not None:
+            head_cache.save(key, temp)
+
+    # Heads of each aquifer, with proxies for missing aquifers
+    heads = proxy_heads(well_names, sim_heads, proxyflag)
+
+    # heads - all well data no matter the date
+    return heads
 
 
 # %%###########################################################################
@@ -1398,24 +1351,17 @@ def load_Pastas(Pastasfiles, lenfiles, proxyflag, models, well_names,
 # Assuming has data for all four aquifers
 # Assuming conceptual model of clay above BK, between BK and PD, PD and NL, NL
 # and NB for a total of 4 clay layers.
-def set_ic(headb, headt, i, mode, fullheadt, fullheadb,
-           tmin, tmax, SS_data, wellnest, aq_namet, aq_nameb,
+def set_ic(heads, i, mode, tmin, tmax, SS_data, wellnest, aq_namet, aq_nameb,
            Kv_cl, Sskv_cl, Sske_cl, Sske_aqt, Sske_aqb, CC, Nz,
-           Thick_cl, nclay, Thick_aqt, Thick_aqb, Nt,
-           all_well_data=None):
+           Thick_cl, nclay, Thick_aqt, Thick_aqb, Nt):
     """Runs groundwater models for aquifers to set initial conditions for clay
     layers
 
-    headb - head of bottom aquifer
-    headt - head of top aquifer
+    heads - WellNestHeads of all groundwater data of the aquifers despite the
+    date (observed if raw, Pastas simulated if Pastas)
     i - current clay layer (1 - 4) where 1 is the top clay layer
     mode - raw groundwater data or time series from pastas (raw needs to
     to be interpolated). options: raw, pastas
-    all_well_data - raw observed groundwater data not within tmin and tmax
-    fullheadt - all Pastas simulated groundwater data from top aquifer despite the
-    date
-    fullheadb - all Pastas simulated groundwater data from bottom aquifer despite
-    the date
     tmin, tmax - (str) minimum and maximum year to calculate sub
     SS_data - steady state heads relative to land surface from coastal dem 2.1. SS
     heads taken from MODFLOW model. Only used with no data from 1950 onwards but
@@ -1441,6 +1387,14 @@ def set_ic(headb, headt, i, mode, fullheadt, fullheadb,
     t_ic - time for spin up run
     h_ic - head for spin up run for clay model layers
     """
+    # Head of bottom aquifer, all dates and dates within tmin and tmax
+    fullheadb = heads.layer(i-1)
+    headb = heads.window(tmin, tmax).layer(i-1)
+
+    # Head of top aquifer if not the top clay layer
+    if i != 1:
+        fullheadt = heads.layer(i-2)
+        headt = heads.window(tmin, tmax).layer(i-2)
 
     # Create daily time series
     df = pd.DataFrame(index=pd.date_range("1950-01-01",
@@ -1462,26 +1416,19 @@ def set_ic(headb, headt, i, mode, fullheadt, fullheadb,
         # in linear interpolation of head
         # Top
         if mode == "raw":
-            subsetdate_t = all_well_data.index[np.logical_and(
-                ~all_well_data.iloc[:, i-2].isna(),
-                all_well_data.index < headt.index[0])]
-            interpdata = all_well_data.loc[
-                subsetdate_t].iloc[:, i-2]
+            subsetdate_t = fullheadt.index[np.logical_and(
+                ~fullheadt.isna(),
+                fullheadt.index < headt.index[0])]
         elif mode == "Pastas":
             subsetdate_t = fullheadt.index[np.logical_and(
                 ~fullheadt.isna(),
                 fullheadt.index.year < int(tmin))]
-            interpdata = fullheadt.loc[subsetdate_t]
 
         # Getting subset of index of those dates that are before
         # tmin to be used in linear interpolation of head
-        subsetindex_t = []
-
-        for j in range(len(subsetdate_t)):
-            subsetindex_t = np.append(subsetindex_t,
-                                      np.flatnonzero(
-                                          df.index ==
-                                          subsetdate_t[j]))
+        subsetindex_t = df.index.get_indexer(subsetdate_t)
+        interpdata = fullheadt.loc[subsetdate_t[subsetindex_t >= 0]]
+        subsetindex_t = subsetindex_t[subsetindex_t >= 0]
 
         # If no earlier GW obs before model start
         if len(subsetindex_t) == 0:
@@ -1494,9 +1441,6 @@ def set_ic(headb, headt, i, mode, fullheadt, fullheadb,
         # llnear interpolation with SS heads
         else:
 
-            # Converting to int
-            subsetindex_t = subsetindex_t.astype(int)
-
             # Values and will interpolate between; time for
             # interpolation
             timet2_ic = np.insert(subsetindex_t, 0, 0)
@@ -1512,26 +1456,19 @@ def set_ic(headb, headt, i, mode, fullheadt, fullheadb,
 
         # Bottom
         if mode == "raw":
-            subsetdate_b = all_well_data.index[np.logical_and(
-                ~all_well_data.iloc[:, i-1].isna(),
-                all_well_data.index < headb.index[0])]
-            interpdata = all_well_data.loc[
-                subsetdate_b].iloc[:, i-1]
+            subsetdate_b = fullheadb.index[np.logical_and(
+                ~fullheadb.isna(),
+                fullheadb.index < headb.index[0])]
         elif mode == "Pastas":
             subsetdate_b = fullheadb.index[np.logical_and(
                 ~fullheadb.isna(),
                 fullheadb.index.year < int(tmin))]
-            interpdata = fullheadb.loc[subsetdate_b]
 
         # Getting subset of index of those dates that are before
         # tmin to be used in linear interpolation of head
-        subsetindex_b = []
-
-        for j in range(len(subsetdate_b)):
-            subsetindex_b = np.append(subsetindex_b,
-                                      np.flatnonzero(
-                                          df.index ==
-                                          subsetdate_b[j]))
+        subsetindex_b = df.index.get_indexer(subsetdate_b)
+        interpdata = fullheadb.loc[subsetdate_b[subsetindex_b >= 0]]
+        subsetindex_b = subsetindex_b[subsetindex_b >= 0]
 
         # If no earlier GW obs before model start
         if len(subsetindex_b) == 0:
@@ -1543,9 +1480,6 @@ def set_ic(headb, headt, i, mode, fullheadt, fullheadb,
         # llnear interpolation with SS heads
         else:
 
-            # Converting to int
-            subsetindex_b = subsetindex_b.astype(int)
-
             # Values and will interpolate between; time for
             # interpolation
             timeb2_ic = np.insert(subsetindex_b, 0, 0)
@@ -1587,25 +1521,19 @@ def set_ic(headb, headt, i, mode, fullheadt, fullheadb,
         # in linear interpolation of head
         # Bottom
         if mode == "raw":
-            subsetdate_b = all_well_data.index[np.logical_and(
-                ~all_well_data.iloc[:, i-1].isna(),
-                all_well_data.index < headb.index[0])]
-            interpdata = all_well_data.loc[subsetdate_b].iloc[:, i]
+            subsetdate_b = fullheadb.index[np.logical_and(
+                ~fullheadb.isna(),
+                fullheadb.index < headb.index[0])]
         elif mode == "Pastas":
             subsetdate_b = fullheadb.index[np.logical_and(
                 ~fullheadb.isna(),
                 fullheadb.index.year < int(tmin))]
-            interpdata = fullheadb.loc[subsetdate_b]
 
         # Getting subset of index of those dates that are before
         # tmin to be used in linear interpolation of head
-        subsetindex_b = []
-
-        for j in range(len(subsetdate_b)):
-            subsetindex_b = np.append(subsetindex_b,
-                                      np.flatnonzero(
-                                          df.index ==
-                                          subsetdate_b[j]))
+        subsetindex_b = df.index.get_indexer(subsetdate_b)
+        interpdata = fullheadb.loc[subsetdate_b[subsetindex_b >= 0]]
+        subsetindex_b = subsetindex_b[subsetindex_b >= 0]
 
         # If no earlier GW obs before model start
         if len(subsetindex_b) == 0:
@@ -1617,9 +1545,6 @@ def set_ic(headb, headt, i, mode, fullheadt, fullheadb,
         # llnear interpolation with SS heads
         else:
 
-            # Converting to int
-            subsetindex_b = subsetindex_b.astype(int)
-
             # Values and will interpolate between; time for
             # interpolation
             timeb2_ic = np.insert(subsetindex_b, 0, 0)
@@ -1667,6 +1592,108 @@ def set_ic(headb, headt, i, mode, fullheadt, fullheadb,
     return t_ic, h_ic
 
 
+# %%###########################################################################
+# Contribution of each clay layer, collected while solving
+##############################################################################
+
+class LayerStats:
+    """Contribution of each clay layer to the subsidence of its well nest.
+
+    Filled by run_sub as each well nest is solved, from the cumulative
+    subsidence of its clay layers at the model time steps, so the daily
+    results do not have to be read again. The share of a layer is its
+    cumulative subsidence over the total of the well nest; avg_share is the
+    mean share over the model time steps (avg_sub_perc of bkk_postproc is the
+    mean over the daily dates, within ~0.1%).
+    """
+
+    def __init__(self):
+
+        self.rows = []  # One dictionary per well nest and layer
+
+    def add_nest(self, wellnest, start, sub_rows, subv_rows):
+        """Adds the clay layers of one well nest.
+
+        wellnest - well nest name
+        start - date of model time 0
+        sub_rows - sub_total rows of the well nest: wellnest, well, model time
+        (days), cum sub (m)
+        subv_rows - subv_total rows of the well nest (inelastic)
+        """
+        # (layer, model time) arrays; all layers of a well nest have the same
+        # model times
+        t = np.array([row[2] for row in sub_rows], dtype=float)
+        sub = np.array([row[3] for row in sub_rows], dtype=float)
+        subv = np.array([row[3] for row in subv_rows], dtype=float)
+        total = sub.sum(axis=0)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+
+            # Share of the total at each model time after the first
+            share = sub[:, 1:] / total[1:]
+            avg_share = share.mean(axis=1)
+
+            # Fraction of the cumulative subsidence that is inelastic (above 1
+            # if the elastic part is a rebound)
+            inelastic_frac = subv[:, -1] / sub[:, -1]
+
+        # Subsidence rate (m/yr) over each model time step; the peak is the
+        # most negative (fastest subsidence), dated at the end of the step
+        # (nearest day)
+        rate = np.diff(sub, axis=1) / np.diff(t, axis=1) * 365.25
+        peak = np.argmin(rate, axis=1)
+        layers = np.arange(len(sub))
+
+        for layer, clay, well, cum_sub, cum_subv, share_, avg_share_, \
+                frac, peak_rate, peak_t in zip(
+                    layers, CLAYS, [row[1] for row in sub_rows], sub[:, -1],
+                    subv[:, -1], share[:, -1], avg_share, inelastic_frac,
+                    rate[layers, peak], t[layers, peak + 1]):
+
+            self.rows.append({"wellnest": wellnest, "layer": layer,
+                              "clay": clay, "well": well,
+                              "cum_sub": cum_sub, "cum_subv": cum_subv,
+                              "share": share_, "avg_share": avg_share_,
+                              "inelastic_frac": frac,
+                              "peak_rate": peak_rate,
+                              "peak_date": (pd.Timestamp(start) +
+                                            pd.Timedelta(days=peak_t)
+                                            ).round("D")})
+
+    def add_run(self, all_results, sub_total, subv_total):
+        """Adds all well nests of a run (e.g. loaded from a RunCache).
+
+        all_results, sub_total, subv_total - from bkk_subsidence
+        """
+        start = 0
+        while start < len(sub_total):
+
+            # Consecutive rows of the same well nest (at most one per clay,
+            # a well nest can be listed twice)
+            stop = start + 1
+            while stop < len(sub_total) and stop - start < len(CLAYS) and \
+                    sub_total[stop][0] == sub_total[start][0]:
+                stop += 1
+
+            self.add_nest(sub_total[start][0], all_results[start][3][0],
+                          sub_total[start:stop], subv_total[start:stop])
+            start = stop
+
+    def table(self):
+        """Dataframe indexed by (wellnest, layer), layer 0 the shallowest
+        (VSC), with clay, well, cum_sub and cum_subv (m, at the last model
+        time), share and avg_share (fraction of the well nest total),
+        inelastic_frac, peak_rate (m/yr, negative for subsidence) and
+        peak_date.
+        """
+        columns = ["wellnest", "layer", "clay", "well", "cum_sub", "cum_subv",
+                   "share", "avg_share", "inelastic_frac", "peak_rate",
+                   "peak_date"]
+
+        return pd.DataFrame(self.rows, columns=columns).set_index(
+            ["wellnest", "layer"])
+
+
 # %%###########################################################################
 # Runs the bulk of code of the subsidence model for the four clay layers
 ##############################################################################
@@ -1674,23 +1701,18 @@ def set_ic(headb, headt, i, mode, fullheadt, fullheadb,
 # Assuming has data for all four aquifers
 # Assuming conceptual model of clay above BK, between BK and PD, PD and NL, NL
 # and NB for a total of 4 clay layers.
-def run_sub(num_clay, all_well4_data, well_data_dates, mode,
-            tmin, tmax, SS_data, wellnest, K_data, Sskv_data, Sske_data, CC, Nz,
-            Thick_data, ic_run, sub_total, subv_total, all_results,
-            well_data=None):
+def run_sub(num_clay, heads, mode,
+            tmin, tmax, SS_data, wellnest, params, CC, Nz,
+            ic_run, sub_total, subv_total, all_results, layer_stats=None):
     """Runs code for bulk of subsidence modeling
 
     num_clay - number of clay layers
-    Thick_data - thickness data for each well nest and layer
-    all_well4_data - all well data no matter the date
-    well_data_dates - well data with only overlapping dates
+    heads - WellNestHeads of all well data no matter the date
     mode - raw groundwater data or time series from pastas (raw needs to
     to be interpolated). options: raw, pastas
-    all_well_data - raw observed groundwater data not within tmin and tmax
     tmin, tmax - (str) minimum and maximum year to calculate sub
-    K_data - vertical hydraulic conductivity data for each well nest and layer
-    Sske_data - elastic specific storage data for each well nest and layer
-    Sskv_data - inelastic specific storage data for each well nest and layer
+    params - SubParameters of thickness, K, Sskv and Sske for each well nest
+    and layer
     SS_data - steady state heads relative to land surface from coastal dem 2.1. SS
     heads taken from MODFLOW model. Only used with no data from 1950 onwards but
     Pastas was used to simulate from 1950 onwards. Shouldn't be used but is an
@@ -1700,6 +1722,8 @@ def run_sub(num_clay, all_well4_data, well_data_dates, mode,
     sub_total - list of lists (stores results for total subsidence)
     subv_total - list of lists (stores results for inelastic sub)
     all_results - list of lists (stores all results)
+    layer_stats - LayerStats; contribution of each clay layer of the well nest
+    is added once all layers are solved
 
     Returns
     sub_total - list of lists (stores results for total subsidence)
@@ -1707,6 +1731,9 @@ def run_sub(num_clay, all_well4_data, well_data_dates, mode,
     all_results - list of lists (stores all results)
     """
 
+    # Well data with only overlapping dates within tmin and tmax
+    heads_dates = heads.window(tmin, tmax)
+
     # Keeps track of current z (bottom of layer)
     curr_z = 0
 
@@ -1745,29 +1772,17 @@ def run_sub(num_clay, all_well4_data, well_data_dates, mode,
 
         # Thickness data, thickness for the clay layer, and  top and
         # bottom aquifer
-        Thick_cl = Thick_data.loc[wellnest, clay_name]
-        Thick_aqb = Thick_data.loc[wellnest, aq_nameb]
-        Thick_aqt = Thick_data.loc[wellnest, aq_namet]
+        Thick_cl = params.value("Thickness", wellnest, clay_name)
+        Thick_aqb = params.value("Thickness", wellnest, aq_nameb)
+        Thick_aqt = params.value("Thickness", wellnest, aq_namet)
 
         # Time for both aquifers is the same
         # If clay layer above BK, no aquifer above it
         if i == 1:
 
-            if mode == "Pastas":
-
-                # BK head
-                # Only bottom aquifer
-                fullheadt = None
-                fullheadb = all_well4_data.iloc[:, i-1]
-                headb = well_data_dates.iloc[:, i-1]
-
-            elif mode == "raw":
-
-                # BK head
-                # No top aquifer, only bottom aquifer
-                headb = well_data.iloc[:, i-1]
-
-            # No top aquifer
+            # BK head
+            # No top aquifer, only bottom aquifer
+            headb = heads_dates.layer(i-1)
             headt = None
 
             # Thickness/Specific storage of top aquifer is 0 because
@@ -1784,23 +1799,13 @@ def run_sub(num_clay, all_well4_data, well_data_dates, mode,
         # If not first aquifer
         if i != 1:
 
-            if mode == "Pastas":
-
-                fullheadb = all_well4_data.iloc[:, i-1]
-                headb = well_data_dates.iloc[:, i-1]
-
-                fullheadt = all_well4_data.iloc[:, i-2]
-                headt = well_data_dates.iloc[:, i-2]
+            headb = heads_dates.layer(i-1)
+            headt = heads_dates.layer(i-2)
 
-            elif mode == "raw":
+            Sske_aqt = params.value("Sske", wellnest, aq_namet)
 
-                headb = well_data.iloc[:, i-1]
-                headt = well_data.iloc[:, i-2]
-
-            Sske_aqt = Sske_data.loc[wellnest, aq_namet]
-
-        # Creating time time series [0: len of time series]
-        timet = np.arange(len(headb.index))
+        # Creating time time series (days since the first date)
+        timet = (headb.index - headb.index[0]).days.values
 
         # Thickness of top aquifer needs to be halved
         # For all clay layers (top will be zero even if halved)
@@ -1808,14 +1813,14 @@ def run_sub(num_clay, all_well4_data, well_data_dates, mode,
 
         # Specific storage for clays, needed for DELAY CALCULATIONS
         # Inelastic (v) and elastic (e)
-        Sskv_cl = Sskv_data.loc[wellnest, clay_name]
-        Sske_cl = Sske_data.loc[wellnest, clay_name]
-        Sske_aqb = Sske_data.loc[wellnest, aq_nameb]
+        Sskv_cl = params.value("Sskv", wellnest, clay_name)
+        Sske_cl = params.value("Sske", wellnest, clay_name)
+        Sske_aqb = params.value("Sske", wellnest, aq_nameb)
 
         # Kv for clays (m/day)
         # Assuming Kv = Kh
         # Using Chula value for BK clay for all clay values as starting
-        Kv_cl = K_data.loc[wellnest, clay_name]
+        Kv_cl = params.value("K", wellnest, clay_name)
 
         # Number of clay layers
         nclay = 1
@@ -1844,8 +1849,7 @@ def run_sub(num_clay, all_well4_data, well_data_dates, mode,
         # to get clay heads to where they need to be
         if ic_run:
 
-            t_ic, h_ic = set_ic(headb, headt, i, mode, fullheadt,
-                                fullheadb, tmin, tmax, SS_data, wellnest,
+            t_ic, h_ic = set_ic(heads, i, mode, tmin, tmax, SS_data, wellnest,
                                 aq_namet, aq_nameb, Kv_cl, Sskv_cl, Sske_cl,
                                 Sske_aqt, Sske_aqb, CC, Nz, Thick_cl, nclay,
                                 Thick_aqt, Thick_aqb, Nt)
@@ -1877,15 +1881,8 @@ def run_sub(num_clay, all_well4_data, well_data_dates, mode,
                                  nclay=nclay, sandthickt=Thick_aqt,
                                  sandthickb=Thick_aqb,
                                  Nz=Nz, CC=CC, Nt=Nt)
-        # Well names
-        if mode == "Pastas":
-
-            # Getting well name from Pastas model file name
-            well_name = all_well4_data.columns[i-1]
-
-        elif mode == "raw":
-
-            well_name = well_data.columns[i-1]
+        # Well names (from Pastas model file name if Pastas)
+        well_name = heads.names[i-1]
 
         # Adds subsidence to total of all clay
         # Stores records as wellnest, well, data in list
@@ -1911,6 +1908,11 @@ def run_sub(num_clay, all_well4_data, well_data_dates, mode,
             all_results.append([wellnest, well_name,
                                 timet, headb.index, h, z])
 
+    # Contribution of each clay layer, from the model time steps just solved
+    if layer_stats is not None:
+        layer_stats.add_nest(wellnest, heads_dates.index[0],
+                             sub_total[-num_clay:], subv_total[-num_clay:])
+
     return sub_total, subv_total, all_results
 
 
@@ -1932,8 +1934,8 @@ def pastas_pump(model, pump_path, pump_sheet):
     model.del_stressmodel("well")  # Deletes previous pumping
 
     # Adds new pumping
-    EstTotPump = pd.read_excel(pump_path, sheet_name=pump_sheet, index_col=0,
-                               parse_dates=["Date"])
+    EstTotPump = bkk_cache.read_excel(pump_path, sheet_name=pump_sheet,
+                                      index_col=0, parse_dates=["Date"])
     EstTotPump_ = ps.StressModel(EstTotPump.Pump, rfunc=ps.Gamma(), name="well",
                                  settings="well", up=False)
     model.add_stressmodel(EstTotPump_)
@@ -1950,20 +1952,93 @@ def pastas_pump(model, pump_path, pump_sheet):
 # Runs Pastas and subsidence models and saves data
 ##############################################################################
 
+def subsidence_key(wellnestlist, mode, tmin, tmax, params, CC, Nz, ic_run,
+                   proxyflag, pumpflag, model_path=None, pump_path=None,
+                   pump_sheet=None, pump_series=None, initoptiparam=None,
+                   head_archive=None, resample_daily=True, obs_store=None):
+    """Cache key of a bkk_subsidence run: hash of everything it depends on.
+
+    Same arguments as bkk_subsidence. The key changes if the heads (observation
+    sheets, observations in the store used up to the end of tmax, or Pastas
+    models, pumping and window), clay parameters, land surface and steady
+    state heads, settings (CC, Nz, ic_run, proxyflag, resample_daily), the
+    Pastas version or the code of this module or of main_functions change
+
+    Returns
+    key - (str) hex digest
+    """
+    inputs_path = os.path.abspath("inputs")
+
+    # Code, Pastas version and settings
+    parts = [bkk_cache.CACHE_VERSION, ps.__version__,
+             bkk_cache.hash_file(__file__), bkk_cache.hash_file(mfs.__file__),
+             str(mode), str(tmin), str(tmax), repr(CC), str(Nz),
+             str(bool(ic_run)), str(proxyflag), str(resample_daily)]
+
+    # Clay and aquifer parameters (with sensitivity factors)
+    parts.extend([bkk_cache.hash_series(params.frame(param))
+                  for param in PARAMETERS])
+
+    # Land surface and steady state heads
+    parts.append(bkk_cache.hash_file(os.path.join(
+        inputs_path, "LandSurfElev_GWWellLocs.xlsx")))
+    if ic_run:
+        parts.append(bkk_cache.hash_file(os.path.join(
+            inputs_path, "SS_Head_GWWellLocs.xlsx")))
+
+    # Heads of each well nest
+    if mode == "Pastas":
+        catalog = bkk_catalog.load_catalog(models_path=model_path)
+        if head_archive is not None:
+            parts.append(head_archive.index["sources"])
+
+    for wellnest in wellnestlist:
+
+        parts.append(wellnest)
+
+        # Observed heads
+        if mode == "raw":
+
+            # Observations in the store used up to the end of tmax; later
+            # ingests do not change the key
+            if obs_store is not None and wellnest in obs_store:
+                parts.append(obs_store.window_key(wellnest, tmax))
+            else:
+                parts.append(bkk_cache.hash_file(os.path.join(
+                    inputs_path, wellnest + ".xlsx")))
+
+        # Pastas models, pumping and window of the simulated heads
+        else:
+
+            for modelfile in catalog.model_files(wellnest):
+
+                parts.append(bkk_cache.head_key(
+                    os.path.join(model_path, modelfile), "1950", tmax, 365*30,
+                    pumpflag, re.search("_(.*)_GW", modelfile).group(1),
+                    pump_series=pump_series, pump_path=pump_path,
+                    pump_sheet=pump_sheet, initoptiparam=initoptiparam))
+
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+
 # Assuming has data for all four aquifers
 # Assuming conceptual model of clay above BK, between BK and PD, PD and NL, NL
 # and NB for a total of 4 clay layers.
 def bkk_subsidence(wellnestlist, mode, tmin, tmax,
-                   Thick_data, K_data, Sskv_data, Sske_data, CC, Nz, ic_run,
+                   params, CC, Nz, ic_run,
                    proxyflag, pumpflag, model_path=None, pump_path=None,
                    pump_sheet=None, pump_series=None,
-                   initoptiparam=None,):
+                   initoptiparam=None, head_cache=None, head_archive=None,
+                   warmup_cache=None, resample_daily=True, obs_store=None,
+                   run_cache=None, layer_stats=None):
     """Calculate sub for four clay layers and four confined aquifers.
 
     wellnestlist - list of wellnest to calculate subsidence for
     mode - raw groundwater data or time series from pastas (raw needs to
     to be interpolated). options: raw, pastas
     tmin, tmax - (str) minimum and maximum year to calculate sub
+    params - SubParameters of the clays and aquifers (load_parameters, or
+    SubParameters.from_frames(Thick_data, K_data, Sskv_data, Sske_data))
     CC - convergence criteria
     Nz - number of nodes in the z direction
     ic_run - True or false to generate initial condition run for clays
@@ -1972,12 +2047,23 @@ def bkk_subsidence(wellnestlist, mode, tmin, tmax,
     model_path - path to python models
     pump_path - path to pumping excel sheet
     pump_sheet - sheet of specific pumping scenario
+    head_cache - bkk_cache.HeadCache of Pastas simulated heads; if all heads of
+    a well nest are cached, its Pastas models are not loaded or simulated
+    head_archive - bkk_archive.HeadArchive of daily heads for each pumping sheet
+    written by the Pastas stage; read instead of simulating
+    warmup_cache - bkk_cache.WarmupCache; warmup contributions of the Pastas
+    models are reused between pumping scenarios
+    resample_daily - raw mode only; if False, observed heads are not resampled
+    to every day, only interpolated to the observation dates and the end of
+    each year (results are then at those dates)
+    obs_store - raw mode only; bkk_ingest.ObservationStore of ingested TGMS
+    observations, used instead of the well nest excel files
+    run_cache - bkk_cache.RunCache; if a run with the same inputs
+    (subsidence_key) was saved, its results are returned, otherwise the results
+    are saved
+    layer_stats - LayerStats; contribution of each clay layer of each well
+    nest is added as it is solved (or from the cached run)
 
-    The data sets have specific names for clays and aquifers
-    Thick_data - thickness of clay and aquifers
-    K_data - vertical hydraulic conductivity of clay and aquifers
-    Sskv - inelastic specific storage term
-    Sske - elastic specific storage term
     Returns
     all_total - list of lists: all subsidence data (total and inelastic) for
     # each clay layer
@@ -1985,6 +2071,28 @@ def bkk_subsidence(wellnestlist, mode, tmin, tmax,
     subv_total - list of lists: inelastic sub total for all four clay layers
     # (m)
     """
+    # If a run with the same inputs is cached
+    if run_cache is not None:
+
+        run_key = subsidence_key(wellnestlist, mode, tmin, tmax, params, CC,
+                                 Nz, ic_run, proxyflag, pumpflag,
+                                 model_path=model_path, pump_path=pump_path,
+                                 pump_sheet=pump_sheet,
+                                 pump_series=pump_series,
+                                 initoptiparam=initoptiparam,
+                                 head_archive=head_archive,
+                                 resample_daily=resample_daily,
+                                 obs_store=obs_store)
+        results = run_cache.load(run_key)
+
+        if results is not None:
+            run_cache.report()
+
+            if layer_stats is not None:
+                layer_stats.add_run(*results)
+
+            return results
+
     # Preallocation
     # Head time series for each  node
     all_results = []
@@ -2000,10 +2108,10 @@ def bkk_subsidence(wellnestlist, mode, tmin, tmax,
                                  "LandSurfElev_GWWellLocs.xlsx")
 
     # Each well nest has its own Ss and K sheet
-    landsurf_data = pd.read_excel(landsurf_path,
-                                  sheet_name="2.1",
-                                  usecols="C:F",
-                                  index_col=0)
+    landsurf_data = bkk_cache.read_excel(landsurf_path,
+                                         sheet_name="2.1",
+                                         usecols="C:F",
+                                         index_col=0)
 
     # If running transient simulation before model run
     # to get clay heads to where they need to be
@@ -2013,9 +2121,14 @@ def bkk_subsidence(wellnestlist, mode, tmin, tmax,
                                "SS_Head_GWWellLocs.xlsx")
 
         # Each well nest has its own Ss and K sheet
-        SS_data = pd.read_excel(SS_path,
-                                sheet_name="SS_Py",
-                                index_col=0)
+        SS_data = bkk_cache.read_excel(SS_path,
+                                       sheet_name="SS_Py",
+                                       index_col=0)
+
+    # Pastas model files of each well nest
+    if mode == "Pastas":
+
+        catalog = bkk_catalog.load_catalog(models_path=model_path)
 
     # For each well nest in the list
     for wellnest in wellnestlist:
@@ -2023,67 +2136,76 @@ def bkk_subsidence(wellnestlist, mode, tmin, tmax,
         # If calculating subsidence from raw groundwater data
         if mode == "raw":
 
-            # Preprocesses wellnest groundwater data and returns dataframe
-            # with data of matching dates after interpolation
-            # Returns data within tmin and tmax in well_data, and data not
-            # within tmin and tmax in all_well_data
-            well_data, all_well_data = bkk_wellnest_preproc(wellnest,
-                                                            tmin, tmax,
-                                                            proxyflag)
+            # Preprocesses wellnest groundwater data and returns heads
+            # of all dates after interpolation
+            heads = bkk_wellnest_preproc(wellnest, tmin, tmax, proxyflag,
+                                         resample_daily=resample_daily,
+                                         obs_store=obs_store)
 
             # Correcting obs GW to land surface
-            well_data += (landsurf_data.RASTERVALU.loc[wellnest])
-            all_well_data += (landsurf_data.RASTERVALU.loc[wellnest])
+            heads += (landsurf_data.RASTERVALU.loc[wellnest])
 
             # Number clay layers
-            num_clay = len(well_data.columns)
+            num_clay = len(heads)
 
         elif mode == "Pastas":
 
             # Get Pastas model file names for each wellnest (Should have four
-            # files for each aquifer)
-            Pastasfiles = [filename for filename in os.listdir(model_path)
-                           if filename.startswith(wellnest) &
-                           filename.endswith(".pas")]
-
-            # Reordering from shallowest to deepest aquifer
-            # Reorder well list to shallow to deep aquifers
+            # files for each aquifer), from shallowest to deepest aquifer
             # BK, PD, NL, NB
-            Pastasfiles = [x for y in ["_BK", "_PD", "_NL", "_NB"]
-                           for x in Pastasfiles if y in x]
+            Pastasfiles = catalog.model_files(wellnest)
             lenfiles = len(Pastasfiles)
 
-            # Loading models for good
-            models, well_names, pastas_optparam = load_Pastas_models(
-                Pastasfiles, model_path)
-
-            well_data_dates, \
-                all_well4_data = load_Pastas(Pastasfiles,
-                                             lenfiles,
-                                             proxyflag, models,
-                                             well_names,
-                                             model_path,
-                                             pumpflag,
-                                             tmin, tmax,
-                                             initoptiparam=initoptiparam,
-                                             pump_path=pump_path,
-                                             pump_sheet=pump_sheet,
-                                             pump_series=pump_series
-                                             )
+            # If caching heads, models only loaded if heads not cached
+            if head_cache is not None or head_archive is not None:
+
+                models = [None] * lenfiles
+                well_names = [re.search("_(.*)_GW", s).group(1)
+                              for s in Pastasfiles]
+
+            else:
+
+                # Loading models for good
+                models, well_names, pastas_optparam = load_Pastas_models(
+                    Pastasfiles, model_path)
+
+            heads = load_Pastas(Pastasfiles,
+                                lenfiles,
+                                proxyflag, models,
+                                well_names,
+                                model_path,
+                                pumpflag,
+                                tmin, tmax,
+                                initoptiparam=initoptiparam,
+                                pump_path=pump_path,
+                                pump_sheet=pump_sheet,
+                                pump_series=pump_series,
+                                head_cache=head_cache,
+                                head_archive=head_archive,
+                                warmup_cache=warmup_cache
+                                )
 
             num_clay = 4
 
         sub_total, subv_total, all_results = run_sub(num_clay,
-                                                     all_well4_data,
-                                                     well_data_dates, mode,
+                                                     heads, mode,
                                                      tmin, tmax, SS_data,
-                                                     wellnest,
-                                                     K_data, Sskv_data,
-                                                     Sske_data,
-                                                     CC, Nz, Thick_data,
-                                                     ic_run,
+                                                     wellnest, params,
+                                                     CC, Nz, ic_run,
                                                      sub_total, subv_total,
-                                                     all_results)
+                                                     all_results,
+                                                     layer_stats=layer_stats)
+
+    # Cache statistics
+    if head_cache is not None:
+        head_cache.report()
+    if warmup_cache is not None:
+        warmup_cache.report()
+
+    # Saving the run
+    if run_cache is not None:
+        run_cache.save(run_key, (all_results, sub_total, subv_total))
+        run_cache.report()
 
     # Returns heads in clay nodes, z dist, cum sub time series for each well,
     # cum inelastic sub time series for each well, original time step
@@ -2094,10 +2216,175 @@ def bkk_subsidence(wellnestlist, mode, tmin, tmax,
 # Post processes data
 ##############################################################################
 
+def interp_rows(x, xp, fp):
+    """np.interp of many rows at once.
+
+    x - array (row, time) of times to interpolate to
+    xp - array (row, model time) of increasing model times
+    fp - array (row, model time) of values at the model times
+
+    Returns
+    values - array (row, time), as np.interp of each row
+    """
+    rows = np.arange(len(x))[:, None]
+    n = xp.shape[1]
+
+    # Interval of each time; rows with the same model and original times
+    # (all clay layers of a run, usually) are searched once
+    j = np.empty(x.shape, dtype=int)
+    searched = {}
+    for row in range(len(x)):
+        key = (xp[row].tobytes(), x[row].tobytes())
+        if key not in searched:
+            searched[key] = np.clip(np.searchsorted(xp[row], x[row],
+                                                    side="right") - 1,
+                                    0, n - 2)
+        j[row] = searched[key]
+
+    # Linear interpolation in the interval, the same operations as np.interp
+    # (slopes of the model intervals first)
+    slopes = (fp[:, 1:] - fp[:, :-1]) / (xp[:, 1:] - xp[:, :-1])
+    fp0 = np.take_along_axis(fp, j, axis=1)
+    dx = x - np.take_along_axis(xp, j, axis=1)
+    slope = np.take_along_axis(slopes, j, axis=1)
+    values = slope * dx + fp0
+    if np.isnan(values).any():
+        fp1 = np.take_along_axis(fp, j + 1, axis=1)
+        xp1 = np.take_along_axis(xp, j + 1, axis=1)
+        np.copyto(values, slope * (x - xp1) + fp1, where=np.isnan(values))
+
+    # At the model times and outside of them
+    np.copyto(values, fp0, where=dx == 0)
+    np.copyto(values, np.broadcast_to(fp[:, :1], x.shape),
+              where=x < xp[:, :1])
+    np.copyto(values, np.broadcast_to(fp[:, -1:], x.shape),
+              where=x >= xp[:, -1:])
+
+    return values
+
+
+def postproc_arrays(wellnestlist, sub_total, subv_total, all_results):
+    """Results of all well nests as (well nest, clay layer, time) arrays,
+    reinterpolated to the original dates, and the annual subsidence of all well
+    nests as one dataframe. Inputs are not changed.
+
+    wellnestlist - list of wellnest to calculate subsidence for
+    sub_total - list of lists: wellnest, well, interp t, cum sub results (m)
+    subv_total - list of lists: wellnest, well, interp t, cum sub inelastic
+    results (m)
+    all_results - lists of lists: wellnest, well, time original, date, ...
+    (same clay layers per well nest, shallow to deep)
+
+    Returns
+    results - dictionary of
+    layers - well names of the clay layers (well nest, layer)
+    dates - original dates (well nest, time), NaT after the last date of well
+    nests with fewer dates
+    length - number of original dates of each well nest
+    sub, subv - cum sub total and inelastic at the original dates (m)
+    (well nest, layer, time)
+    total - cum sub of all clay layers (m) (well nest, time)
+    annual - dataframe of nest (index in wellnestlist), wellnest, date,
+    CumTotSum, year and AnnRates, the annual cum sub and rates of all well
+    nests (m), as the annual dataframes of bkk_postproc
+    avg_sub_perc - average fraction of subsidence from each clay layer
+    (well nest, layer)
+    """
+    num_nest = len(wellnestlist)
+    num_layer = len(all_results) // num_nest
+
+    # Original and model time of each layer, padded with NaN to the longest
+    length = np.array([len(all_results[num_well*num_layer][2])
+                       for num_well in range(num_nest)])
+    T = length.max()
+    T_model = max(len(row[2]) for row in sub_total)
+
+    t_og = np.full((num_nest, T), np.nan)
+    dates = np.full((num_nest, T), np.datetime64("NaT"),
+                    dtype="datetime64[ns]")
+    for num_well in range(num_nest):
+        t_og[num_well, :length[num_well]] = all_results[num_well*num_layer][2]
+        dates[num_well, :length[num_well]] = \
+            all_results[num_well*num_layer][3]
+
+    # Model times (item 2) and cum sub (item 3) of each layer, padded to the
+    # longest; padded model times are infinite so the last value is kept
+    def stack_model(rows, item):
+        values = np.empty((len(rows), T_model))
+        for i, row in enumerate(rows):
+            values[i, :len(row[item])] = row[item]
+            values[i, len(row[item]):] = np.inf if item == 2 else row[item][-1]
+        return values
+
+    # Reinterpolated to original time series, all layers at once
+    x = np.repeat(t_og, num_layer, axis=0)
+    valid = np.arange(T) < length[:, None]
+    sub = interp_rows(x, stack_model(sub_total, 2), stack_model(sub_total, 3))
+    subv = interp_rows(x, stack_model(subv_total, 2),
+                       stack_model(subv_total, 3))
+    sub = np.where(valid[:, None], sub.reshape(num_nest, num_layer, T), np.nan)
+    subv = np.where(valid[:, None], subv.reshape(num_nest, num_layer, T),
+                    np.nan)
+
+    # Cum total sub of all clay layers
+    total = np.sum(sub, axis=1)
+
+    # Dec 31 of each year: the next day is in another year
+    years = dates.astype("datetime64[Y]")
+    dec31 = valid & (years != (dates + np.timedelta64(1, "D")).astype(
+        "datetime64[Y]"))
+    nest_id, pos = np.nonzero(dec31)
+
+    # # IMPORTANT INFO
+    # # For benchmark measurements, the first year is 0, the second year is
+    # # the compaction rate over that first year.
+    # # For implicit Calc, the first year has a compaction rate over that
+    # # year, so need to move Implicit values down one to match benchmark
+    # # measurements.
+    # First data value is the previous year at 0 compaction, and each value is
+    # at the end of the year before
+    first = np.flatnonzero(np.r_[True, nest_id[1:] != nest_id[:-1]])
+    last = np.r_[first[1:], len(nest_id)] - 1
+    prev_dec31 = years[nest_id, pos].astype(dates.dtype) - \
+        np.timedelta64(1, "D")
+    annual_dates = np.insert(prev_dec31, last + 1, dates[nest_id[last],
+                                                         pos[last]])
+    cum = np.insert(total[nest_id, pos], first, 0.)
+    year = np.insert(years[nest_id, pos].astype(int) + 1970., first, 0.)
+    rows = np.insert(nest_id, first, nest_id[first])
+
+    # Adding annual rates
+    rates = np.diff(cum, prepend=np.nan)
+    rates[first + np.arange(len(first))] = np.nan
+
+    annual = pd.DataFrame({"nest": rows,
+                           "wellnest": np.asarray(wellnestlist)[rows],
+                           "date": annual_dates,
+                           "CumTotSum": cum,
+                           "year": year,
+                           "AnnRates": rates})
+
+    # Looking at sub percentages for each well
+    perc = sub[:, :, 1:] / total[:, None, 1:]
+    if np.all(length == T):
+        avg_sub_perc = np.average(perc, axis=2)
+    else:
+        avg_sub_perc = np.nanmean(perc, axis=2)
+
+    layers = np.array([row[1] for row in all_results],
+                      dtype=object).reshape(num_nest, num_layer)
+
+    return {"layers": layers, "dates": dates, "length": length, "sub": sub,
+            "subv": subv, "total": total, "annual": annual,
+            "avg_sub_perc": avg_sub_perc}
+
+
 # Need to downsample sub data into daily
 def bkk_postproc(wellnestlist, sub_total, subv_total, all_results):
     """Take results of calcs, cleans it, reinterpolates to original date.
 
+    Inputs are not changed; new lists are returned (see postproc_arrays for the
+    results as arrays).
     wellnestlist - list of wellnest to calculate subsidence for
     sub_total - list of lists: wellnest, well, interp t, cum sub results (m)
     subv_total - list of lists: wellnest, well, interp t, cum sub inelastic
@@ -2117,85 +2404,31 @@ def bkk_postproc(wellnestlist, sub_total, subv_total, all_results):
     avg_sub_perc - lists of lists of average subsidence percentage for each well
     from total subsidence across all time steps
     """
-    # Preallocation
-    # Saves annual total sub for all 4 clay for all wellnests
-    annual_data_all = []
+    results = postproc_arrays(wellnestlist, sub_total, subv_total,
+                              all_results)
+    num_layer = results["sub"].shape[1]
 
-    # Saves sub percentage from each well
-    avg_sub_perc = []
-
-    # For each well nest in the list
-    # num_well is the index, wellnest = name
+    # Reinterpolated cum sub added as [4] of copies of the lists
+    sub_new, subv_new, avg_sub_perc = [], [], []
     for num_well, wellnest in enumerate(wellnestlist):
+        for i in range(num_layer):
+
+            T = results["length"][num_well]
+            sub_new.append(sub_total[num_well*num_layer+i][:4] +
+                           [results["sub"][num_well, i, :T]])
+            subv_new.append(subv_total[num_well*num_layer+i][:4] +
+                            [results["subv"][num_well, i, :T]])
+            avg_sub_perc.append([wellnest, i,
+                                 results["avg_sub_perc"][num_well, i]])
+
+    # Annual data of each well nest
+    annual_data_all = []
+    for num_well, annual_data in results["annual"].groupby("nest"):
+
+        annual_data = annual_data.set_index("date")[["CumTotSum", "year",
+                                                     "AnnRates"]]
+        annual_data.index = pd.DatetimeIndex(annual_data.index.values)
+        annual_data_all.append([wellnestlist[num_well], annual_data])
 
-        # Total sub for all 4 clay for one wellnest
-        # Resets after one well nest completed
-        cumsum_4cl = np.zeros([4, len(all_results[num_well*4][2])])
-
-        # Assumes four wells for each wellnest
-        # For each well in each wellnest
-        # num_well*4+i guarantees well indexing within each well nest
-        for i in range(4):
-
-            # time original (original time series (0:len(date)))
-            t_og = all_results[num_well*4+i][2]
-
-            # Reinterpolated to original time series
-            # [2] has the model time series, [3] has the cum sub results
-            sub_total[num_well*4+i].append(np.interp(t_og,
-                                                     sub_total[num_well*4+i][2],
-                                                     sub_total[num_well*4+i][3]))
-
-            # Adding this new interpolation to cum_sum4cl
-            # Each i for each well in one well nest
-            cumsum_4cl[i] += sub_total[num_well*4+i][4]
-
-            # Reinterpolated to original time series
-            # [2] has the model time series, [3] has the cum sub results
-            subv_total[num_well*4+i].append(np.interp(t_og,
-                                                      subv_total[num_well*4+i][2],
-                                                      subv_total[num_well*4+i][3]))
-
-        #  original date series
-        date = all_results[num_well*4][3]
-        # For each well nest, creating new data frame for the cum total sub sum
-        df_data = {"Date": date, "CumTotSum": np.sum(cumsum_4cl, axis=0)}
-        df = pd.DataFrame(df_data,
-                          columns=["Date", "CumTotSum"],
-                          index=date)
-        df["month"] = df.index.month
-        df["day"] = df.index.day
-
-        # Resampling to each year
-        annual_data = df.CumTotSum[(df["month"] == 12) &
-                                   (df["day"] == 31)].to_frame()
-        annual_data["year"] = annual_data.index.year
-
-        # # IMPORTANT INFO
-        # # For benchmark measurements, the first year is 0, the second year is
-        # # the compaction rate over that first year.
-        # # For implicit Calc, the first year has a compaction rate over that
-        # # year, so need to move Implicit values down one to match benchmark
-        # # measurements.
-        # # Index has the right years
-        # First data value is the previous year at 0 compaction
-        # Adds an extra year to the end
-        annual_data.loc[annual_data.index[-1] + pd.offsets.DateOffset(years=1)] = 0
-        annual_data = annual_data.shift(1)  # Shifts all values down one year
-        annual_data.iloc[0] = 0  # Sets first value as 0
-        annual_data.index = annual_data.index.shift(-12, freq="M")
-
-        # Adding annual rates
-        annual_data["AnnRates"] = annual_data.CumTotSum.diff()
-
-        # Saving annual data for all well nests
-        annual_data_all.append([wellnest, annual_data])
-
-        # Looking at sub percentages for each well
-        all_clay = np.sum(cumsum_4cl, axis=0)
-        for j in range(4):
-            avg_sub_perc.append([wellnest, j,
-                                 (np.average(np.divide(cumsum_4cl[j, 1:],
-                                                       all_clay[1:])))])
     # Returning
-    return sub_total, subv_total, annual_data_all, avg_sub_perc
+    return sub_new, subv_new, annual_data_all, avg_sub_perc
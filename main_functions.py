@@ -18,14 +18,34 @@ TU Delft
 # import statements
 import pandas as pd
 import numpy as np
-import datetime
 import matplotlib.pyplot as plt
-import datetime as dt
 
 # Closing all figures
 plt.close("all")
 
 
+###############################################################################
+###############################################################################
+###############################################################################
+
+# Function to convert dates from the TGMS portal to english dates
+def Thai_Dates(dates):
+    # # Inputs:
+    # Series of dates as dd/mm/yyyy strings with thai years
+    # # Outputs:
+    # Series of english dates
+
+    # Splitting day, month and thai year from dd/mm/yyyy for all dates at once
+    # (leap days are valid in english years but not always in thai years)
+    date_parts = dates.astype(str).str.extract(
+        r"^(\d{1,2})/(\d{1,2})/(\d{4})")
+
+    # Thai years - 543 = english years
+    return pd.to_datetime(pd.DataFrame({"Year": date_parts[2].astype(int) - 543,
+                                        "Month": date_parts[1].astype(int),
+                                        "Day": date_parts[0].astype(int)}))
+
+
 ###############################################################################
 ###############################################################################
 ###############################################################################
@@ -54,44 +74,8 @@ def GW_Data_Process(GW_Data, well_name=None):
     df_data.Date = df_data["Date"].astype(str)
 
     # Reformating date from thai years to english years
-    len_head = len(df_data.iloc[:, 1])
-    date_list = []
-    df_data["Year"] = np.nan
-    df_data["Month"] = np.nan
-    df_data["Day"] = np.nan
-
-    # For each data point
-    for i in range(len_head):
-
-        # Current date
-        date = df_data.Date.loc[i]
-
-        # If leap day
-        if date[0:2] == "29" and date[3:5] == "02":
-
-            # Thai years - 543 = english years
-            df_data.Year.loc[i] = int(date[6:10]) - 543
-            df_data.Month.loc[i] = int(date[3:5])
-            df_data.Day.loc[i] = int(date[0:2])
-
-            # Converting to date time format
-            date_list.append(dt.datetime.strptime(str(df_data.Day.loc[i]).replace(
-                ".0", "") + "/" +
-                str(df_data.Month.loc[i]).replace(".0", "") +
-                "/" + str(df_data.Year.loc[i]).replace(".0", ""),
-                "%d/%m/%Y").date())
-
-        # If not a leap date
-        else:
-
-            # Converting to date time format
-            date_list.append(dt.datetime.strptime(date, "%d/%m/%Y %M:%S").date())
-            df_data.Year.loc[i] = (date_list[i].year) - 543
-            df_data.Month.loc[i] = (date_list[i].month)
-            df_data.Day.loc[i] = (date_list[i].day)
-
     # Saving new english date
-    df_data["EngDate"] = pd.to_datetime(df_data[["Year", "Month", "Day"]])
+    df_data["EngDate"] = Thai_Dates(df_data.Date)
 
     # If individual well name given
     if well_name is not None: